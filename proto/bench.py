@@ -0,0 +1,413 @@
+#! /usr/bin/env python
+"""Benchmark program.
+
+By default, synthetic memory maps of various shapes are generated and each
+stage of the generation pipeline is timed.  The results are written in
+JSON, so that they can be compared between releases."""
+import sys
+import os
+import glob
+import time
+import json
+import shutil
+import platform
+import argparse
+import tempfile
+import cheby
+import cheby.parser as parser
+import cheby.layout as layout
+import cheby.cprint as cprint
+import cheby.compiled as compiled
+import cheby.expand_hdl as expand_hdl
+import cheby.gen_name as gen_name
+import cheby.gen_hdl as gen_hdl
+import cheby.hdltree as hdltree
+import cheby.gen_gena_memmap as gen_gena_memmap
+import cheby.gen_gena_regctrl as gen_gena_regctrl
+import cheby.print_vhdl as print_vhdl
+import cheby.print_verilog as print_verilog
+
+srcdir = '../testfiles/'
+
+
+class Shape(object):
+    """Shape of a synthetic memory map:
+       REGS registers of WIDTH bits with FIELDS fields, in DEPTH levels of
+       nested blocks, an (unrolled) array of REPEAT registers (if not 0) and
+       SUBMAPS instances of a submap of SUBMAP_REGS registers."""
+    names = ['regs', 'width', 'fields', 'depth', 'repeat', 'submaps',
+             'submap_regs']
+
+    def __init__(self, regs=100, width=32, fields=2, depth=0, repeat=0,
+                 submaps=0, submap_regs=16):
+        self.regs = regs
+        self.width = width
+        self.fields = fields
+        self.depth = depth
+        self.repeat = repeat
+        self.submaps = submaps
+        self.submap_regs = submap_regs
+
+    def as_dict(self):
+        return dict([(n, getattr(self, n)) for n in self.names])
+
+    def name(self):
+        return '-'.join(['{}{}'.format(n, getattr(self, n))
+                         for n in self.names
+                         if (n != 'submap_regs' or self.submaps)
+                         and (n != 'width' or self.width != 32)])
+
+
+def gen_reg(fd, indent, name, rwidth, nfields):
+    """Write register NAME of RWIDTH bits with NFIELDS fields."""
+    fd.write(indent + '- reg:\n')
+    fd.write(indent + '    name: {}\n'.format(name))
+    fd.write(indent + '    description: register {}\n'.format(name))
+    fd.write(indent + '    width: {}\n'.format(rwidth))
+    fd.write(indent + '    access: rw\n')
+    if nfields == 0:
+        return
+    assert nfields <= rwidth
+    fd.write(indent + '    children:\n')
+    width = rwidth // nfields
+    for i in range(nfields):
+        fd.write(indent + '    - field:\n')
+        fd.write(indent + '        name: f{}\n'.format(i))
+        if width == 1:
+            fd.write(indent + '        range: {}\n'.format(i))
+        else:
+            fd.write(indent + '        range: {}-{}\n'.format(
+                (i + 1) * width - 1, i * width))
+
+
+def gen_map_file(filename, name, shape, submap_filename=None):
+    with open(filename, 'w') as fd:
+        fd.write('memory-map:\n')
+        fd.write('  name: {}\n'.format(name))
+        fd.write('  bus: wb-32-be\n')
+        fd.write('  children:\n')
+        indent = '  '
+        for i in range(shape.depth):
+            fd.write(indent + '- block:\n')
+            fd.write(indent + '    name: b{}\n'.format(i))
+            fd.write(indent + '    children:\n')
+            indent += '    '
+        for i in range(shape.regs):
+            gen_reg(fd, indent, 'r{}'.format(i), shape.width, shape.fields)
+        if shape.repeat:
+            fd.write(indent + '- array:\n')
+            fd.write(indent + '    name: arr\n')
+            fd.write(indent + '    repeat: {}\n'.format(shape.repeat))
+            # Not aligned, so that the array is unrolled by expand_hdl.
+            fd.write(indent + '    align: False\n')
+            fd.write(indent + '    children:\n')
+            gen_reg(fd, indent + '    ', 'areg', shape.width, shape.fields)
+        for i in range(shape.submaps):
+            fd.write(indent + '- submap:\n')
+            fd.write(indent + '    name: sub{}\n'.format(i))
+            fd.write(indent + '    filename: {}\n'.format(
+                os.path.basename(submap_filename)))
+
+
+def gen_map(dirname, shape):
+    """Write a synthetic memory map of shape SHAPE (and its submap) in
+       directory DIRNAME.  Return the filename of the map."""
+    filename = os.path.join(dirname, 'bench.cheby')
+    subname = os.path.join(dirname, 'bench_sub.cheby')
+    if shape.submaps:
+        gen_map_file(subname, 'bench_sub', Shape(regs=shape.submap_regs,
+                                                 width=shape.width,
+                                                 fields=shape.fields))
+    gen_map_file(filename, 'bench', shape, subname)
+    return filename
+
+
+def timeit(func, repeat=3):
+    """Return the best time (in seconds) of REPEAT calls to FUNC."""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def tree_size(n):
+    """Return the memory (in bytes) used by the nodes of the tree N
+       (without the values of the attributes)."""
+    res = sys.getsizeof(n)
+    # Note: this creates the (empty) dictionary of slotted instances.
+    d = getattr(n, '__dict__', None)
+    if d:
+        res += sys.getsizeof(d)
+    for c in getattr(n, 'children', []):
+        res += tree_size(c)
+    return res
+
+
+def pipeline(filename, st):
+    """Return the list of stages (name, required stage, function) to
+       generate all the files for FILENAME.  The functions must be
+       called in order.  The tree is stored in ST['tree']."""
+
+    def parse():
+        st['tree'] = parser.parse_yaml(filename)
+
+    def compile_tree():
+        st['compiled'] = compiled.compile_tree(st['tree'])
+
+    def gen_memmap():
+        gen_gena_memmap.gen_gena_memmap(st['tree'])
+
+    def gen_hdl_tree():
+        st['hdl'] = gen_hdl.generate_hdl(st['tree'])
+
+    def printer(p, name):
+        def run():
+            with open(os.devnull, 'w') as fd:
+                p(fd, st[name])
+        return run
+
+    return [
+        ('parse_yaml', None, parse),
+        ('layout_cheby', 'parse_yaml',
+         lambda: layout.layout_cheby(st['tree'])),
+        ('cprint', 'layout_cheby', printer(cprint.cprint_cheby, 'tree')),
+        ('compile_tree', 'layout_cheby', compile_tree),
+        ('load_compiled', 'compile_tree',
+         lambda: compiled.load_buffer(st['compiled'], filename)),
+        ('gena_memmap', 'layout_cheby', gen_memmap),
+        ('expand_hdl', 'layout_cheby',
+         lambda: expand_hdl.expand_hdl(st['tree'])),
+        ('gena_regctrl', 'gena_memmap',
+         lambda: gen_gena_regctrl.gen_gena_regctrl(st['tree'])),
+        ('gen_name_root', 'expand_hdl',
+         lambda: gen_name.gen_name_root(st['tree'])),
+        ('generate_hdl', 'gen_name_root', gen_hdl_tree),
+        ('print_vhdl', 'generate_hdl',
+         printer(print_vhdl.print_vhdl, 'hdl')),
+        ('print_verilog', 'generate_hdl',
+         printer(print_verilog.print_verilog, 'hdl'))]
+
+
+# Stages after which the size of the tree is measured.
+size_stages = ['layout_cheby', 'gen_name_root']
+
+
+def bench_stages(filename, runs=3):
+    """Run the pipeline RUNS times on FILENAME.  Return the best time of
+       each stage, the errors of the stages that failed (the stages
+       that depend on them are not run) and the size of the tree after
+       some stages."""
+    times = {}
+    errors = {}
+    sizes = {}
+    for i in range(runs):
+        failed = set()
+        st = {}
+        for name, req, func in pipeline(filename, st):
+            if req in failed:
+                failed.add(name)
+                continue
+            start = time.time()
+            try:
+                func()
+            except Exception as e:
+                failed.add(name)
+                errors[name] = '{}: {}'.format(type(e).__name__, e)
+                continue
+            t = time.time() - start
+            if name not in times or t < times[name]:
+                times[name] = t
+            if name in size_stages and name not in sizes:
+                sizes[name] = tree_size(st['tree'])
+    return times, errors, sizes
+
+
+def bench_shape(shape, runs=3):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = gen_map(tmpdir, shape)
+        times, errors, sizes = bench_stages(filename, runs)
+    finally:
+        shutil.rmtree(tmpdir)
+    return {'name': shape.name(),
+            'shape': shape.as_dict(),
+            'runs': runs,
+            'times': times,
+            'tree_bytes': sizes,
+            'errors': errors}
+
+
+default_shapes = [
+    Shape(regs=1000),
+    Shape(regs=1000, fields=32),
+    Shape(regs=1000, width=64, fields=64),
+    Shape(regs=10000, fields=1),
+    Shape(regs=100, depth=8),
+    Shape(regs=10, repeat=4096),
+    Shape(regs=10, submaps=256),
+]
+
+
+def bench_shapes(shapes, runs=3):
+    return {'cheby_version': cheby.__version__,
+            'python': platform.python_version(),
+            'benchmarks': [bench_shape(s, runs) for s in shapes]}
+
+
+def bench_yaml_backends(files, repeat=3):
+    backends = sorted(parser.yaml_loaders)
+    print('yaml backends (default: {}), times in ms'.format(
+        parser.yaml_backend))
+    print('{:<32} '.format('file') +
+          ' '.join(['{:>10}'.format(b) for b in backends]))
+    for f in files:
+        content = open(f, 'rb').read()
+        res = []
+        for b in backends:
+            t = timeit(lambda: parser.load_yaml(f, content, b), repeat)
+            res.append(t)
+        print('{:<32} '.format(os.path.basename(f)) +
+              ' '.join(['{:10.2f}'.format(t * 1000) for t in res]))
+
+
+def bench_parser(nregs):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = gen_map(tmpdir, Shape(regs=nregs))
+        # Big file: run only once.
+        bench_yaml_backends([filename], 1)
+        for name, events in [('parse_yaml', False),
+                             ('parse_yaml (events)', True)]:
+            print('{:<32} '.format(name) + ' '.join(
+                ['{:10.2f}'.format(1000 * timeit(
+                    lambda: parser.parse_yaml(filename, backend=b,
+                                              events=events), 1))
+                 for b in sorted(parser.yaml_loaders)]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_print(name, h, printers, repeat=3):
+    def run(p):
+        with open(os.devnull, 'w') as fd:
+            p(fd, h)
+    print('{:<32} '.format(name) + ' '.join(
+        ['{:10.2f}'.format(1000 * timeit(lambda: run(p), repeat))
+         for p in printers]))
+
+
+def bench_printers(gena_file, nregs):
+    """Time the HDL printers on the gena RegCtrl of GENA_FILE and on the
+       HDL of a synthetic map of NREGS registers."""
+    print('hdl printers, times in ms')
+    print('{:<32} {:>10} {:>10}'.format('', 'vhdl', 'verilog'))
+    t = parser.parse_yaml(gena_file)
+    layout.layout_cheby(t)
+    gen_gena_memmap.gen_gena_memmap(t)
+    expand_hdl.expand_hdl(t)
+    h = gen_gena_regctrl.gen_gena_regctrl(t)
+    bench_print(os.path.basename(gena_file), h, [print_vhdl.print_vhdl])
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = gen_map(tmpdir, Shape(regs=nregs))
+        t = parser.parse_yaml(filename)
+        layout.layout_cheby(t)
+        expand_hdl.expand_hdl(t)
+        gen_name.gen_name_root(t)
+        h = gen_hdl.generate_hdl(t)
+        bench_print('regs{}'.format(nregs), h,
+                    [print_vhdl.print_vhdl, print_verilog.print_verilog])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def gen_hdl_module(n):
+    """Return a synthetic HDL module with N processes, using most of the
+       kinds of HDL nodes."""
+    m = hdltree.HDLModule('bench')
+    clk = m.add_port('clk_i')
+    rst = m.add_port('rst_n_i')
+    adr = m.add_port('adr_i', 32)
+    for i in range(n):
+        d = m.add_port('d{}_i'.format(i), 32)
+        q = m.add_port('q{}_o'.format(i), 32, dir='OUT')
+        r = hdltree.HDLSignal('r{}'.format(i), 32)
+        m.decls.append(r)
+        m.stmts.append(hdltree.HDLComment('Process {}'.format(i)))
+        proc = hdltree.HDLSync(clk, rst)
+        proc.rst_stmts.append(hdltree.HDLAssign(
+            r, hdltree.HDLReplicate(hdltree.bit_0, 32)))
+        sw = hdltree.HDLSwitch(hdltree.HDLSlice(adr, 2, 4))
+        for v in range(4):
+            ch = hdltree.HDLChoiceExpr(hdltree.HDLConst(v, 4))
+            ch.stmts.append(hdltree.HDLAssign(
+                hdltree.HDLSlice(r, 8 * v, 8),
+                hdltree.HDLSlice(d, 8 * v, 8)))
+            sw.choices.append(ch)
+        sw.choices.append(hdltree.HDLChoiceDefault())
+        cond = hdltree.HDLAnd(hdltree.HDLEq(hdltree.HDLIndex(adr, 0),
+                                            hdltree.bit_1),
+                              hdltree.HDLNot(hdltree.HDLIndex(adr, 1)))
+        ifs = hdltree.HDLIfElse(cond)
+        ifs.then_stmts.append(sw)
+        ifs.else_stmts.append(hdltree.HDLAssign(
+            r, hdltree.HDLConcat(hdltree.HDLSlice(r, 0, 16),
+                                 hdltree.HDLHexConst(i & 0xffff, 16))))
+        proc.sync_stmts.append(ifs)
+        m.stmts.append(proc)
+        m.stmts.append(hdltree.HDLAssign(q, r))
+    return m
+
+
+def bench_tables():
+    bench_yaml_backends(sorted(glob.glob(srcdir + '*.yaml')))
+    print('')
+    bench_parser(10000)
+    print('')
+    bench_printers(srcdir + 'gena/Area_CRegs_Regs_Mems.cheby', 2000)
+    bench_print('synthetic module (5000)', gen_hdl_module(5000),
+                [print_vhdl.print_vhdl, print_verilog.print_verilog])
+
+
+def main():
+    aparser = argparse.ArgumentParser(description='cheby benchmarks')
+    for n in Shape.names:
+        aparser.add_argument('--' + n.replace('_', '-'), type=int,
+                             help='{} of the synthetic map'.format(n))
+    aparser.add_argument('--runs', type=int, default=3,
+                         help='number of runs (the best time is reported)')
+    aparser.add_argument('-o', '--output',
+                         help='write the JSON results to this file')
+    aparser.add_argument('--tables', action='store_true',
+                         help='display the yaml backends and printers tables')
+    args = aparser.parse_args()
+
+    if args.tables:
+        bench_tables()
+        return
+    shape = Shape()
+    custom = False
+    for n in Shape.names:
+        v = getattr(args, n)
+        if v is not None:
+            setattr(shape, n, v)
+            custom = True
+    if shape.fields > shape.width:
+        aparser.error('--fields must not be greater than --width')
+    res = bench_shapes([shape] if custom else default_shapes, args.runs)
+    if args.output is None:
+        json.dump(res, sys.stdout, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as fd:
+            json.dump(res, fd, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,8 +8,10 @@ import cheby.parser
 import cheby.tree as tree
 import cheby.pprint as pprint
 import cheby.layout
+import cheby.timing
 
 connection = None
+timer = cheby.timing.NullTimer()
 
 class Buffer(object):
     def __init__(self):
@@ -214,7 +216,8 @@ def compute_fileset(filename):
       # Add it to deps, load it.
       de = DepEntry(filename)
       deps[basename] = de
-      de.node = cheby.parser.parse_yaml(de.filename)
+      with timer.stage('parse_yaml'):
+         de.node = cheby.parser.parse_yaml(de.filename)
       de.node.c_filename = filename
       # Update todo with submaps.
       submaps = extract_submaps(de.node)
@@ -264,7 +267,8 @@ def upload_files(cmd_name, *args):
       de.fid = rows[0][0]
       # Add file
       buf = Buffer()
-      pprint.pprint_cheby(buf, de.node)
+      with timer.stage('pprint'):
+         pprint.pprint_cheby(buf, de.node)
       cursor.execute(
          """INSERT INTO cheby_files
             (file_id, file_name, namespace_id, file_content)
@@ -340,10 +344,13 @@ def bad_cmd(cmd_name, *args):
 
 def main():
    global connection
+   global timer
 
    parser = argparse.ArgumentParser(description='CCDB/Cheby bridge')
    parser.add_argument("-c", dest='config', required=True,
                        help='DB connection (usr/passwd@dsn)')
+   parser.add_argument("--time-stages", action='store_true',
+                       help='display the time and memory used by each stage')
    parser.add_argument("args", nargs='+')
    args = parser.parse_args()
 
@@ -352,7 +359,11 @@ def main():
    cmd_name = args.args[0]
    cmd_args = args.args[1:]                       
    proc = commands.get(cmd_name, bad_cmd)
+   if args.time_stages:
+      timer = cheby.timing.StageTimer()
    proc(cmd_name, *cmd_args)
+   if args.time_stages:
+      timer.report(sys.stderr, cmd_name)
 
 
 if __name__ == '__main__':
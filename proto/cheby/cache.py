@@ -0,0 +1,119 @@
+"""On-disk cache of parsed trees.
+   The parsed tree (before layout) of a file is pickled in the cache
+   directory.  The key is the hash of the file contents, so that the same
+   file at different locations share the entry, and a modified file never
+   hits a stale entry.  The cheby and python versions are part of the key,
+   as the classes of the tree may change between versions.
+
+   Entries are evicted when they are older than MAX_AGE seconds (the age is
+   the time of the last hit), and the oldest entries are evicted when the
+   total size of the cache is above MAX_SIZE bytes."""
+
+import os
+import sys
+import time
+import hashlib
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import cheby
+import cheby.tree
+
+SUFFIX = '.pickle'
+
+# Version of the pickled format of the tree classes.  To be incremented
+# when the classes change incompatibly (like the use of __slots__).
+FORMAT = 4
+
+
+class Cache(object):
+    def __init__(self, directory, max_size=64 << 20, max_age=30 * 86400):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, content):
+        "Return the key for file content CONTENT (a byte string)"
+        h = hashlib.sha1()
+        h.update('cheby-{}-{}-py{}\n'.format(
+            cheby.__version__, FORMAT, sys.version_info[0]).encode('ascii'))
+        h.update(content)
+        return h.hexdigest()
+
+    def entry_filename(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, key):
+        """Return the tree for KEY, or None if not in the cache."""
+        filename = self.entry_filename(key)
+        try:
+            with open(filename, 'rb') as fd:
+                res = pickle.load(fd)
+        except IOError:
+            self.misses += 1
+            return None
+        except Exception:
+            # Corrupted or incompatible entry: discard it.
+            self.remove(filename)
+            self.misses += 1
+            return None
+        # The cached paths of the tree may have been computed by another
+        # process.
+        cheby.tree.invalidate_caches()
+        # Refresh the age of the entry.
+        os.utime(filename, None)
+        self.hits += 1
+        return res
+
+    def store(self, key, root):
+        """Save tree ROOT for KEY."""
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(root, f, pickle.HIGHEST_PROTOCOL)
+        # Atomic, so that concurrent users never see a partial entry.
+        os.rename(tmpname, self.entry_filename(key))
+        self.evict()
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def entries(self):
+        """Return the list of (mtime, size, filename) of the entries."""
+        res = []
+        for f in os.listdir(self.directory):
+            if not f.endswith(SUFFIX):
+                continue
+            filename = os.path.join(self.directory, f)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            res.append((st.st_mtime, st.st_size, filename))
+        return res
+
+    def evict(self):
+        """Remove old entries, and the least recently used entries
+           until the size of the cache is below the limit."""
+        entries = sorted(self.entries())
+        if self.max_age is not None:
+            limit = time.time() - self.max_age
+            while entries and entries[0][0] < limit:
+                self.remove(entries.pop(0)[2])
+        if self.max_size is not None:
+            size = sum([e[1] for e in entries])
+            while entries and size > self.max_size:
+                _, sz, filename = entries.pop(0)
+                self.remove(filename)
+                size -= sz
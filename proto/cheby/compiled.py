@@ -0,0 +1,243 @@
+"""Compiled (binary) format of a laid-out tree.
+
+   Tools that only access the registers (like cheby.ual) can load a
+   compiled tree instead of parsing and laying out the yaml files.  The
+   file contains tables of fixed size entries (little endian):
+   - the header,
+   - the nodes, in pre-order (a node follows its parent).  The trees of the
+     submaps follow the main tree, each one only once,
+   - the fields, by register,
+   - the string pool: each string is its length (32 bits) followed by its
+     utf-8 bytes.  A string is referenced by its offset in the pool.
+   The tree loaded has only the user data and the layout values needed to
+   access the registers (names, addresses, sizes, widths, fields)."""
+
+import os
+import struct
+import mmap
+import cheby.tree as tree
+
+MAGIC = b'CHBC'
+VERSION = 1
+SUFFIX = '.chbc'
+
+# magic, version, number of nodes, number of fields, size of the pool
+HEADER = struct.Struct('<4sIIII')
+# kind, word size (root), parent, submap,
+# name, description, bus (root) or filename (submap), access (reg),
+# type (reg), width (reg), c_rwidth (reg), c_iowidth (reg), repeat (array),
+# first field, number of fields, c_sel_bits, c_blk_bits (composite),
+# c_address, c_size, c_align, c_elsize (array)
+NODE = struct.Struct('<BBxxii13I4Q')
+# name, description, lo, hi (-1 if None)
+FIELD = struct.Struct('<IIhh')
+
+NONE = 0xffffffff   # No string or no value
+
+KINDS = [tree.Root, tree.Block, tree.Array, tree.Submap, tree.Reg]
+
+
+class CompiledException(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class StringPool(object):
+    def __init__(self):
+        self.offsets = {}
+        self.data = []
+        self.size = 0
+
+    def add(self, s):
+        """Return the offset of string S (NONE if S is None)."""
+        if s is None:
+            return NONE
+        res = self.offsets.get(s)
+        if res is None:
+            b = s.encode('utf-8')
+            res = self.size
+            self.offsets[s] = res
+            self.data.append(struct.pack('<I', len(b)))
+            self.data.append(b)
+            self.size += 4 + len(b)
+        return res
+
+
+def none_int(v):
+    return NONE if v is None else v
+
+
+def int_none(v):
+    return None if v == NONE else v
+
+
+def compile_tree(root):
+    """Return the compiled form (a byte string) of laid-out tree ROOT."""
+    pool = StringPool()
+    nodes = []
+    fields = []
+    index = {}      # id(node) -> index in nodes
+    submaps = []    # (node entry, submap root)
+    trees = [root]
+    for t in trees:
+        todo = [(t, -1)]
+        while todo:
+            n, parent = todo.pop()
+            index[id(n)] = len(nodes)
+            e = [KINDS.index(type(n)), 0, parent, -1,
+                 pool.add(n.name), pool.add(n.description), NONE,
+                 NONE, NONE, NONE, NONE, NONE, NONE, len(fields), 0,
+                 NONE, NONE,
+                 n.c_address, n.c_size, n.c_align, 0]
+            if isinstance(n, tree.Reg):
+                e[7] = pool.add(n.access)
+                e[8] = pool.add(n.type)
+                e[9] = n.width
+                e[10] = n.c_rwidth
+                e[11] = n.c_iowidth
+                for f in n.children:
+                    fields.append(FIELD.pack(
+                        pool.add(f.name), pool.add(f.description),
+                        f.lo, -1 if f.hi is None else f.hi))
+                e[14] = len(n.children)
+            elif isinstance(n, tree.Root):
+                e[1] = n.c_word_size
+                e[6] = pool.add(n.bus)
+            elif isinstance(n, tree.Submap):
+                e[6] = pool.add(n.filename)
+                if n.filename is not None:
+                    if id(n.c_submap) not in [id(s) for s in trees]:
+                        trees.append(n.c_submap)
+                    submaps.append((e, n.c_submap))
+            elif isinstance(n, tree.Array):
+                e[12] = n.repeat
+                e[20] = n.c_elsize
+            if isinstance(n, tree.CompositeNode):
+                e[15] = none_int(n.c_sel_bits)
+                e[16] = none_int(n.c_blk_bits)
+            nodes.append(e)
+            if not isinstance(n, tree.Reg):
+                todo.extend([(c, index[id(n)]) for c in reversed(n.children)])
+    for e, sm in submaps:
+        e[3] = index[id(sm)]
+    res = [HEADER.pack(MAGIC, VERSION, len(nodes), len(fields), pool.size)]
+    res.extend([NODE.pack(*e) for e in nodes])
+    res.extend(fields)
+    res.extend(pool.data)
+    return b''.join(res)
+
+
+def save_compiled(fd, root):
+    """Write the compiled form of laid-out tree ROOT to binary stream FD."""
+    fd.write(compile_tree(root))
+
+
+def is_compiled(filename):
+    """True if FILENAME is a compiled tree."""
+    with open(filename, 'rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+def load_buffer(buf, filename):
+    """Return the tree compiled in BUF."""
+    if len(buf) < HEADER.size:
+        raise CompiledException("{}: truncated file".format(filename))
+    magic, version, nnodes, nfields, poolsize = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise CompiledException("{}: not a compiled file".format(filename))
+    if version != VERSION:
+        raise CompiledException("{}: unsupported version {}".format(
+            filename, version))
+    field_off = HEADER.size + nnodes * NODE.size
+    pool_off = field_off + nfields * FIELD.size
+    if len(buf) < pool_off + poolsize:
+        raise CompiledException("{}: truncated file".format(filename))
+    strings = {}
+
+    def get_str(off):
+        if off == NONE:
+            return None
+        res = strings.get(off)
+        if res is None:
+            l, = struct.unpack_from('<I', buf, pool_off + off)
+            start = pool_off + off + 4
+            res = buf[start:start + l].decode('utf-8')
+            strings[off] = res
+        return res
+
+    nodes = []
+    submaps = []
+    off = HEADER.size
+    for i in range(nnodes):
+        (kind, word_size, parent, submap,
+         name, desc, extra, access, typ, width, rwidth, iowidth, repeat,
+         first, nflds, sel_bits, blk_bits,
+         addr, size, align, elsize) = NODE.unpack_from(buf, off)
+        off += NODE.size
+        cls = KINDS[kind]
+        if cls is tree.Root:
+            n = tree.Root()
+            n.bus = get_str(extra)
+            n.c_word_size = word_size
+            n.c_filename = filename
+        else:
+            p = nodes[parent]
+            n = cls(p)
+            p.children.append(n)
+        n.name = get_str(name)
+        n.description = get_str(desc)
+        n.c_address = addr
+        n.c_size = size
+        n.c_align = align
+        if isinstance(n, tree.CompositeNode):
+            n.c_sel_bits = int_none(sel_bits)
+            n.c_blk_bits = int_none(blk_bits)
+        if cls is tree.Reg:
+            n.access = get_str(access)
+            n.type = get_str(typ)
+            n.width = width
+            n.c_rwidth = rwidth
+            n.c_iowidth = iowidth
+            foff = field_off + first * FIELD.size
+            for j in range(nflds):
+                fname, fdesc, lo, hi = FIELD.unpack_from(buf, foff)
+                foff += FIELD.size
+                if fname == NONE:
+                    f = tree.FieldReg(n)
+                    f.c_rwidth = rwidth
+                    f.c_iowidth = iowidth
+                else:
+                    f = tree.Field(n)
+                    f.c_rwidth = 1 if hi < 0 else hi - lo + 1
+                    f.c_iowidth = f.c_rwidth
+                f.name = get_str(fname)
+                f.description = get_str(fdesc)
+                f.lo = lo
+                f.hi = None if hi < 0 else hi
+                n.children.append(f)
+        elif cls is tree.Submap:
+            n.filename = get_str(extra)
+            if submap >= 0:
+                submaps.append((n, submap))
+        elif cls is tree.Array:
+            n.repeat = repeat
+            n.c_elsize = elsize
+        nodes.append(n)
+    for n, i in submaps:
+        n.c_submap = nodes[i]
+    if not nodes:
+        raise CompiledException("{}: empty file".format(filename))
+    return nodes[0]
+
+
+def load_compiled(filename):
+    """Load and return the compiled tree of FILENAME."""
+    with open(filename, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            # Cannot be mapped.
+            raise CompiledException("{}: truncated file".format(filename))
+        buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return load_buffer(buf, filename)
+        finally:
+            buf.close()
@@ -0,0 +1,95 @@
+"""Makefile-style dependency files.
+   A dependency file lists the generated files (the targets) and the files
+   read to generate them: the input file and all its submaps.  The first
+   line is a comment with a stamp, which is a hash of the cheby version,
+   of the generation options and of the content of the inputs.  When the
+   stamp is unchanged, the targets don't need to be regenerated."""
+
+import os
+import re
+import hashlib
+
+import cheby
+
+STAMP_PREFIX = '# cheby-stamp: '
+
+
+def compute_stamp(options, inputs):
+    """Return the stamp for OPTIONS (a string) and files INPUTS, or None
+       if an input cannot be read."""
+    h = hashlib.sha1()
+    h.update('cheby-{}\n{}\n'.format(
+        cheby.__version__, options).encode('utf-8'))
+    for f in inputs:
+        try:
+            with open(f, 'rb') as fd:
+                content = fd.read()
+        except IOError:
+            return None
+        h.update('{}:{}\n'.format(f, len(content)).encode('utf-8'))
+        h.update(content)
+    return h.hexdigest()
+
+
+def escape(filename):
+    """Escape FILENAME for make: spaces, '$' (variable references) and
+       '#' (comments)."""
+    return filename.replace('$', '$$').replace('#', '\\#').replace(
+        ' ', '\\ ')
+
+
+def split_names(s):
+    """Split S into a list of (unescaped) file names."""
+    return [re.sub(r'\\([ #])|\$(\$)', lambda m: m.group(1) or m.group(2), f)
+            for f in re.findall(r'(?:\\[ #]|\$\$|\S)+', s)]
+
+
+def write_depfile(filename, targets, inputs, options):
+    with open(filename, 'w') as fd:
+        fd.write(STAMP_PREFIX + compute_stamp(options, inputs) + '\n')
+        fd.write(' '.join([escape(t) for t in targets]) + ':')
+        for f in inputs:
+            fd.write(' \\\n  ' + escape(f))
+        fd.write('\n')
+        # Like gcc -MP: an empty rule for each input so that make doesn't
+        # fail when an input is removed.
+        for f in inputs:
+            fd.write('\n' + escape(f) + ':\n')
+
+
+def read_depfile(filename):
+    """Return the (stamp, targets, inputs) of dependency file FILENAME,
+       or None if it doesn't exist or is not a cheby dependency file."""
+    try:
+        with open(filename) as fd:
+            lines = fd.read().split('\n')
+    except IOError:
+        return None
+    if len(lines) < 2 or not lines[0].startswith(STAMP_PREFIX):
+        return None
+    stamp = lines[0][len(STAMP_PREFIX):]
+    # Join the continuation lines of the rule.
+    rule = ''
+    for l in lines[1:]:
+        if l.endswith(' \\'):
+            rule += l[:-2]
+        else:
+            rule += l
+            break
+    targets, sep, deps = rule.partition(':')
+    if not sep:
+        return None
+    return stamp, split_names(targets), split_names(deps)
+
+
+def is_up_to_date(filename, options):
+    """True if the targets of dependency file FILENAME exist and were
+       generated with OPTIONS from inputs that haven't changed."""
+    res = read_depfile(filename)
+    if res is None:
+        return False
+    stamp, targets, inputs = res
+    for t in targets:
+        if not os.path.exists(t):
+            return False
+    return stamp == compute_stamp(options, inputs)
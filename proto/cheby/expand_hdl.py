@@ -1,6 +1,5 @@
 import cheby.parser as parser
 import cheby.tree as tree
-import copy
 
 def expand_x_hdl_field(f, n, dct):
     # Default values
@@ -44,18 +43,129 @@ def expand_x_hdl(n):
     else:
         raise AssertionError(n)
 
-def tree_copy(n, new_parent):
-    if isinstance(n, tree.Reg):
-        res = copy.copy(n)
-        res._parent = new_parent
-        res.children = [tree_copy(f, res) for f in n.children]
-        return res
-    elif isinstance(n, tree.FieldBase):
-        res = copy.copy(n)
-        res._parent = new_parent
+
+class ElementView(object):
+    """Mixin for the nodes of an unrolled array element.  The slots are
+       copied from the template node, and the other attributes (the
+       extensions, which are not modified) are read from the template,
+       so that the instance dictionaries are not copied.  The attributes
+       set by the generators are stored in the view."""
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        # Only called when the attribute is not set on the view.
+        if name == '_template':
+            raise AttributeError(name)
+        return getattr(self._template, name)
+
+
+class RegView(ElementView, tree.Reg):
+    __slots__ = ('_template',)
+
+
+class FieldView(ElementView, tree.Field):
+    __slots__ = ('_template',)
+
+
+class FieldRegView(ElementView, tree.FieldReg):
+    __slots__ = ('_template',)
+
+
+view_classes = {tree.Reg: RegView,
+                tree.Field: FieldView,
+                tree.FieldReg: FieldRegView}
+
+
+def get_slots(cls, cache={}):
+    """Return the names of the slots of CLS and its bases (to be copied
+       in a view)."""
+    res = cache.get(cls)
+    if res is None:
+        res = []
+        for c in cls.__mro__:
+            for name in c.__dict__.get('__slots__', ()):
+                if name not in ('__dict__', '_parent', 'children',
+                                'c_names', '_root_cache', '_path_cache'):
+                    res.append(name)
+        cache[cls] = res
+    return res
+
+
+def create_view(n, parent):
+    # Faster than copy.copy, and doesn't copy the dictionary.
+    res = object.__new__(view_classes[type(n)])
+    res._template = n
+    res._parent = parent
+    res._root_cache = None
+    res._path_cache = None
+    for name in get_slots(type(n)):
+        try:
+            setattr(res, name, getattr(n, name))
+        except AttributeError:
+            pass
+    return res
+
+
+class ArrayElements(object):
+    """Children of an unrolled array.  The elements are views of the
+       template element, created on first access (and then kept)."""
+    def __init__(self, block, template, repeat, elsize):
+        self.block = block
+        self.template = template
+        self.elsize = elsize
+        self.elements = [None] * repeat
+
+    def __len__(self):
+        return len(self.elements)
+
+    def get(self, i):
+        res = self.elements[i]
+        if res is None:
+            el = self.template
+            res = create_view(el, self.block)
+            res.name = "{}{:x}".format(el.name, i)
+            res.c_address = self.block.c_address + i * self.elsize
+            res.children = [create_view(f, res) for f in el.children]
+            res.c_names = None
+            self.elements[i] = res
         return res
-    else:
-        raise AssertionError(n)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.get(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.get(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get(i)
+
+    def get_child(self, name):
+        """Return the element named NAME, or None.  Only this element
+           is created."""
+        prefix = self.template.name
+        if name is None or not name.startswith(prefix):
+            return None
+        suffix = name[len(prefix):]
+        try:
+            i = int(suffix, 16)
+        except ValueError:
+            return None
+        if i >= len(self) or '{:x}'.format(i) != suffix:
+            return None
+        return self.get(i)
+
+    def get_child_at(self, addr):
+        """Return the element that contains the relative address ADDR,
+           or None.  Only this element is created."""
+        off = addr - self.block.c_address
+        if off < 0:
+            return None
+        i = off // self.elsize
+        if i >= len(self) or off - i * self.elsize >= self.template.c_size:
+            return None
+        return self.get(i)
 
 
 def unroll_array(n):
@@ -69,23 +179,29 @@ def unroll_array(n):
     res.c_size = n.c_size
     assert len(n.children) == 1
     el = n.children[0]
-    for i in range(n.repeat):
-        c = tree_copy(el, res)
-        c.name = "{}{:x}".format(el.name, i)
-        c.c_address = n.c_address + i * n.c_elsize
-        res.children.append(c)
+    if not isinstance(el, tree.Reg):
+        raise AssertionError(el)
+    res.children = ArrayElements(res, el, n.repeat, n.c_elsize)
     return res
 
 
 def unroll_arrays(n):
     if isinstance(n, tree.Reg):
         return n
+    if isinstance(n.children, ArrayElements):
+        # Already unrolled (shared submap).
+        return n
     if isinstance(n, tree.Array):
         if n.align == False:
             return unroll_array(n)
     if isinstance(n, tree.CompositeNode):
         nl = [unroll_arrays(el) for el in n.children]
-        n.children = nl
+        if any([a is not b for a, b in zip(nl, n.children)]):
+            n.children = nl
+            # Rebuild the indexes on the next lookup.
+            n.c_names = None
+            n.c_sorted_children = None
+            n.c_addresses = None
         return n
     raise AssertionError
 
@@ -93,3 +209,4 @@ def unroll_arrays(n):
 def expand_hdl(root):
     expand_x_hdl(root)
     unroll_arrays(root)
+    tree.invalidate_caches()
@@ -37,10 +37,7 @@ def find_by_name(root, path, ref):
     for p in path:
         n = None
         if isinstance(base, (tree.Root, tree.Block, tree.Reg)):
-            for e in base.children:
-                if e.name == p:
-                    n = e
-                    break
+            n = base.get_child(p)
         if n == None:
             raise GenHDLException("cannot find '{}' in '{}' for '{}'".format(
                 p, base.name, ref))
@@ -1052,6 +1049,8 @@ def gen_hdl_area_decls(area, pfx, root, module, isigs):
                         assert len(el.children) == 0
                         assert get_gena_gen(el, 'include') == 'internal'
                         el.children = el.c_submap.children
+                        el.c_names = el.c_submap.c_names
+                        tree.invalidate_caches()
                         lib = get_gena_gen(el.c_submap, 'vhdl-library')
                         if not lib:
                             lib = 'work'
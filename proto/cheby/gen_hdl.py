@@ -83,7 +83,7 @@ def gen_wishbone_bus(build_port, addr_bits, data_bits, comment=None,
     res['stb'] = build_port('stb', None, dir=inp)
     if addr_bits > 0:
         res['adr'] = build_port('adr', addr_bits, dir=inp)
-    res['sel'] = build_port('sel', data_bits / tree.BYTE_SIZE, dir=inp)
+    res['sel'] = build_port('sel', data_bits // tree.BYTE_SIZE, dir=inp)
     res['we'] = build_port('we', None, dir=inp)
     res['dati'] = build_port('dat', data_bits, dir=inp)
 
@@ -146,6 +146,103 @@ def expand_wishbone(root, module, isigs):
         add_decode_wb(root, module, isigs)
 
 
+def gen_axi4lite_bus(build_port, addr_bits, data_bits, comment=None,
+                     is_master=False):
+    """Return the ports of an AXI4-Lite bus (the addresses are byte
+       addresses).  The ports of a slave are created if IS_MASTER is False."""
+    res = {}
+    inp, out = ('IN', 'OUT') if not is_master else ('OUT', 'IN')
+    # Write address channel
+    res['awvalid'] = build_port('awvalid', None, dir=inp)
+    res['awvalid'].comment = comment
+    res['awready'] = build_port('awready', None, dir=out)
+    res['awaddr'] = build_port('awaddr', addr_bits, dir=inp)
+    res['awprot'] = build_port('awprot', 3, dir=inp)
+    # Write data channel
+    res['wvalid'] = build_port('wvalid', None, dir=inp)
+    res['wready'] = build_port('wready', None, dir=out)
+    res['wdata'] = build_port('wdata', data_bits, dir=inp)
+    res['wstrb'] = build_port('wstrb', data_bits // tree.BYTE_SIZE, dir=inp)
+    # Write response channel
+    res['bvalid'] = build_port('bvalid', None, dir=out)
+    res['bready'] = build_port('bready', None, dir=inp)
+    res['bresp'] = build_port('bresp', 2, dir=out)
+    # Read address channel
+    res['arvalid'] = build_port('arvalid', None, dir=inp)
+    res['arready'] = build_port('arready', None, dir=out)
+    res['araddr'] = build_port('araddr', addr_bits, dir=inp)
+    res['arprot'] = build_port('arprot', 3, dir=inp)
+    # Read data channel
+    res['rvalid'] = build_port('rvalid', None, dir=out)
+    res['rready'] = build_port('rready', None, dir=inp)
+    res['rdata'] = build_port('rdata', data_bits, dir=out)
+    res['rresp'] = build_port('rresp', 2, dir=out)
+    return res
+
+
+def add_decode_axi4lite(root, module, isigs):
+    """Generate internal signals used by decoder/processes from AXI4-Lite
+       bus.  A write request is present when both the address and the data
+       are valid, and a read request when the address is valid; the
+       requests are not accepted while the response cannot be output.
+       The requests are acked (the address and data accepted) in the cycle
+       they are handled."""
+    bus = root.h_bus
+    isigs.rd_int = HDLSignal('rd_int')        # Read access
+    isigs.wr_int = HDLSignal('wr_int')        # Write access
+    isigs.rd_ack = HDLSignal('rd_ack_int')    # Ack for read
+    isigs.wr_ack = HDLSignal('wr_ack_int')    # Ack for write
+    isigs.bvalid = HDLSignal('bvalid_int')
+    isigs.rvalid = HDLSignal('rvalid_int')
+    module.decls.extend([isigs.rd_int, isigs.wr_int,
+                         isigs.rd_ack, isigs.wr_ack,
+                         isigs.bvalid, isigs.rvalid])
+    # Word addresses
+    addr_bits = root.c_sel_bits + root.c_blk_bits - root.c_addr_word_bits
+    if addr_bits > 0:
+        isigs.wr_adr = HDLSignal('wr_adr_int', addr_bits)
+        isigs.rd_adr = HDLSignal('rd_adr_int', addr_bits)
+        module.decls.extend([isigs.wr_adr, isigs.rd_adr])
+        module.stmts.append(HDLAssign(isigs.wr_adr,
+            HDLSlice(bus['awaddr'], root.c_addr_word_bits, addr_bits)))
+        module.stmts.append(HDLAssign(isigs.rd_adr,
+            HDLSlice(bus['araddr'], root.c_addr_word_bits, addr_bits)))
+    else:
+        isigs.wr_adr = None
+        isigs.rd_adr = None
+    isigs.wr_dat = bus['wdata']
+    isigs.rd_dat = bus['rdata']
+
+    module.stmts.append(HDLAssign(isigs.wr_int, HDLAnd(
+        HDLAnd(bus['awvalid'], bus['wvalid']),
+        HDLOr(HDLNot(isigs.bvalid), bus['bready']))))
+    module.stmts.append(HDLAssign(bus['awready'], isigs.wr_ack))
+    module.stmts.append(HDLAssign(bus['wready'], isigs.wr_ack))
+    module.stmts.append(HDLAssign(bus['bvalid'], isigs.bvalid))
+    module.stmts.append(HDLAssign(bus['bresp'], HDLConst(0, 2)))
+    module.stmts.append(HDLAssign(isigs.rd_int, HDLAnd(
+        bus['arvalid'], HDLOr(HDLNot(isigs.rvalid), bus['rready']))))
+    module.stmts.append(HDLAssign(bus['arready'], isigs.rd_ack))
+    module.stmts.append(HDLAssign(bus['rvalid'], isigs.rvalid))
+    module.stmts.append(HDLAssign(bus['rresp'], HDLConst(0, 2)))
+
+
+def expand_axi4lite(root, module, isigs):
+    """Create AXI4-Lite interface."""
+    root.h_bus = {}
+    root.h_bus['clk'] = module.add_port('aclk')
+    root.h_bus['rst'] = module.add_port('areset_n')
+    root.h_bus.update(
+        gen_axi4lite_bus(
+            lambda n, sz, dir: module.add_port(n, size=sz, dir=dir),
+            root.c_sel_bits + root.c_blk_bits, root.c_word_bits))
+    root.h_bussplit = True
+
+    if isigs:
+        module.stmts.append(HDLComment('AXI4-Lite decode signals'))
+        add_decode_axi4lite(root, module, isigs)
+
+
 def add_decode_cern_be_vme(root, module, isigs):
     "Generate internal signals used by decoder/processes from CERN-BE-VME bus."
     isigs.rd_int = root.h_bus['rd']
@@ -263,6 +360,76 @@ def wire_bus_slave_sram(root, stmts, n):
                           root.c_addr_word_bits,
                           n.c_blk_bits - root.c_addr_word_bits)))
 
+def gen_bus_slave_axi4lite(root, module, prefix, n):
+    n.h_bus = gen_axi4lite_bus(
+        lambda name, sz, dir: module.add_port(
+            '{}{}_{}'.format(prefix, name, dirname[dir]), size=sz, dir=dir),
+        n.c_blk_bits, root.c_word_bits, n.description, True)
+    # Internal signals: requests and channels already accepted.
+    n.h_wr = HDLSignal(prefix + 'wr')
+    n.h_rd = HDLSignal(prefix + 'rd')
+    n.h_aw_done = HDLSignal(prefix + 'aw_done')
+    n.h_w_done = HDLSignal(prefix + 'w_done')
+    n.h_ar_done = HDLSignal(prefix + 'ar_done')
+    module.decls.extend([n.h_wr, n.h_rd,
+                         n.h_aw_done, n.h_w_done, n.h_ar_done])
+
+def wire_bus_slave_axi4lite(root, stmts, n):
+    """The address and data channels are valid while the request is
+       present and until they are accepted.  The requests are kept until
+       the response."""
+    stmts.append(HDLComment("Assignments for submap {}".format(n.name)))
+    bus = n.h_bus
+    stmts.append(HDLAssign(bus['awvalid'],
+                           HDLAnd(n.h_wr, HDLNot(n.h_aw_done))))
+    stmts.append(HDLAssign(bus['wvalid'], HDLAnd(n.h_wr, HDLNot(n.h_w_done))))
+    stmts.append(HDLAssign(bus['bready'], n.h_wr))
+    stmts.append(HDLAssign(bus['arvalid'],
+                           HDLAnd(n.h_rd, HDLNot(n.h_ar_done))))
+    stmts.append(HDLAssign(bus['rready'], n.h_rd))
+    width = n.c_blk_bits - root.c_addr_word_bits
+    if root.bus == 'axi4-lite-32':
+        stmts.append(HDLAssign(bus['awaddr'],
+                               HDLSlice(root.h_bus['awaddr'], 0, n.c_blk_bits)))
+        stmts.append(HDLAssign(bus['araddr'],
+                               HDLSlice(root.h_bus['araddr'], 0, n.c_blk_bits)))
+        stmts.append(HDLAssign(bus['awprot'], root.h_bus['awprot']))
+        stmts.append(HDLAssign(bus['arprot'], root.h_bus['arprot']))
+        stmts.append(HDLAssign(bus['wdata'], root.h_bus['wdata']))
+        stmts.append(HDLAssign(bus['wstrb'], root.h_bus['wstrb']))
+    else:
+        # The address of the bus has a word granularity.
+        for name in ['awaddr', 'araddr']:
+            if width > 0:
+                stmts.append(HDLAssign(
+                    HDLSlice(bus[name], root.c_addr_word_bits, width),
+                    HDLSlice(root.h_bus['adr'], 0, width)))
+            stmts.append(HDLAssign(
+                HDLSlice(bus[name], 0, root.c_addr_word_bits),
+                HDLReplicate(bit_0, root.c_addr_word_bits)))
+        stmts.append(HDLAssign(bus['awprot'], HDLReplicate(bit_0, 3)))
+        stmts.append(HDLAssign(bus['arprot'], HDLReplicate(bit_0, 3)))
+        stmts.append(HDLAssign(bus['wdata'], root.h_bus['dati']))
+        stmts.append(HDLAssign(bus['wstrb'],
+                               HDLReplicate(bit_1, root.c_word_size)))
+    # Set the flags when a channel is accepted, clear them on the response.
+    proc = HDLSync(root.h_bus['clk'], root.h_bus['rst'])
+    stmts.append(proc)
+    for flag in [n.h_aw_done, n.h_w_done, n.h_ar_done]:
+        proc.rst_stmts.append(HDLAssign(flag, bit_0))
+    for flags, req, resp in [([(n.h_aw_done, 'awready'),
+                               (n.h_w_done, 'wready')], n.h_wr, 'bvalid'),
+                             ([(n.h_ar_done, 'arready')], n.h_rd, 'rvalid')]:
+        resp_if = HDLIfElse(HDLEq(bus[resp], bit_1))
+        proc.sync_stmts.append(resp_if)
+        for flag, ready in flags:
+            resp_if.then_stmts.append(HDLAssign(flag, bit_0))
+            ready_if = HDLIfElse(HDLAnd(HDLEq(req, bit_1),
+                                        HDLEq(bus[ready], bit_1)))
+            ready_if.else_stmts = None
+            ready_if.then_stmts.append(HDLAssign(flag, bit_1))
+            resp_if.else_stmts.append(ready_if)
+
 def gen_bus_slave(root, module, prefix, n, interface, busgroup):
     if interface == 'wb-32-be':
         n.h_bus = gen_bus_slave_wb32(
@@ -275,6 +442,8 @@ def gen_bus_slave(root, module, prefix, n, interface, busgroup):
     elif interface == 'sram':
         n.h_bus = {}
         gen_bus_slave_sram(root, prefix, n)
+    elif interface == 'axi4-lite-32':
+        gen_bus_slave_axi4lite(root, module, prefix, n)
     else:
         raise AssertionError(interface)
 
@@ -298,6 +467,8 @@ def wire_submap(root, module, n, stmts):
         wire_bus_slave_wb32(root, stmts, n)
     elif n.c_interface == 'sram':
         wire_bus_slave_sram(root, stmts, n)
+    elif n.c_interface == 'axi4-lite-32':
+        wire_bus_slave_axi4lite(root, stmts, n)
     else:
         raise AssertionError(n.interface)
 
@@ -481,19 +652,37 @@ def gather_children(n):
     else:
         raise AssertionError
 
-def add_block_decoder(root, stmts, addr, children, hi, func):
-    if False:
-        print("add_block_decoder: hi={}".format(hi))
-        for i in children:
-            print("{}: {:08x}".format(i.name, i.c_address))
-        print("----")
+class DecodeSwitch(object):
+    """Decode of the address bits [LO, LO + WIDTH) (byte address).
+       CHOICES is the list of (value of the bits, decode sub-tree)."""
+    def __init__(self, lo, width):
+        self.lo = lo
+        self.width = width
+        self.choices = []
+
+
+class DecodeReg(object):
+    "Decode of the words of register EL, whose block has BLK_BITS bits."
+    def __init__(self, el, blk_bits):
+        self.el = el
+        self.blk_bits = blk_bits
+
+
+class DecodeElement(object):
+    "Element EL (a submap or an array) is selected."
+    def __init__(self, el):
+        self.el = el
+
+
+def build_block_decoder(children, hi):
+    """Return the decode tree for CHILDREN (sorted by address) within
+       a block of HI bits."""
     if len(children) == 1:
         el = children[0]
         if isinstance(el, tree.Reg):
-            add_reg_decoder(root, stmts, addr, func, children, hi)
+            return DecodeReg(el, hi)
         else:
-            func(stmts, el, 0)
-        return
+            return DecodeElement(el)
 
     maxsz = max([e.c_size for e in children])
     maxszl2 = ilog2(maxsz)
@@ -501,48 +690,72 @@ def add_block_decoder(root, stmts, addr, children, hi, func):
     mask = (1 << hi) - maxsz
     assert maxszl2 < hi
 
-    # Note: addr has a word granularity.
-    sw = HDLSwitch(HDLSlice(addr, maxszl2 - root.c_addr_word_bits, hi - maxszl2))
-    stmts.append(sw)
-
-    while len(children) > 0:
-        first = children[0]
-        children = children[1:]
-        l = [first]
-        base = first.c_address & mask
-        if False:
-            print("hi={} szl2={} first: {:08x}, base: {:08x}, mask: {:08x}".format(
-                hi, maxszl2, first.c_address, base, mask))
-        while len(children) > 0:
-            el = children[0]
-            if (el.c_address & mask) != base:
-                break
-            if False:
-                print(" {} c_addr={:08x}".format(el.name, el.c_address))
-            l.append(el)
-            children = children[1:]
-
-        ch = HDLChoiceExpr(HDLConst(base >> maxszl2, hi - maxszl2))
-        sw.choices.append(ch)
-        add_block_decoder(root, ch.stmts, addr, l, maxszl2, func)
-
-    sw.choices.append(HDLChoiceDefault())
+    res = DecodeSwitch(maxszl2, hi - maxszl2)
+    # Group the consecutive children with the same address bits.
+    i = 0
+    while i < len(children):
+        base = children[i].c_address & mask
+        j = i + 1
+        while j < len(children) and (children[j].c_address & mask) == base:
+            j += 1
+        res.choices.append(
+            (base >> maxszl2, build_block_decoder(children[i:j], maxszl2)))
+        i = j
+    return res
 
 
-def add_decoder(root, stmts, addr, n, func):
-    """Call :param func: for each element of :param n:.  :param func: can also
-       be called with None when a decoder is generated and could handle an
-       address that has no corresponding children."""
+def build_decoder(root):
+    "Return the decode tree of ROOT."
     children = gather_children(root)
     children = sorted(children, key=lambda x: x.c_address)
+    return build_block_decoder(children, root.c_sel_bits + root.c_blk_bits)
+
+
+def add_block_decoder(root, stmts, addr, dec, func):
+    if isinstance(dec, DecodeReg):
+        add_reg_decoder(root, stmts, addr, func, [dec.el], dec.blk_bits)
+    elif isinstance(dec, DecodeElement):
+        func(stmts, dec.el, 0)
+    else:
+        # Note: addr has a word granularity.
+        sw = HDLSwitch(HDLSlice(addr, dec.lo - root.c_addr_word_bits,
+                                dec.width))
+        stmts.append(sw)
+        for val, sub in dec.choices:
+            ch = HDLChoiceExpr(HDLConst(val, dec.width))
+            sw.choices.append(ch)
+            add_block_decoder(root, ch.stmts, addr, sub, func)
+        sw.choices.append(HDLChoiceDefault())
+
+
+def prune_decoder(dec, keep):
+    """Return decode tree DEC restricted to the elements whose id is in
+       KEEP, or None if there is no such element."""
+    if isinstance(dec, DecodeSwitch):
+        res = DecodeSwitch(dec.lo, dec.width)
+        for val, sub in dec.choices:
+            sub = prune_decoder(sub, keep)
+            if sub is not None:
+                res.choices.append((val, sub))
+        return res if res.choices else None
+    elif id(dec.el) in keep:
+        return dec
+    else:
+        return None
 
-    add_block_decoder(
-        root, stmts, addr, children, root.c_sel_bits + root.c_blk_bits, func)
 
+def add_decoder(root, stmts, addr, func):
+    """Call :param func: for each element of :param root:.  :param func: can
+       also be called with None when a decoder is generated and could handle
+       an address that has no corresponding children.
+       The decode tree is built once by generate_hdl."""
+    add_block_decoder(root, stmts, addr, root.h_decoder, func)
 
-def field_decode(root, reg, f, off, val, dat):
-    """Handle multi-word accesses.  Slice (if needed) VAL and DAT for offset
-       OFF and field F or register REG."""
+
+def field_range(root, f, off):
+    """Return the bounds (d_lo, d_hi, v_lo, v_hi) of field F in the word at
+       offset OFF: the bits of the word and the bits of the value.  Return
+       None if F is not in that word."""
     # Register and value bounds
     d_lo = f.lo
     d_hi = f.lo + f.c_rwidth - 1
@@ -550,9 +763,9 @@ def field_decode(root, reg, f, off, val, dat):
     v_hi = f.c_rwidth - 1
     # Next field if not affected by this read.
     if d_hi < off:
-        return (None, None)
+        return None
     if d_lo >= off + root.c_word_bits:
-        return (None, None)
+        return None
     if d_lo < off:
         # Strip the part below OFF.
         delta = off - d_lo
@@ -565,7 +778,16 @@ def field_decode(root, reg, f, off, val, dat):
         delta = d_hi + 1 - root.c_word_bits
         d_hi = root.c_word_bits - 1
         v_hi -= delta
+    return (d_lo, d_hi, v_lo, v_hi)
+
 
+def field_decode(root, reg, f, off, val, dat):
+    """Handle multi-word accesses.  Slice (if needed) VAL and DAT for offset
+       OFF and field F or register REG."""
+    r = field_range(root, f, off)
+    if r is None:
+        return (None, None)
+    d_lo, d_hi, v_lo, v_hi = r
     if d_hi == root.c_word_bits - 1 and d_lo == 0:
         pass
     else:
@@ -577,23 +799,9 @@ def field_decode(root, reg, f, off, val, dat):
     return (val, dat)
 
 
-def add_read_reg_process(root, module, isigs):
-    # Register read
-    rd_data = root.h_reg_rdat_int
-    rd_ack = root.h_rd_ack1_int
-    rdproc = HDLSync(root.h_bus['clk'], root.h_bus['rst'])
-    module.stmts.append(rdproc)
-    rdproc.rst_stmts.append(HDLAssign(rd_ack, bit_0))
-    rdproc.rst_stmts.append(HDLAssign(rd_data,
-                                      HDLReplicate(bit_x, root.c_word_bits)))
-    rdproc.sync_stmts.append(HDLAssign(rd_data,
-                                       HDLReplicate(bit_x, root.c_word_bits)))
-    rd_if = HDLIfElse(HDLAnd(HDLEq(isigs.rd_int, bit_1),
-                             HDLEq(rd_ack, bit_0)))
-    rdproc.sync_stmts.append(rd_if)
-    rd_if.then_stmts.append(HDLAssign(rd_ack, bit_1))
-    rd_if.else_stmts.append(HDLAssign(rd_ack, bit_0))
-
+def read_reg_func(root, rd_data):
+    """Return the decoder function that reads the registers into
+       RD_DATA."""
     def add_read_reg(s, n, off):
         for f in n.children:
             if n.access in ['wo', 'rw']:
@@ -623,15 +831,164 @@ def add_read_reg_process(root, module, isigs):
                 # Blocks have been handled.
                 raise AssertionError
 
+    return add_read
+
+
+def get_read_mux_fanin(root):
+    """Return the fan-in of the register read mux tree (x-hdl
+       read-mux-fanin attribute of ROOT), or None for a flat mux."""
+    fanin = root.get_extension('x_hdl', 'read-mux-fanin', None)
+    if fanin is not None and (not isinstance(fanin, int) or fanin < 2):
+        raise HdlError("incorrect x-hdl read-mux-fanin '{}' for {} (must "
+                       "be an integer greater than 1)".format(
+                           fanin, root.name))
+    return fanin
+
+
+def balanced_groups(items, weight, fanin):
+    """Split ITEMS into consecutive groups of similar weight, each one
+       with a total weight of at most FANIN (unless an item is heavier)."""
+    def get_target(total):
+        # Spread TOTAL on the minimal number of groups.
+        ngroups = max((total + fanin - 1) // fanin, 1)
+        return (total + ngroups - 1) // ngroups
+
+    total = sum([weight(e) for e in items])
+    target = get_target(total)
+    res = []
+    cur = []
+    cur_weight = 0
+    for e in items:
+        w = weight(e)
+        if cur and cur_weight + w > target:
+            res.append(cur)
+            total -= cur_weight
+            target = get_target(total)
+            cur = []
+            cur_weight = 0
+        cur.append(e)
+        cur_weight += w
+    if cur:
+        res.append(cur)
+    return res
+
+
+def add_read_mux_tree(root, module, isigs, groups):
+    """Generate the register read mux as a tree of registered sub-muxes.
+       Each group of registers of GROUPS (consecutive address ranges) is
+       decoded by a sub-mux (the decode tree restricted to the group) whose
+       output is 0 when not selected, then the outputs are or-ed by levels
+       of at most h_read_mux_fanin inputs.  The ack is delayed by the number
+       of levels.  As the RAMs are still read in one cycle, the registers
+       then have their own ack, started only when a register is selected."""
+    fanin = root.h_read_mux_fanin
+    rd_data = root.h_reg_rdat_int
+    has_ram = any([isinstance(n, tree.Array) for n in gather_children(root)])
+    if has_ram:
+        rd_ack = HDLSignal('rd_ack_reg_int')
+        root.h_rd_reg_sel = HDLSignal('rd_reg_sel_int')
+        module.decls.extend([rd_ack, root.h_rd_reg_sel])
+        root.h_rd_ack_reg = rd_ack
+    else:
+        rd_ack = root.h_rd_ack1_int
+    muxproc = HDLSync(root.h_bus['clk'], None)
+    module.stmts.append(muxproc)
+    sigs = []
+    for i, regs in enumerate(groups):
+        sig = HDLSignal('reg_rdat_0_{}_int'.format(i), root.c_word_bits)
+        module.decls.append(sig)
+        sigs.append(sig)
+        muxproc.sync_stmts.append(
+            HDLAssign(sig, HDLReplicate(bit_0, root.c_word_bits)))
+        add_block_decoder(root, muxproc.sync_stmts, root.h_bus['adr'],
+                          prune_decoder(root.h_decoder,
+                                        set([id(r) for r in regs])),
+                          read_reg_func(root, sig))
+    level = 0
+    while len(sigs) > 1:
+        level += 1
+        grps = balanced_groups(sigs, lambda x: 1, fanin)
+        if len(grps) == 1:
+            dests = [rd_data]
+        else:
+            dests = [HDLSignal('reg_rdat_{}_{}_int'.format(level, i),
+                               root.c_word_bits) for i in range(len(grps))]
+            module.decls.extend(dests)
+        for dest, grp in zip(dests, grps):
+            expr = grp[0]
+            for sig in grp[1:]:
+                expr = HDLOr(expr, sig)
+            muxproc.sync_stmts.append(HDLAssign(dest, expr))
+        sigs = dests
+
+    # Requests in flight, one per level.
+    stages = [HDLSignal('rd_stage{}_int'.format(i + 1)) for i in range(level)]
+    module.decls.extend(stages)
+    ackproc = HDLSync(root.h_bus['clk'], root.h_bus['rst'])
+    module.stmts.append(ackproc)
+    cond = HDLEq(isigs.rd_int, bit_1)
+    if has_ram:
+        cond = HDLAnd(cond, HDLEq(root.h_rd_reg_sel, bit_1))
+    for s in stages + [rd_ack]:
+        ackproc.rst_stmts.append(HDLAssign(s, bit_0))
+        cond = HDLAnd(cond, HDLEq(s, bit_0))
+    rd_if = HDLIfElse(cond)
+    ackproc.sync_stmts.append(rd_if)
+    rd_if.then_stmts.append(HDLAssign(stages[0], bit_1))
+    rd_if.else_stmts.append(HDLAssign(stages[0], bit_0))
+    for prev, s in zip(stages, stages[1:] + [rd_ack]):
+        ackproc.sync_stmts.append(HDLAssign(s, prev))
+    if has_ram:
+        # Single cycle ack for the RAMs.
+        ram_ack = root.h_rd_ack1_int
+        ackproc.rst_stmts.append(HDLAssign(ram_ack, bit_0))
+        ram_if = HDLIfElse(HDLAnd(HDLAnd(HDLEq(isigs.rd_int, bit_1),
+                                         HDLEq(root.h_rd_reg_sel, bit_0)),
+                                  HDLEq(ram_ack, bit_0)))
+        ram_if.then_stmts.append(HDLAssign(ram_ack, bit_1))
+        ram_if.else_stmts.append(HDLAssign(ram_ack, bit_0))
+        ackproc.sync_stmts.append(ram_if)
+
+
+def add_read_reg_process(root, module, isigs):
+    if root.h_read_mux_fanin is not None:
+        regs = [n for n in gather_children(root)
+                if isinstance(n, tree.Reg) and n.access != 'wo']
+        regs = sorted(regs, key=lambda x: x.c_address)
+
+        def nwords(n):
+            return (n.c_size + root.c_word_size - 1) // root.c_word_size
+
+        groups = balanced_groups(regs, nwords, root.h_read_mux_fanin)
+        if len(groups) > 1:
+            add_read_mux_tree(root, module, isigs, groups)
+            return
+    # Register read
+    rd_data = root.h_reg_rdat_int
+    rd_ack = root.h_rd_ack1_int
+    rdproc = HDLSync(root.h_bus['clk'], root.h_bus['rst'])
+    module.stmts.append(rdproc)
+    rdproc.rst_stmts.append(HDLAssign(rd_ack, bit_0))
+    rdproc.rst_stmts.append(HDLAssign(rd_data,
+                                      HDLReplicate(bit_x, root.c_word_bits)))
+    rdproc.sync_stmts.append(HDLAssign(rd_data,
+                                       HDLReplicate(bit_x, root.c_word_bits)))
+    rd_if = HDLIfElse(HDLAnd(HDLEq(isigs.rd_int, bit_1),
+                             HDLEq(rd_ack, bit_0)))
+    rdproc.sync_stmts.append(rd_if)
+    rd_if.then_stmts.append(HDLAssign(rd_ack, bit_1))
+    rd_if.else_stmts.append(HDLAssign(rd_ack, bit_0))
+
     then_stmts = []
-    add_decoder(root, then_stmts, root.h_bus.get('adr', None), root, add_read)
+    add_decoder(root, then_stmts, root.h_bus.get('adr', None),
+                read_reg_func(root, rd_data))
     rd_if.then_stmts.extend(then_stmts)
 
 
 def add_read_process(root, module, isigs):
     # Register read
-    rd_data = root.h_bus['dato']
-    rd_ack = isigs.rd_ack
+    rd_data = isigs.rd_dat
+    rd_ack = isigs.rd_mux_ack
     rd_adr = root.h_bus.get('adr', None)
     rdproc = HDLComb()
     if rd_adr is not None:
@@ -639,30 +996,50 @@ def add_read_process(root, module, isigs):
     if root.h_max_delay >= 1:
         rdproc.sensitivity.extend([root.h_reg_rdat_int, root.h_rd_ack1_int,
                                    isigs.rd_int])
+        if root.h_rd_ack_reg is not root.h_rd_ack1_int:
+            rdproc.sensitivity.append(root.h_rd_ack_reg)
     module.stmts.append(rdproc)
 
     # All the read are ack'ed (including the read to unassigned addresses).
     rdproc.stmts.append(HDLComment("By default ack read requests"))
     rdproc.stmts.append(HDLAssign(rd_data,
                                   HDLReplicate(bit_0, root.c_word_bits)))
-    rdproc.stmts.append(HDLAssign(rd_ack, bit_1))
+    if root.h_rd_reg_sel is not None:
+        rdproc.stmts.append(HDLAssign(root.h_rd_reg_sel, bit_0))
+    if 'rd' in root.h_pipeline:
+        # The ack is registered, so it must be set only for a request.
+        if root.h_max_delay < 1:
+            rdproc.sensitivity.append(isigs.rd_int)
+        rdproc.stmts.append(HDLAssign(rd_ack, isigs.rd_int))
+    else:
+        rdproc.stmts.append(HDLAssign(rd_ack, bit_1))
 
     def add_read(s, n, off):
         if n is not None:
             if isinstance(n, tree.Reg):
                 s.append(HDLComment(n.name))
                 s.append(HDLAssign(rd_data, root.h_reg_rdat_int))
-                s.append(HDLAssign(rd_ack, root.h_rd_ack1_int))
+                s.append(HDLAssign(rd_ack, root.h_rd_ack_reg))
+                if root.h_rd_reg_sel is not None:
+                    s.append(HDLAssign(root.h_rd_reg_sel, bit_1))
             elif isinstance(n, tree.Submap):
                 s.append(HDLComment("Submap {}".format(n.name)))
                 if n.c_interface == 'wb-32-be':
                     s.append(HDLAssign(rd_data, n.h_bus['dato']))
                     rdproc.stmts.append(HDLAssign(n.h_rd, bit_0))
                     s.append(HDLAssign(n.h_rd, isigs.rd_int))
-                    s.append(HDLAssign(isigs.rd_ack, n.h_bus['ack']))
+                    s.append(HDLAssign(rd_ack, n.h_bus['ack']))
                     return
                 elif n.c_interface == 'sram':
                     return
+                elif n.c_interface == 'axi4-lite-32':
+                    rdproc.sensitivity.extend([n.h_bus['rdata'],
+                                               n.h_bus['rvalid']])
+                    s.append(HDLAssign(rd_data, n.h_bus['rdata']))
+                    rdproc.stmts.append(HDLAssign(n.h_rd, bit_0))
+                    s.append(HDLAssign(n.h_rd, isigs.rd_int))
+                    s.append(HDLAssign(rd_ack, n.h_bus['rvalid']))
+                    return
                 else:
                     raise AssertionError
             elif isinstance(n, tree.Array):
@@ -684,20 +1061,32 @@ def add_read_process(root, module, isigs):
                 raise AssertionError
 
     stmts = []
-    add_decoder(root, stmts, rd_adr, root, add_read)
+    add_decoder(root, stmts, rd_adr, add_read)
     rdproc.stmts.extend(stmts)
 
-def add_write_process(root, module, isigs):
-    # Register write
-    wrproc = HDLSync(root.h_bus['clk'], root.h_bus['rst'])
-    module.stmts.append(wrproc)
-    if root.h_ram_wr_dly is not None:
-        wrproc.rst_stmts.append(HDLAssign(root.h_ram_wr_dly, bit_0))
-    wr_if = HDLIfElse(HDLAnd(HDLEq(isigs.wr_int, bit_1),
-                             HDLEq(isigs.wr_ack, bit_0)))
-    wr_if.else_stmts.append(HDLAssign(isigs.wr_ack, bit_0))
-    wr_data = root.h_bus['dati']
+def add_write_lanes(root, s, f, off, r, wr_data, wr_strb, assign):
+    """Write field F (whose value is R) from WR_DATA at offset OFF, byte
+       per byte according to WR_STRB.  ASSIGN writes the whole field."""
+    d_lo, d_hi, v_lo, _ = field_range(root, f, off)
+    lanes = list(range(d_lo // tree.BYTE_SIZE, d_hi // tree.BYTE_SIZE + 1))
+    for b in lanes:
+        lane_if = HDLIfElse(HDLEq(Slice_or_Index(wr_strb, b, 1), bit_1))
+        lane_if.else_stmts = None
+        s.append(lane_if)
+        if len(lanes) == 1:
+            lane_if.then_stmts.append(assign)
+        else:
+            lo = max(d_lo, b * tree.BYTE_SIZE)
+            hi = min(d_hi, (b + 1) * tree.BYTE_SIZE - 1)
+            lane_if.then_stmts.append(HDLAssign(
+                Slice_or_Index(r, v_lo + lo - d_lo, hi - lo + 1),
+                Slice_or_Index(wr_data, lo, hi - lo + 1)))
+
 
+def write_reg_func(root, wrproc, wr_data, wr_strb=None):
+    """Return the function that writes WR_DATA to the fields of a register.
+       The reset values are added to the process WRPROC.  If WR_STRB is
+       not None, only the bytes whose strobe is set are written."""
     def add_write_reg(s, n, off):
         for f in n.children:
             # Reset code
@@ -715,12 +1104,29 @@ def add_write_process(root, module, isigs):
             reg, dat = field_decode(root, n, f, off, r, wr_data)
             if reg is None:
                 continue
-            s.append(HDLAssign(reg, dat))
+            if wr_strb is None:
+                s.append(HDLAssign(reg, dat))
+            else:
+                add_write_lanes(root, s, f, off, r, wr_data, wr_strb,
+                                HDLAssign(reg, dat))
             if f.h_wport is not None:
                 s.append(HDLAssign(f.h_wport, bit_1))
                 wrproc.rst_stmts.append(HDLAssign(f.h_wport, bit_0))
                 wrproc.sync_stmts.append(HDLAssign(f.h_wport, bit_0))
 
+    return add_write_reg
+
+
+def add_write_process(root, module, isigs):
+    # Register write
+    wrproc = HDLSync(root.h_bus['clk'], root.h_bus['rst'])
+    module.stmts.append(wrproc)
+    if root.h_ram_wr_dly is not None:
+        wrproc.rst_stmts.append(HDLAssign(root.h_ram_wr_dly, bit_0))
+    wr_if = HDLIfElse(HDLAnd(HDLEq(isigs.wr_int, bit_1),
+                             HDLEq(isigs.wr_ack, bit_0)))
+    wr_if.else_stmts.append(HDLAssign(isigs.wr_ack, bit_0))
+    add_write_reg = write_reg_func(root, wrproc, isigs.wr_dat)
 
     def add_write(s, n, off):
         if n is not None:
@@ -739,6 +1145,13 @@ def add_write_process(root, module, isigs):
                 elif n.c_interface == 'sram':
                     s.append(HDLAssign(n.h_wr_o, bit_1))
                     return
+                elif n.c_interface == 'axi4-lite-32':
+                    # Keep the request until the response.
+                    wrproc.rst_stmts.append(HDLAssign(n.h_wr, bit_0))
+                    wr_if.then_stmts.append(HDLAssign(n.h_wr, bit_0))
+                    s.append(HDLAssign(n.h_wr, HDLNot(n.h_bus['bvalid'])))
+                    s.append(HDLAssign(isigs.wr_ack, n.h_bus['bvalid']))
+                    return
                 else:
                     raise AssertionError
             elif isinstance(n, tree.Array):
@@ -760,11 +1173,121 @@ def add_write_process(root, module, isigs):
         # addresses)
         s.append(HDLAssign(isigs.wr_ack, bit_1))
     then_stmts = []
-    add_decoder(root, then_stmts, root.h_bus.get('adr', None), root, add_write)
+    add_decoder(root, then_stmts, isigs.wr_adr, add_write)
     wr_if.then_stmts.extend(then_stmts)
     wrproc.sync_stmts.append(wr_if)
 
 
+def check_axi4lite(root):
+    """Raise HdlError for the features not handled with an AXI4-Lite
+       bus."""
+    for n in gather_children(root):
+        if isinstance(n, tree.Array):
+            raise HdlError("RAM {} is not supported with bus {}".format(
+                n.get_path(), root.bus))
+        elif isinstance(n, tree.Submap) and n.c_interface != root.bus:
+            raise HdlError("interface {} of submap {} is not supported with "
+                           "bus {}".format(n.c_interface, n.get_path(),
+                                           root.bus))
+    for attr in ['pipeline', 'read-mux-fanin']:
+        if root.get_extension('x_hdl', attr, None) is not None:
+            raise HdlError("x-hdl {} is not supported with bus {}".format(
+                attr, root.bus))
+
+
+def add_axi4lite_ack(root, module, req, ack, addr, sub_req, sub_ack):
+    """Assign ACK of the requests REQ.  The registers ack in the cycle of
+       the request (so a request can be handled every cycle), a submap acks
+       with its response (its channel SUB_ACK); the request is forwarded
+       to the submap with its signal SUB_REQ."""
+    submaps = [n for n in gather_children(root)
+               if isinstance(n, tree.Submap)]
+    if not submaps:
+        module.stmts.append(HDLAssign(ack, req))
+        return
+    proc = HDLComb()
+    if addr is not None:
+        proc.sensitivity.append(addr)
+    proc.sensitivity.append(req)
+    module.stmts.append(proc)
+    proc.stmts.append(HDLAssign(ack, req))
+    for n in submaps:
+        proc.stmts.append(HDLAssign(getattr(n, sub_req), bit_0))
+        proc.sensitivity.append(n.h_bus[sub_ack])
+
+    def add_ack(s, n, off):
+        s.append(HDLComment("Submap {}".format(n.name)))
+        s.append(HDLAssign(getattr(n, sub_req), req))
+        s.append(HDLAssign(ack, n.h_bus[sub_ack]))
+
+    # Only decode the submaps.
+    dec = prune_decoder(root.h_decoder, set([id(n) for n in submaps]))
+    stmts = []
+    add_block_decoder(root, stmts, addr, dec, add_ack)
+    proc.stmts.extend(stmts)
+
+
+def add_axi4lite_write_process(root, module, isigs):
+    bus = root.h_bus
+    add_axi4lite_ack(root, module, isigs.wr_int, isigs.wr_ack, isigs.wr_adr,
+                     'h_wr', 'bvalid')
+    wrproc = HDLSync(bus['clk'], bus['rst'])
+    wrproc.rst_stmts.append(HDLAssign(isigs.bvalid, bit_0))
+    # The response is set when the request is acked, and kept until it is
+    # accepted.
+    wr_if = HDLIfElse(HDLEq(isigs.wr_ack, bit_1))
+    wr_if.then_stmts.append(HDLAssign(isigs.bvalid, bit_1))
+    resp_if = HDLIfElse(HDLEq(bus['bready'], bit_1))
+    resp_if.else_stmts = None
+    resp_if.then_stmts.append(HDLAssign(isigs.bvalid, bit_0))
+    wr_if.else_stmts.append(resp_if)
+    add_write_reg = write_reg_func(root, wrproc, isigs.wr_dat, bus['wstrb'])
+
+    def add_write(s, n, off):
+        if isinstance(n, tree.Reg):
+            s.append(HDLComment(n.name))
+            if n.access in ['wo', 'rw']:
+                add_write_reg(s, n, off)
+
+    then_stmts = []
+    add_decoder(root, then_stmts, isigs.wr_adr, add_write)
+    wr_if.then_stmts.extend(then_stmts)
+    wrproc.sync_stmts.append(wr_if)
+    module.stmts.append(wrproc)
+
+
+def add_axi4lite_read_process(root, module, isigs):
+    bus = root.h_bus
+    add_axi4lite_ack(root, module, isigs.rd_int, isigs.rd_ack, isigs.rd_adr,
+                     'h_rd', 'rvalid')
+    rdproc = HDLSync(bus['clk'], bus['rst'])
+    rdproc.rst_stmts.append(HDLAssign(isigs.rvalid, bit_0))
+    # The data is read when the request is acked, and kept until it is
+    # accepted.  Unassigned addresses read as 0.
+    rd_if = HDLIfElse(HDLEq(isigs.rd_ack, bit_1))
+    rd_if.then_stmts.append(HDLAssign(isigs.rvalid, bit_1))
+    rd_if.then_stmts.append(HDLAssign(bus['rdata'],
+                                      HDLReplicate(bit_0, root.c_word_bits)))
+    resp_if = HDLIfElse(HDLEq(bus['rready'], bit_1))
+    resp_if.else_stmts = None
+    resp_if.then_stmts.append(HDLAssign(isigs.rvalid, bit_0))
+    rd_if.else_stmts.append(resp_if)
+    add_read_reg = read_reg_func(root, bus['rdata'])
+
+    def add_read(s, n, off):
+        if isinstance(n, tree.Submap):
+            s.append(HDLComment("Submap {}".format(n.name)))
+            s.append(HDLAssign(bus['rdata'], n.h_bus['rdata']))
+        else:
+            add_read_reg(s, n, off)
+
+    then_stmts = []
+    add_decoder(root, then_stmts, isigs.rd_adr, add_read)
+    rd_if.then_stmts.extend(then_stmts)
+    rdproc.sync_stmts.append(rd_if)
+    module.stmts.append(rdproc)
+
+
 def gen_hdl_header(root, isigs=None):
     module = HDLModule()
     module.name = root.name
@@ -777,6 +1300,8 @@ def gen_hdl_header(root, isigs=None):
     # Create the bus
     if root.bus == 'wb-32-be':
         expand_wishbone(root, module, isigs)
+    elif root.bus == 'axi4-lite-32':
+        expand_axi4lite(root, module, isigs)
     elif root.bus.startswith('cern-be-vme-'):
         names = root.bus[12:].split('-')
         err = names[0] == 'err'
@@ -793,6 +1318,65 @@ def gen_hdl_header(root, isigs=None):
     return module
 
 
+def get_pipeline(root):
+    """Return the list of the paths ('rd', 'wr') with a register stage,
+       according to the x-hdl pipeline attribute of ROOT."""
+    stages = {'none': [], 'rd': ['rd'], 'wr': ['wr'], 'all': ['rd', 'wr']}
+    pipeline = root.get_extension('x_hdl', 'pipeline', 'none')
+    if pipeline not in stages:
+        raise HdlError("incorrect x-hdl pipeline '{}' for {} (must be one "
+                       "of: {})".format(pipeline, root.name,
+                                        ', '.join(sorted(stages))))
+    return stages[pipeline]
+
+
+def add_write_pipeline(root, module, isigs):
+    """Register stage on the write requests: the request, the address and
+       the data are registered and kept until the request is acked."""
+    wr_req = HDLSignal('wr_req_d0')
+    module.decls.append(wr_req)
+    proc = HDLSync(root.h_bus['clk'], root.h_bus['rst'])
+    module.stmts.append(proc)
+    proc.rst_stmts.append(HDLAssign(wr_req, bit_0))
+    ack_if = HDLIfElse(HDLEq(isigs.wr_ack, bit_1))
+    proc.sync_stmts.append(ack_if)
+    ack_if.then_stmts.append(HDLAssign(wr_req, bit_0))
+    req_if = HDLIfElse(HDLEq(wr_req, bit_0))
+    req_if.else_stmts = None
+    ack_if.else_stmts = [req_if]
+    req_if.then_stmts.append(HDLAssign(wr_req, isigs.wr_int))
+    if isigs.wr_adr is not None:
+        wr_adr = HDLSignal('wr_adr_d0', isigs.wr_adr.size,
+                           lo_idx=isigs.wr_adr.lo_idx)
+        module.decls.append(wr_adr)
+        req_if.then_stmts.append(HDLAssign(wr_adr, isigs.wr_adr))
+        isigs.wr_adr = wr_adr
+    wr_dat = HDLSignal('wr_dat_d0', root.c_word_bits)
+    module.decls.append(wr_dat)
+    req_if.then_stmts.append(HDLAssign(wr_dat, isigs.wr_dat))
+    isigs.wr_int = wr_req
+    isigs.wr_dat = wr_dat
+
+
+def add_read_pipeline(root, module, isigs):
+    """Register stage on the output of the read mux (data and ack).  The
+       request is masked while the ack is output, so that a request that is
+       kept until its ack is not handled twice."""
+    rd_req = HDLSignal('rd_req_int')
+    module.decls.append(rd_req)
+    module.stmts.append(
+        HDLAssign(rd_req, HDLAnd(isigs.rd_int, HDLNot(isigs.rd_ack))))
+    isigs.rd_int = rd_req
+    isigs.rd_dat = HDLSignal('rd_dat_d0', root.c_word_bits)
+    isigs.rd_mux_ack = HDLSignal('rd_ack_d0')
+    module.decls.extend([isigs.rd_dat, isigs.rd_mux_ack])
+    proc = HDLSync(root.h_bus['clk'], root.h_bus['rst'])
+    module.stmts.append(proc)
+    proc.rst_stmts.append(HDLAssign(isigs.rd_ack, bit_0))
+    proc.sync_stmts.append(HDLAssign(isigs.rd_ack, isigs.rd_mux_ack))
+    proc.sync_stmts.append(HDLAssign(root.h_bus['dato'], isigs.rd_dat))
+
+
 def compute_max_delay(n):
     if isinstance(n, tree.Reg):
         return 1
@@ -812,6 +1396,10 @@ def generate_hdl(root):
     isigs = Isigs()
 
     root.h_max_delay = compute_max_delay(root)
+    root.h_pipeline = get_pipeline(root)
+    root.h_read_mux_fanin = get_read_mux_fanin(root)
+    if root.bus == 'axi4-lite-32':
+        check_axi4lite(root)
 
     module = gen_hdl_header(root, isigs)
 
@@ -833,14 +1421,41 @@ def generate_hdl(root):
     root.h_ram_wr_dly = None
     wire_regs(root, module, isigs, root)
 
+    # Address decoder, shared by the processes.
+    root.h_decoder = build_decoder(root)
+
+    if root.bus == 'axi4-lite-32':
+        module.stmts.append(HDLComment('Process for write requests.'))
+        add_axi4lite_write_process(root, module, isigs)
+        module.stmts.append(HDLComment('Process for read requests.'))
+        add_axi4lite_read_process(root, module, isigs)
+        return module
+
+    # Signals used by the processes for the requests and the read mux,
+    # replaced by registers when pipelined.
+    isigs.wr_adr = root.h_bus.get('adr', None)
+    isigs.wr_dat = root.h_bus['dati']
+    isigs.rd_dat = root.h_bus['dato']
+    isigs.rd_mux_ack = isigs.rd_ack
+    if root.h_pipeline:
+        module.stmts.append(HDLComment('Pipeline stages.'))
+    if 'wr' in root.h_pipeline:
+        add_write_pipeline(root, module, isigs)
+    if 'rd' in root.h_pipeline:
+        add_read_pipeline(root, module, isigs)
+
     module.stmts.append(HDLComment('Process for write requests.'))
     add_write_process(root, module, isigs)
 
+    # Register selection, only needed when the registers have their own ack.
+    root.h_rd_reg_sel = None
     if root.h_max_delay >= 1:
         root.h_reg_rdat_int = HDLSignal('reg_rdat_int', root.c_word_bits)
         module.decls.append(root.h_reg_rdat_int)
         root.h_rd_ack1_int = HDLSignal('rd_ack1_int')
         module.decls.append(root.h_rd_ack1_int)
+        # Register ack, when not the RAM ack.
+        root.h_rd_ack_reg = root.h_rd_ack1_int
         module.stmts.append(HDLComment('Process for registers read.'))
         add_read_reg_process(root, module, isigs)
 
@@ -375,3 +375,35 @@ class HDLMul(HDLBinary):
 
 class HDLSub(HDLBinary):
     pass
+
+
+class Dispatcher(object):
+    """Table of functions indexed by the class of the HDL nodes (used by
+       the printers).  A node is handled by the function registered for its
+       class or for its nearest base class."""
+    def __init__(self, name):
+        self.name = name
+        self.funcs = {}
+        self.cache = {}     # class -> function (including the base classes)
+
+    def register(self, *types):
+        "Decorator to register a function for TYPES."
+        def fun(f):
+            for t in types:
+                self.funcs[t] = f
+            self.cache = {}
+            return f
+        return fun
+
+    def lookup(self, n):
+        "Return the function for node N."
+        try:
+            return self.cache[type(n)]
+        except KeyError:
+            pass
+        for t in type(n).__mro__:
+            f = self.funcs.get(t)
+            if f is not None:
+                self.cache[type(n)] = f
+                return f
+        raise AssertionError("unhandled hdl {} {}".format(self.name, n))
@@ -45,28 +45,26 @@ def get_gena_gen(n, name, default=None):
     return gen.get(name, default)
 
 
-class Layout(tree.Visitor):
-    def __init__(self, word_size):
-        super(Layout, self).__init__()
-        self.address = 0
+class Layout(object):
+    "Parameters of the layout of a tree"
+    def __init__(self, word_size, submaps):
         self.word_size = word_size
         self.align_reg = True
+        self.submaps = submaps
 
-    def duplicate(self):
-        res = Layout(self.word_size)
-        res.align_reg = self.align_reg
-        return res
 
-    def compute_address(self, n):
-        if n.address is None or n.address == 'next':
-            self.address = align(self.address, n.c_align)
-        else:
-            if (n.address % n.c_align) != 0:
-                raise LayoutException(n,
-                    "unaligned address for {}".format(n.get_path()))
-            self.address = n.address
-        n.c_address = self.address
-        self.address += n.c_size
+def compute_address(n, address):
+    """Place N at or after ADDRESS (the end of the previous node).
+       Return the end of N."""
+    if n.address is None or n.address == 'next':
+        address = align(address, n.c_align)
+    else:
+        if (n.address % n.c_align) != 0:
+            raise LayoutException(n,
+                "unaligned address for {}".format(n.get_path()))
+        address = n.address
+    n.c_address = address
+    return address + n.c_size
 
 
 class LayoutException(Exception):
@@ -81,7 +79,9 @@ def layout_named(n):
             "missing name for {}".format(n.get_path()))
 
 
-def layout_field(f, parent, pos):
+def layout_field(f, parent, used):
+    """Layout field F of register PARENT.  USED is the mask of the bits
+       used by the previous fields.  Return the updated mask."""
     layout_named(f)
     # Check range is present
     if f.lo is None:
@@ -89,7 +89,7 @@ def layout_field(f, parent, pos):
             "missing range for field {}".format(f.get_path()))
     # Compute width
     if f.hi is None:
-        r = [f.lo]
+        hi = f.lo
         f.c_rwidth = 1
         f.c_iowidth = 1
     else:
@@ -99,30 +99,34 @@ def layout_field(f, parent, pos):
         elif f.hi == f.lo:
             raise LayoutException(f,
                 "one-bit range for field {}".format(f.get_path()))
-        r = range(f.lo, f.hi + 1)
+        hi = f.hi
         f.c_rwidth = f.hi - f.lo + 1
         f.c_iowidth = f.c_rwidth
     # Check for overlap
-    if r[-1] >= parent.width:
+    if hi >= parent.width:
         raise LayoutException(f,
             "field {} width overflows its register size".format(f.get_path()))
-    elif r[-1] >= parent.c_rwidth:
+    elif hi >= parent.c_rwidth:
         raise LayoutException(f,
             "field {} extends beyond register storage size".format(f.get_path()))
-    for i in r:
-        if pos[i] is None:
-            pos[i] = f
-        else:
-            raise LayoutException(f,
-                "field {} overlaps field {} in bit {}".format(
-                    f.get_path(), pos[i].get_path(), i))
+    mask = ((1 << f.c_rwidth) - 1) << f.lo
+    if used & mask:
+        # Report the lowest bit in common, and the field that uses it.
+        common = used & mask
+        i = (common & -common).bit_length() - 1
+        for other in parent.children:
+            if other.lo <= i <= (other.lo if other.hi is None else other.hi):
+                break
+        raise LayoutException(f,
+            "field {} overlaps field {} in bit {}".format(
+                f.get_path(), other.get_path(), i))
     # Check preset
     if f.preset is not None and f.preset >= (1 << f.c_rwidth):
         raise LayoutException(f,
             "incorrect preset value for field {}".format(f.get_path()))
+    return used | mask
 
 
-@Layout.register(tree.Reg)
 def layout_reg(lo, n):
     # doc: Width must be 8, 16, 32, 64
     # Maybe infer width from fields ?
@@ -185,20 +189,23 @@ def layout_reg(lo, n):
         n.c_align = align(n.c_size, lo.word_size)
     else:
         n.c_align = lo.word_size
-    names = set()
+    if n.children and isinstance(n.children[0], tree.FieldReg):
+        # Remove the artificial field of a previous layout.
+        del n.children[0]
+    n.c_names = {}
     if n.children:
         if n.type is not None:
             raise LayoutException(n,
                 "register {} with both a type and fields".format(n.get_path()))
         n.c_type = None
-        pos = [None] * n.width
+        used = 0
         for f in n.children:
-            if f.name in names:
+            if f.name in n.c_names:
                 raise LayoutException(f,
                     "field '{}' reuse a name in reg {}".format(
                         f.name, n.get_path()))
-            names.add(f.name)
-            layout_field(f, n, pos)
+            n.c_names[f.name] = f
+            used = layout_field(f, n, used)
     else:
         # Create the artificial field
         f = tree.FieldReg(n)
@@ -229,17 +236,59 @@ def layout_reg(lo, n):
 
 def compute_submap_absolute_filename(sm):
     filename = sm.filename
-    root = sm
-    while not isinstance(root, tree.Root):
-        root = root._parent
     if not os.path.isabs(filename):
-        filename = os.path.join(os.path.dirname(root.c_filename), filename)
+        filename = os.path.join(os.path.dirname(sm.get_root().c_filename),
+                                filename)
     return filename
 
 def load_submap(blk):
     sys.stderr.write('Loading {}...\n'.format(blk.filename))
     filename = compute_submap_absolute_filename(blk)
-    return cheby.parser.parse_yaml(filename)
+    return cheby.parser.parse_yaml(filename, blk.get_root().c_cache)
+
+
+def is_submap_inlined(n):
+    """True if the content of submap N is inlined in its parent.  In that
+       case the HDL generators annotate the nodes of the submap for this
+       instance, so its tree cannot be shared."""
+    return n.interface == 'include' or get_gena_gen(n, 'include') == 'internal'
+
+
+class SubmapRegistry(object):
+    """Per-run registry of the submaps.  Each file is loaded and laid out
+       only once, and its tree is shared by all the (not inlined) submaps
+       that instantiate it.  Shared trees must be considered as read-only."""
+    def __init__(self):
+        self.submaps = {}   # Absolute filename -> laid-out root
+        self.loading = set()
+        self.filenames = []  # Loaded files, in load order
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, n):
+        """Return the laid-out tree for submap N."""
+        filename = os.path.abspath(compute_submap_absolute_filename(n))
+        shared = not is_submap_inlined(n)
+        if shared and filename in self.submaps:
+            self.hits += 1
+            return self.submaps[filename]
+        if filename in self.loading:
+            raise LayoutException(n,
+                "recursive inclusion of '{}' by submap '{}'".format(
+                    n.filename, n.get_path()))
+        self.misses += 1
+        if filename not in self.filenames:
+            self.filenames.append(filename)
+        self.loading.add(filename)
+        try:
+            res = load_submap(n)
+            layout_cheby(res, self)
+        finally:
+            self.loading.discard(filename)
+        if shared:
+            self.submaps[filename] = res
+        return res
 
 
 def align_block(lo, n):
@@ -250,7 +299,7 @@ def align_block(lo, n):
         n.c_size = round_pow2(n.c_size)
         n.c_align = round_pow2(n.c_size)
 
-@Layout.register(tree.Submap)
+
 def layout_submap(lo, n):
     if n.filename is None:
         if n.size is None:
@@ -266,8 +315,7 @@ def layout_submap(lo, n):
         if n.size is not None:
             raise LayoutException(n,
                 "size given for submap '{}'".format(n.get_path()))
-        submap = load_submap(n)
-        layout_cheby(submap)
+        submap = lo.submaps.load(n)
         n.c_submap = submap
         n.c_size = n.c_submap.c_size
         if n.interface is None:
@@ -280,20 +328,20 @@ def layout_submap(lo, n):
                     n.get_path()))
     align_block(lo, n)
 
-@Layout.register(tree.Block)
-def layout_block(lo, n):
-    if n.children:
-        layout_composite(lo, n)
-    elif n.size is None:
+def layout_empty_block(lo, n):
+    if n.size is None:
         raise LayoutException(n,
             "no size in block '{}'".format(n.get_path()))
-    else:
-        n.c_size = n.size
+    n.c_size = n.size
+    align_block(lo, n)
+
+
+def leave_block(lo, n):
+    leave_composite(lo, n)
     align_block(lo, n)
 
 
-@Layout.register(tree.Array)
-def layout_array(lo, n):
+def enter_array(lo, n):
     # Sanity check
     if len(n.children) != 1:
         raise LayoutException(n,
@@ -301,7 +349,11 @@ def layout_array(lo, n):
     if n.repeat is None:
         raise LayoutException(n,
             "missing repeat count for {}".format(n.get_path()))
-    layout_composite(lo, n)
+    enter_composite(lo, n)
+
+
+def leave_array(lo, n):
+    leave_composite(lo, n)
     n.c_elsize = align(n.c_size, n.c_align)
     if n.align is None or n.align:
         # Align to power of 2.
@@ -315,31 +367,31 @@ def layout_array(lo, n):
     n.c_sel_bits = ilog2(n.c_size) - n.c_blk_bits
 
 
-@Layout.register(tree.CompositeNode)
-def layout_composite(lo, n):
+def enter_composite(lo, n):
     layout_named(n)
 
     # Check each child has a unique name.
-    names = set()
+    n.c_names = {}
     for c in n.children:
-        if c.name in names:
+        if c.name in n.c_names:
             raise LayoutException(c,
                 "child {} reuse name '{}'".format(c.get_path(), c.name))
-        names.add(c.name)
+        n.c_names[c.name] = c
 
-    # Compute size and alignment of children.
-    lo1 = lo.duplicate()
+
+def leave_composite(lo, n):
+    # Compute size and alignment from the children.
     max_align = 0
     for c in n.children:
-        lo1.visit(c)
         max_align = max(max_align, c.c_align)
     has_aligned = False
     for c in n.children:
         if isinstance(c, tree.ComplexNode) and (c.align is None or c.align):
             has_aligned = True
     n.c_size = 0
+    address = 0
     for c in n.children:
-        lo1.compute_address(c)
+        address = compute_address(c, address)
         n.c_size = max(n.c_size, c.c_address + c.c_size)
     n.c_align = max_align
     if n.size is not None:
@@ -359,6 +411,7 @@ def layout_composite(lo, n):
         n.c_sel_bits = 0
     # Keep children in order.
     n.c_sorted_children = sorted(n.children, key=(lambda x: x.c_address))
+    n.c_addresses = [c.c_address for c in n.c_sorted_children]
     # Check for no-overlap.
     last_addr = 0
     last_node = None
@@ -371,19 +424,71 @@ def layout_composite(lo, n):
         last_node = c
 
 
-@Layout.register(tree.Root)
-def layout_root(lo, n):
+def enter_root(lo, n):
     if not n.children:
         raise LayoutException(n, "empty description '{}'".format(n.name))
     n.c_address = 0
-    layout_composite(lo, n)
-
-
-def layout_cheby(n):
+    enter_composite(lo, n)
+
+
+def layout_enter(lo, n):
+    """Start the layout of N.  Return the function to be called once the
+       children of N have been laid out, or None if N is done."""
+    if isinstance(n, tree.Reg):
+        layout_reg(lo, n)
+    elif isinstance(n, tree.Submap):
+        layout_submap(lo, n)
+    elif isinstance(n, tree.Block):
+        if not n.children:
+            layout_empty_block(lo, n)
+        else:
+            enter_composite(lo, n)
+            return leave_block
+    elif isinstance(n, tree.Array):
+        enter_array(lo, n)
+        return leave_array
+    elif isinstance(n, tree.Root):
+        enter_root(lo, n)
+        return leave_composite
+    else:
+        raise AssertionError(n)
+    return None
+
+
+def layout_tree(lo, root, dirty=None):
+    """Layout ROOT and its children.  The children of a node are laid out
+       before the node itself (to compute its size), using an explicit stack
+       so that the depth of the tree is not limited by the python stack.
+       If DIRTY (a set of nodes) is not None, only the nodes of DIRTY and
+       the nodes never laid out are laid out, the others are kept."""
+    stack = []  # List of (node, leave function, iterator on the children)
+    n = root
+    while True:
+        leave = layout_enter(lo, n)
+        if leave is not None:
+            stack.append((n, leave, iter(n.children)))
+        n = None
+        while stack:
+            parent, leave, children = stack[-1]
+            n = next(children, None)
+            if n is not None:
+                if dirty is None or n in dirty or n.c_size is None:
+                    break
+                continue
+            stack.pop()
+            leave(lo, parent)
+        if n is None:
+            return
+
+
+def make_layout(n, submaps):
+    """Return the Layout for root N (according to its bus)."""
     flag_align_reg = True
     n.c_buserr = False
     if n.bus is None or n.bus == 'wb-32-be':
         n.c_word_size = 4
+    elif n.bus == 'axi4-lite-32':
+        n.c_word_size = 4
     elif n.bus.startswith('cern-be-vme-'):
         params = n.bus[12:].split('-')
         if params[0] == 'err':
@@ -409,6 +514,60 @@ def layout_cheby(n):
         flag_align_reg = False
     else:
         raise LayoutException(n, "unknown bus '{}'".format(n.bus))
-    lo = Layout(n.c_word_size)
+    lo = Layout(n.c_word_size, submaps)
     lo.align_reg = flag_align_reg
-    lo.visit(n)
+    return lo
+
+
+def layout_cheby(n, submaps=None):
+    """Layout tree N.  SUBMAPS is the SubmapRegistry used to load the
+       submaps; a new one is created if None."""
+    if submaps is None:
+        submaps = SubmapRegistry()
+    layout_tree(make_layout(n, submaps), n)
+    # Fields have been added to the registers without fields.
+    tree.invalidate_caches()
+
+
+class IncrementalLayout(object):
+    """Layout of a tree which is edited.  The tree is first fully laid out.
+       After an edit, the nodes changed must be marked with mark_dirty
+       (a changed field or a new field: its register; a new or removed
+       child: its parent, or the new child) and relayout() lays out
+       only these nodes and their ancestors (the addresses of the other
+       nodes are recomputed by their parent).  Marking a node also
+       invalidates the cached paths and the children index of the node.
+       The submaps already loaded are reused.  The tree must not be
+       expanded (see expand_hdl)."""
+    def __init__(self, root, submaps=None):
+        if submaps is None:
+            submaps = SubmapRegistry()
+        self.root = root
+        self.submaps = submaps
+        self.dirty = set()
+        self.full = False
+        layout_cheby(root, submaps)
+
+    def mark_dirty(self, n):
+        if n is self.root:
+            # The bus may have changed: everything has to be laid out.
+            self.full = True
+        # Children may have been added, removed or renamed.
+        tree.invalidate_caches()
+        while n is not None:
+            if isinstance(n, tree.ChildrenByName):
+                n.c_names = None
+            if n in self.dirty:
+                break
+            self.dirty.add(n)
+            n = n._parent
+
+    def relayout(self):
+        if self.full:
+            layout_cheby(self.root, self.submaps)
+        elif self.dirty:
+            layout_tree(make_layout(self.root, self.submaps), self.root,
+                        self.dirty)
+            tree.invalidate_caches()
+        self.dirty = set()
+        self.full = False
@@ -0,0 +1,128 @@
+"""Lookup of the register at an address.
+
+   The index is built from a laid-out tree.  The registers of the blocks are
+   flattened into a list of intervals sorted by address, so that an address
+   is resolved with a binary search.  Arrays are not unrolled: an array is
+   a single interval, and the address is resolved in the index of its
+   element.  Likewise, a submap is a single interval with the index of the
+   submap tree (built once for all the instances of a shared submap)."""
+
+import bisect
+import cheby.tree as tree
+
+
+class Location(object):
+    """Result of a lookup.
+       :var node: the register (or the generic submap or the empty block).
+       :var path: the path of the node, with the indexes of the arrays.
+       :var indexes: the indexes of the arrays, outer first.
+       :var offset: the offset of the address within the node.
+       :var fields: the fields of the addressed word of the register."""
+    def __init__(self, node, path, indexes, offset, fields):
+        self.node = node
+        self.path = path
+        self.indexes = indexes
+        self.offset = offset
+        self.fields = fields
+
+
+class AddressIndex(object):
+    """Index of the content of composite node N.  The addresses are relative
+       to N.  INDEXES caches the indexes of the submap trees."""
+    def __init__(self, n, indexes=None):
+        if indexes is None:
+            indexes = {}
+        self.entries = []   # (start, end, name, node, index of the content)
+        self.add_children(n, 0, '', indexes)
+        self.entries.sort(key=lambda e: e[0])
+        self.starts = [e[0] for e in self.entries]
+
+    def add_children(self, n, base, prefix, indexes):
+        for c in n.children:
+            addr = base + c.c_address
+            name = prefix + '/' + c.name
+            sub = None
+            if isinstance(c, tree.Array):
+                sub = AddressIndex(c, indexes)
+            elif isinstance(c, tree.Submap):
+                if c.filename is not None:
+                    sub = indexes.get(id(c.c_submap))
+                    if sub is None:
+                        sub = AddressIndex(c.c_submap, indexes)
+                        indexes[id(c.c_submap)] = sub
+            elif isinstance(c, tree.Block) and c.children:
+                self.add_children(c, addr, name, indexes)
+                continue
+            self.entries.append((addr, addr + c.c_size, name, c, sub))
+
+    def find(self, addr):
+        """Return the entry that contains ADDR, or None."""
+        i = bisect.bisect_right(self.starts, addr) - 1
+        if i < 0:
+            return None
+        e = self.entries[i]
+        if addr >= e[1]:
+            return None
+        return e
+
+
+def word_fields(reg, offset, word_size):
+    """Return the fields of REG in the word at byte OFFSET (big endian)."""
+    off = offset - offset % word_size
+    lo = (reg.c_size - word_size - off) * tree.BYTE_SIZE
+    hi = lo + word_size * tree.BYTE_SIZE - 1
+    return [f for f in reg.children
+            if f.lo <= hi and (f.lo if f.hi is None else f.hi) >= lo]
+
+
+class Lookup(object):
+    "Lookup of the addresses of the laid-out tree ROOT"
+    def __init__(self, root):
+        self.root = root
+        self.index = AddressIndex(root)
+
+    def lookup(self, addr):
+        """Return the Location of ADDR, or None if ADDR is not mapped."""
+        index = self.index
+        path = '/' + self.root.name
+        base = 0
+        indexes = []
+        while True:
+            e = index.find(addr - base)
+            if e is None:
+                return None
+            start, _, name, n, sub = e
+            path += name
+            base += start
+            if isinstance(n, tree.Array):
+                i = (addr - base) // n.c_elsize
+                indexes.append(i)
+                path += '[{}]'.format(i)
+                base += i * n.c_elsize
+            if sub is None:
+                break
+            index = sub
+        offset = addr - base
+        if isinstance(n, tree.Reg):
+            fields = word_fields(n, offset, self.root.c_word_size)
+        else:
+            fields = []
+        return Location(n, path, indexes, offset, fields)
+
+
+def print_lookup(fd, root, addrs):
+    """Write the location of each address of ADDRS in ROOT."""
+    lk = Lookup(root)
+    for addr in addrs:
+        loc = lk.lookup(addr)
+        if loc is None:
+            fd.write('0x{:08x}: not mapped\n'.format(addr))
+            continue
+        fd.write('0x{:08x}: {} +0x{:x}\n'.format(addr, loc.path, loc.offset))
+        for f in loc.fields:
+            if f.name is None:
+                continue
+            if f.hi is None:
+                fd.write('  {:02}:    {}\n'.format(f.lo, f.name))
+            else:
+                fd.write('  {:02}-{:02}: {}\n'.format(f.lo, f.hi, f.name))
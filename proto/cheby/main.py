@@ -3,10 +3,19 @@ import sys
 import os.path
 import time
 import argparse
+import contextlib
+import multiprocessing
+import cProfile
 import cheby.parser
+import cheby.cache
+import cheby.depfile
+import cheby.outfile
+import cheby.timing
 import cheby.verilog_parser
 import cheby.pprint as pprint
 import cheby.sprint as sprint
+import cheby.lookup as lookup
+import cheby.compiled as compiled
 import cheby.cprint as cprint
 import cheby.gen_laychk as gen_laychk
 import cheby.layout as layout
@@ -22,6 +31,13 @@ import cheby.gen_wbgen_hdl as gen_wbgen_hdl
 import cheby.gen_wb_wrapper_hdl as gen_wb_wrapper_hdl
 
 
+def parse_address(s):
+    try:
+        return int(s, 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid address '{}'".format(s))
+
+
 def decode_args():
     aparser = argparse.ArgumentParser(description='cheby utility')
     aparser.add_argument('--print-pretty', action='store_true',
@@ -34,8 +50,15 @@ def decode_args():
                          help='display the expanded input in YAML')
     aparser.add_argument('--print-memmap', action='store_true',
                          help='display the layout without fields')
+    aparser.add_argument('--lookup', action='append', type=parse_address,
+                         metavar='ADDR',
+                         help='display the register (and its fields) at '
+                              'address ADDR (can be repeated)')
     aparser.add_argument('--print-c', action='store', nargs='?', const='.',
                          help='display the c header file')
+    aparser.add_argument('--save-compiled', action='store_true',
+                         help='save the laid-out tree in binary form (for '
+                              'cheby.ual)')
     aparser.add_argument('--print-c-check-layout', action='store_true',
                          help='generate c file to check layout of the header')
     aparser.add_argument('--gen-vhdl', action='store_true',
@@ -56,100 +79,359 @@ def decode_args():
                          help='Verilog input file for wishbone wrapper')
     aparser.add_argument('--verilog-mod-name', default='',
                          help='Verilog input module name for wishbone wrapper')
+    aparser.add_argument('--no-timestamp', action='store_true',
+                         help='do not put the date in the generated files')
+    aparser.add_argument('--yaml-events', action='store_true',
+                         help='build the tree from the yaml events (uses '
+                              'less memory for big files)')
+    aparser.add_argument('--cache-dir',
+                         help='directory to cache the parsed files')
+    aparser.add_argument('--submap-stats', action='store_true',
+                         help='display the number of shared submaps')
+    aparser.add_argument('-j', '--jobs', type=int, default=1,
+                         help='number of files handled in parallel')
+    aparser.add_argument('-o', '--output',
+                         help='output file ({name} is replaced by the '
+                              'input file name without extension)')
+    aparser.add_argument('--output-dir',
+                         help='write each generated file in this directory')
+    aparser.add_argument('--depfile',
+                         help='write the make dependencies of the generated '
+                              'files ({name} is replaced as for --output)')
+    aparser.add_argument('--if-changed', action='store_true',
+                         help='do not regenerate the files if the inputs '
+                              'listed in the depfile are unchanged')
+    aparser.add_argument('--time-stages', action='store_true',
+                         help='display the time and memory used by each '
+                              'stage')
+    aparser.add_argument('--profile',
+                         help='write the python profile of the run (in the '
+                              'main process only) to this file')
     aparser.add_argument('FILE', nargs='+')
 
-    return aparser.parse_args()
+    args = aparser.parse_args()
+    if args.depfile is not None \
+       and args.output is None and args.output_dir is None:
+        aparser.error('--depfile requires --output or --output-dir')
+    if args.if_changed and args.depfile is None:
+        aparser.error('--if-changed requires --depfile')
+    if len(args.FILE) > 1:
+        for opt, val in [('--output', args.output),
+                         ('--depfile', args.depfile)]:
+            if val is not None and '{name}' not in val:
+                aparser.error('{} must contain {{name}} with several input '
+                              'files'.format(opt))
+    return args
+
 
+class Files(object):
+    "Files read and generated while handling an input file"
+    def __init__(self, fd, output_dir):
+        self.fd = fd
+        self.output_dir = output_dir
+        self.inputs = []
+        self.outputs = []
+
+    @contextlib.contextmanager
+    def open(self, name):
+        """Return the stream for generated file NAME: the file in the
+           output directory in --output-dir mode, the output otherwise."""
+        if self.output_dir is None:
+            yield self.fd
+        else:
+            name = os.path.join(self.output_dir, name)
+            self.outputs.append(name)
+            with cheby.outfile.OutputFile(name) as f:
+                yield f
 
-def handle_file(args, filename, vfilename, vname):
-    t = cheby.parser.parse_yaml(filename)
 
-    layout.layout_cheby(t)
+def handle_file(fd, args, filename, vfilename, vname, cache=None,
+                timer=None):
+    """Generate the outputs for FILENAME.  Return the Files.
+       The stages are timed by TIMER (if not None)."""
+    if timer is None:
+        timer = cheby.timing.NullTimer()
+    files = Files(fd, args.output_dir)
+    files.inputs.append(filename)
+    with timer.stage('parse_yaml'):
+        t = cheby.parser.parse_yaml(filename, cache)
+
+    with timer.stage('layout_cheby'):
+        submaps = layout.SubmapRegistry()
+        layout.layout_cheby(t, submaps)
+    files.inputs.extend(submaps.filenames)
+    if args.submap_stats:
+        sys.stderr.write("{}: submaps: {} loaded, {} shared\n".format(
+            filename, submaps.misses, submaps.hits))
 
     if args.print_pretty:
-        pprint.pprint_cheby(sys.stdout, t)
+        with timer.stage('print_pretty'):
+            pprint.pprint_cheby(fd, t)
     if args.print_memmap:
-        sprint.sprint_cheby(sys.stdout, t, False)
+        with timer.stage('print_memmap'):
+            sprint.sprint_cheby(fd, t, False)
+    if args.lookup:
+        with timer.stage('lookup'):
+            lookup.print_lookup(fd, t, args.lookup)
     if args.print_simple:
-        sprint.sprint_cheby(sys.stdout, t, True)
+        with timer.stage('print_simple'):
+            sprint.sprint_cheby(fd, t, True)
     if args.print_c is not None:
-        if args.print_c == '-':
-            cprint.cprint_cheby(sys.stdout, t)
-        else:
-            if args.print_c == '.':
-                name = t.name + '.h'
+        with timer.stage('cprint'):
+            if args.print_c == '-':
+                with files.open(t.name + '.h') as out:
+                    cprint.cprint_cheby(out, t)
             else:
-                name = args.print_c
-            fd = open(name, 'w')
-            cprint.cprint_cheby(fd, t)
-            fd.close()
+                if args.print_c == '.':
+                    name = t.name + '.h'
+                    if args.output_dir is not None:
+                        name = os.path.join(args.output_dir, name)
+                else:
+                    name = args.print_c
+                files.outputs.append(name)
+                with cheby.outfile.OutputFile(name) as cfd:
+                    cprint.cprint_cheby(cfd, t)
+    if args.save_compiled:
+        with timer.stage('save_compiled'):
+            name = t.name + compiled.SUFFIX
+            if args.output_dir is not None:
+                name = os.path.join(args.output_dir, name)
+            files.outputs.append(name)
+            with cheby.outfile.OutputFile(name) as out:
+                compiled.save_compiled(out, t)
     if args.print_c_check_layout:
-        gen_laychk.gen_chklayout_cheby(sys.stdout, t)
+        with timer.stage('gen_laychk'):
+            with files.open(t.name + '.c') as out:
+                gen_laychk.gen_chklayout_cheby(out, t)
     if args.gen_encore:
-        print_encore.print_encore(sys.stdout, t)
-    if args.gen_gena_memmap:
-        h = gen_gena_memmap.gen_gena_memmap(t)
-        print_vhdl.print_vhdl(sys.stdout, h)
+        with timer.stage('print_encore'):
+            with files.open(t.name + '.csv') as out:
+                print_encore.print_encore(out, t)
+    if args.gen_gena_memmap or args.gen_gena_regctrl:
+        # Also needed by regctrl.
+        with timer.stage('gena_memmap'):
+            h = gen_gena_memmap.gen_gena_memmap(t)
+        if args.gen_gena_memmap:
+            with timer.stage('print_vhdl'):
+                with files.open('MemMap_' + t.name + '.vhd') as out:
+                    print_vhdl.print_vhdl(out, h)
     # Decode x-hdl
-    expand_hdl.expand_hdl(t)
+    with timer.stage('expand_hdl'):
+        expand_hdl.expand_hdl(t)
     if args.print_simple_expanded:
-        sprint.sprint_cheby(sys.stdout, t, True)
+        with timer.stage('print_simple'):
+            sprint.sprint_cheby(fd, t, True)
     if args.print_pretty_expanded:
-        pprint.pprint_cheby(sys.stdout, t)
+        with timer.stage('print_pretty'):
+            pprint.pprint_cheby(fd, t)
     if args.gen_gena_regctrl:
-        if not args.gen_gena_memmap:
-            gen_gena_memmap.gen_gena_memmap(t)
-        h = gen_gena_regctrl.gen_gena_regctrl(t)
-        print_vhdl.print_vhdl(sys.stdout, h)
+        with timer.stage('gena_regctrl'):
+            h = gen_gena_regctrl.gen_gena_regctrl(t)
+        with timer.stage('print_vhdl'):
+            with files.open('RegCtrl_' + t.name + '.vhd') as out:
+                print_vhdl.print_vhdl(out, h)
     if args.gen_wbgen_vhdl:
-        h = gen_wbgen_hdl.expand_hdl(t)
+        with timer.stage('wbgen_hdl'):
+            h = gen_wbgen_hdl.expand_hdl(t)
         (basename, _) = os.path.splitext(os.path.basename(filename))
-        sys.stdout.write(
+        if args.no_timestamp:
+            created = ''
+        else:
+            created = '-- Created        : {}\n'.format(
+                time.strftime("%a %b %d %X %Y"))
+        with timer.stage('print_vhdl'), \
+             files.open(basename + '.vhdl') as out:
+            out.write(
 """---------------------------------------------------------------------------------------
 -- Title          : Wishbone slave core for {name}
 ---------------------------------------------------------------------------------------
 -- File           : {basename}.vhdl
 -- Author         : auto-generated by wbgen2 from {basename}.wb
--- Created        : {date}
--- Standard       : VHDL'87
+{created}-- Standard       : VHDL'87
 ---------------------------------------------------------------------------------------
 -- THIS FILE WAS GENERATED BY wbgen2 FROM SOURCE FILE {basename}.wb
 -- DO NOT HAND-EDIT UNLESS IT'S ABSOLUTELY NECESSARY!
 ---------------------------------------------------------------------------------------
 
-""".format(name=t.description, basename=basename,
-           date=time.strftime("%a %b %d %X %Y")))
-        print_vhdl.style = 'wbgen'
-        print_vhdl.print_vhdl(sys.stdout, h)
+""".format(name=t.description, basename=basename, created=created))
+            print_vhdl.style = 'wbgen'
+            try:
+                print_vhdl.print_vhdl(out, h)
+            finally:
+                # Do not change the style of the other VHDL files.
+                print_vhdl.style = None
+    if args.gen_vhdl or args.gen_verilog or args.gen_verilog_wb_wrapper:
+        with timer.stage('gen_name_root'):
+            gen_name.gen_name_root(t)
     if args.gen_vhdl or args.gen_verilog:
-        gen_name.gen_name_root(t)
-        h = gen_hdl.generate_hdl(t)
+        with timer.stage('generate_hdl'):
+            h = gen_hdl.generate_hdl(t)
         if args.gen_vhdl:
-            print_vhdl.print_vhdl(sys.stdout, h)
+            with timer.stage('print_vhdl'):
+                with files.open(t.name + '.vhd') as out:
+                    print_vhdl.print_vhdl(out, h)
         if args.gen_verilog:
-            print_verilog.print_verilog(sys.stdout, h)
+            with timer.stage('print_verilog'):
+                with files.open(t.name + '.v') as out:
+                    print_verilog.print_verilog(out, h)
     if args.gen_verilog_wb_wrapper:
-        v = cheby.verilog_parser.parse_verilog(vfilename)
-        gen_name.gen_name_root(t)
-        h = gen_wb_wrapper_hdl.generate_wb_wrapper_hdl(t, v, vname)
-        print_verilog.print_verilog(sys.stdout, h)
+        files.inputs.append(vfilename)
+        with timer.stage('wb_wrapper_hdl'):
+            v = cheby.verilog_parser.parse_verilog(vfilename)
+            h = gen_wb_wrapper_hdl.generate_wb_wrapper_hdl(t, v, vname)
+        with timer.stage('print_verilog'):
+            with files.open(t.name + '_wrapper.v') as out:
+                print_verilog.print_verilog(out, h)
+    return files
+
+
+class Buffer(object):
+    "Output of a file handled by a job"
+    def __init__(self):
+        self.buffer = []
+
+    def write(self, str):
+        self.buffer.append(str)
+
+    def getvalue(self):
+        return ''.join(self.buffer)
+
+
+def output_filename(pattern, filename):
+    name, _ = os.path.splitext(os.path.basename(filename))
+    return pattern.format(name=name)
+
+
+# Options that don't change the generated files.
+ignored_options = ['FILE', 'jobs', 'cache_dir', 'submap_stats',
+                   'depfile', 'if_changed', 'time_stages', 'profile',
+                   'yaml_events']
+
+
+def generation_options(args):
+    """Return ARGS as a string, for the depfile stamp."""
+    return repr(sorted([(k, v) for k, v in vars(args).items()
+                        if k not in ignored_options]))
+
+
+def is_up_to_date(args, f):
+    """True if --if-changed is set and the outputs for F don't need to
+       be generated."""
+    return args.if_changed and cheby.depfile.is_up_to_date(
+        output_filename(args.depfile, f), generation_options(args))
+
+
+def process_file(fd, args, f, cache):
+    """Handle file F, return the error message or None in case of success."""
+    if args.time_stages:
+        timer = cheby.timing.StageTimer()
+    else:
+        timer = None
+    try:
+        files = handle_file(fd, args, f, args.verilog_in_file,
+                            args.verilog_mod_name, cache, timer)
+    except cheby.parser.ParseException as e:
+        return "{}:parse error: {}".format(f, e.msg)
+    except layout.LayoutException as e:
+        return "{}:layout error: {}".format(
+            e.node.get_root().c_filename, e.msg)
+    except gen_hdl.HdlError as e:
+        return "{}:HDL error: {}".format(f, e.msg)
+    if args.depfile is not None:
+        targets = files.outputs
+        if args.output is not None:
+            targets.insert(0, output_filename(args.output, f))
+        cheby.depfile.write_depfile(output_filename(args.depfile, f),
+                                    targets, files.inputs,
+                                    generation_options(args))
+    if timer is not None:
+        timer.report(sys.stderr, f)
+    return None
+
+
+def open_cache(args):
+    if args.cache_dir is not None:
+        return cheby.cache.Cache(args.cache_dir)
+    else:
+        return None
+
+
+def run_job(job):
+    """Handle a file in a worker process."""
+    args, f = job
+    cheby.parser.yaml_events = args.yaml_events
+    return handle_job(args, f, open_cache(args))
+
+
+def handle_job(args, f, cache):
+    """Handle file F.
+       Return the output (None if up to date), the error message and the
+       time spent."""
+    start = time.time()
+    if is_up_to_date(args, f):
+        return None, None, time.time() - start
+    fd = Buffer()
+    err = process_file(fd, args, f, cache)
+    return fd.getvalue(), err, time.time() - start
+
+
+def main_jobs(args):
+    """Handle the files, in parallel using ARGS.jobs processes if greater
+       than 1.  The outputs are written in the order of the files, and all
+       the errors are reported.  The files are timed when run in parallel
+       or with --time-stages."""
+    if args.jobs > 1:
+        # The generators have global state, so use a new process for each
+        # file to get the same result as separate runs.
+        pool = multiprocessing.Pool(args.jobs, maxtasksperchild=1)
+        results = pool.imap(run_job, [(args, f) for f in args.FILE])
+    else:
+        pool = None
+        cache = open_cache(args)
+        results = (handle_job(args, f, cache) for f in args.FILE)
+    show_time = args.jobs > 1 or args.time_stages
+    nerrs = 0
+    try:
+        for f, (out, err, t) in zip(args.FILE, results):
+            if err is not None:
+                sys.stderr.write(err + '\n')
+                nerrs += 1
+            elif out is None:
+                pass
+            elif args.output is not None:
+                with cheby.outfile.OutputFile(
+                        output_filename(args.output, f)) as fd:
+                    fd.write(out)
+            else:
+                sys.stdout.write(out)
+            if show_time:
+                sys.stderr.write("{}: {:.3f}s\n".format(f, t))
+    finally:
+        if pool is not None:
+            # All the results have been read, unless a job failed.
+            pool.terminate()
+            pool.join()
+    if nerrs:
+        sys.exit(2)
+
+
+def run(args):
+    cheby.parser.yaml_events = args.yaml_events
+    if args.output_dir is not None and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    main_jobs(args)
 
 
 def main():
     args = decode_args()
-    for f in args.FILE:
+    if args.profile is None:
+        run(args)
+    else:
+        prof = cProfile.Profile()
         try:
-            handle_file(args, f, args.verilog_in_file, args.verilog_mod_name)
-        except cheby.parser.ParseException as e:
-            sys.stderr.write("{}:parse error: {}\n".format(f, e.msg))
-            sys.exit(2)
-        except layout.LayoutException as e:
-            sys.stderr.write("{}:layout error: {}\n".format(
-                e.node.get_root().c_filename, e.msg))
-            sys.exit(2)
-        except gen_hdl.HdlError as e:
-            sys.stderr.write("{}:HDL error: {}\n".format(f, e.msg))
-            sys.exit(2)
+            prof.runcall(run, args)
+        finally:
+            prof.dump_stats(args.profile)
 
 
 if __name__ == '__main__':
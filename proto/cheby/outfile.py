@@ -0,0 +1,83 @@
+"""Generated files that are written only when their content changes.
+   The content is accumulated in memory and compared with the existing
+   file when closed.  An unchanged file is not touched (so its mtime is
+   kept and the downstream tools don't rebuild), and a changed file is
+   replaced atomically."""
+
+import os
+import tempfile
+
+CHUNK_SIZE = 64 << 10
+
+
+def same_content(filename, content):
+    """True if file FILENAME contains exactly CONTENT (a byte string)."""
+    try:
+        if os.path.getsize(filename) != len(content):
+            return False
+        with open(filename, 'rb') as fd:
+            off = 0
+            while off < len(content):
+                chunk = fd.read(CHUNK_SIZE)
+                if not chunk \
+                   or chunk != content[off:off + len(chunk)]:
+                    return False
+                off += len(chunk)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def file_mode():
+    "Mode of a new file, according to the umask"
+    mask = os.umask(0)
+    os.umask(mask)
+    return 0o666 & ~mask
+
+
+class OutputFile(object):
+    """File-like object for a generated file.  Use it as a context manager,
+       the file is not written if an exception is raised."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.buffer = []
+        self.changed = None     # Set by close()
+
+    def write(self, s):
+        self.buffer.append(s)
+
+    def getvalue(self):
+        if self.buffer and isinstance(self.buffer[0], bytes):
+            res = b''.join(self.buffer)
+        else:
+            res = ''.join(self.buffer)
+        if not isinstance(res, bytes):
+            res = res.encode('utf-8')
+        return res
+
+    def close(self):
+        """Write the file if its content has changed.  Return True if the
+           file was written."""
+        content = self.getvalue()
+        self.buffer = []
+        self.changed = not same_content(self.filename, content)
+        if self.changed:
+            dirname = os.path.dirname(self.filename) or '.'
+            fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=dirname)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(content)
+                os.chmod(tmpname, file_mode())
+                os.rename(tmpname, self.filename)
+            except Exception:
+                os.remove(tmpname)
+                raise
+        return self.changed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        return False
@@ -1,6 +1,19 @@
 import yaml
 import cheby.tree as tree
 
+# YAML loaders, by backend name.  The C-accelerated loader is used when
+# pyyaml has been built with libyaml.
+yaml_loaders = {'python': yaml.SafeLoader}
+try:
+    yaml_loaders['libyaml'] = yaml.CSafeLoader
+    yaml_backend = 'libyaml'
+except AttributeError:
+    yaml_backend = 'python'
+
+# If True, the tree is built from the yaml events (see parse_yaml_events)
+# instead of the loaded document.
+yaml_events = False
+
 
 class ParseException(Exception):
     """Exception raised in case of parse error"""
@@ -64,7 +77,7 @@ def parse_named(node, key, val):
 
 
 def parse_children(node, val):
-    if not isinstance(val, list):
+    if not isinstance(val, (list, EventSequence)):
         error("'children' of {} must be a list".format(node.get_path()))
     for el in val:
         for k, v in el.items():
@@ -93,7 +106,7 @@ def parse_composite(node, key, val):
 
 
 def parse_field(parent, el):
-    if not isinstance(el, dict):
+    if not isinstance(el, (dict, EventMapping)):
         error("'children' of {} must be a dictionnary".format(parent.get_path()))
     res = tree.Field(parent)
     for k, v in el.items():
@@ -182,7 +195,7 @@ def parse_submap(parent, el):
 
 
 def parse_array(parent, el):
-    if not isinstance(el, dict):
+    if not isinstance(el, (dict, EventMapping)):
         error("array {} must be a dictionnary".format(parent.get_path()))
     res = tree.Array(parent)
     for k, v in el.items():
@@ -195,20 +208,74 @@ def parse_array(parent, el):
     return res
 
 
-def parse_yaml(filename):
+def get_yaml_loader(backend=None):
+    """Return the loader class for BACKEND ('libyaml' or 'python').
+       Use the default backend (yaml_backend) if None."""
+    if backend is None:
+        backend = yaml_backend
+    if backend not in yaml_loaders:
+        error("yaml backend '{}' not available".format(backend))
+    return yaml_loaders[backend]
+
+
+def load_yaml(filename, content, backend=None):
+    """Load the yaml CONTENT (of FILENAME), using BACKEND."""
     try:
-        el = yaml.load(open(filename))
+        return yaml.load(content, Loader=get_yaml_loader(backend))
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        error("yaml error: {}:{}:{}: {}".format(
+            filename, mark.line + 1, mark.column + 1, e.problem or e.context))
+    except yaml.YAMLError as e:
+        error("yaml error: {}: {}".format(filename, e))
+
+
+def parse_yaml(filename, cache=None, backend=None, events=None):
+    """Parse FILENAME and return the tree.  If CACHE (a cheby.cache.Cache)
+       is set, the tree is looked up there first, and saved there after
+       parsing.  BACKEND is the yaml loader (see get_yaml_loader).
+       If EVENTS is True, the tree is built from the yaml events (the
+       default is yaml_events)."""
+    try:
+        with open(filename, 'rb') as fd:
+            content = fd.read()
     except IOError as e:
         error("open error: {}".format(e))
 
+    if cache is not None:
+        key = cache.key(content)
+        res = cache.load(key)
+        if res is not None:
+            res.c_filename = filename
+            res.c_cache = cache
+            return res
+
+    if events is None:
+        events = yaml_events
+    if events:
+        res = parse_yaml_events(filename, content, backend)
+    else:
+        res = parse_yaml_content(filename, content, backend)
+
+    if cache is not None:
+        cache.store(key, res)
+        res.c_cache = cache
+    return res
+
+
+def parse_yaml_content(filename, content, backend=None):
+    el = load_yaml(filename, content, backend)
+
     if not isinstance(el, dict):
         error("open error: {}: bad format (not yaml)".format(filename))
     if 'memory-map' not in el:
         error("open error: {}: missing 'memory-map' root node".format(filename))
     if len(el) != 1:
         error("open error: {}: more than one root node".format(filename))
-    el = el['memory-map']
+    return parse_root(filename, el['memory-map'])
+
 
+def parse_root(filename, el):
     res = tree.Root()
     res.c_filename = filename
     for k, v in el.items():
@@ -221,3 +288,148 @@ def parse_yaml(filename):
         else:
             error("unhandled '{}' in root".format(k))
     return res
+
+
+# Keys whose value is a node of the tree.
+node_keys = ('memory-map', 'reg', 'field', 'block', 'submap', 'array')
+
+
+class EventReader(object):
+    """Read values from the yaml events of LOADER.
+       :var mark: the position of the last key read (for the errors)."""
+    def __init__(self, loader):
+        self.loader = loader
+        self.anchors = {}
+        self.mark = None
+
+    def value(self):
+        """Read the next value and return it as a python object."""
+        ev = self.loader.get_event()
+        if isinstance(ev, yaml.AliasEvent):
+            if ev.anchor not in self.anchors:
+                error("undefined alias '{}'".format(ev.anchor))
+            return self.anchors[ev.anchor]
+        elif isinstance(ev, yaml.ScalarEvent):
+            node = yaml.ScalarNode(
+                self.loader.resolve(yaml.ScalarNode, ev.value, ev.implicit)
+                if ev.tag is None or ev.tag == '!' else ev.tag,
+                ev.value, ev.start_mark, ev.end_mark, ev.style)
+            res = self.loader.construct_object(node)
+            # Do not keep the scalars in the constructor.
+            self.loader.constructed_objects.pop(node, None)
+        elif isinstance(ev, yaml.SequenceStartEvent):
+            res = []
+            while not self.loader.check_event(yaml.SequenceEndEvent):
+                res.append(self.value())
+            self.loader.get_event()
+        elif isinstance(ev, yaml.MappingStartEvent):
+            res = {}
+            while not self.loader.check_event(yaml.MappingEndEvent):
+                k = self.value()
+                res[k] = self.value()
+            self.loader.get_event()
+        else:
+            raise AssertionError(ev)
+        if ev.anchor is not None:
+            self.anchors[ev.anchor] = res
+        return res
+
+
+class EventMapping(object):
+    """A yaml mapping whose items are read from the events, only once.
+       The values of the nodes and of the children are not loaded (they are
+       EventMapping and EventSequence), the other values are."""
+    def __init__(self, reader):
+        self.reader = reader
+        reader.loader.get_event()   # MappingStartEvent
+        self.iterator = self.read_items()
+
+    def read_items(self):
+        r = self.reader
+        while not r.loader.check_event(yaml.MappingEndEvent):
+            r.mark = r.loader.peek_event().start_mark
+            k = r.value()
+            if k in node_keys and r.loader.check_event(yaml.MappingStartEvent):
+                v = EventMapping(r)
+            elif k == 'children' \
+                 and r.loader.check_event(yaml.SequenceStartEvent):
+                v = EventSequence(r)
+            else:
+                v = r.value()
+            yield k, v
+            if isinstance(v, (EventMapping, EventSequence)):
+                # Skip what was not read.
+                v.skip()
+        r.loader.get_event()
+
+    def items(self):
+        return self.iterator
+
+    def skip(self):
+        for k, v in self.iterator:
+            pass
+
+
+class EventSequence(object):
+    """A yaml sequence whose elements are read from the events, only once.
+       The mapping elements are EventMapping."""
+    def __init__(self, reader):
+        self.reader = reader
+        reader.loader.get_event()   # SequenceStartEvent
+        self.iterator = self.read_elements()
+
+    def read_elements(self):
+        r = self.reader
+        while not r.loader.check_event(yaml.SequenceEndEvent):
+            if r.loader.check_event(yaml.MappingStartEvent):
+                v = EventMapping(r)
+                yield v
+                v.skip()
+            else:
+                yield r.value()
+        r.loader.get_event()
+
+    def __iter__(self):
+        return self.iterator
+
+    def skip(self):
+        for v in self.iterator:
+            pass
+
+
+def parse_yaml_events(filename, content, backend=None):
+    """Parse the yaml CONTENT (of FILENAME), building the tree from the
+       yaml events: the whole document is never loaded.  The position of
+       the key being parsed is added to the error messages."""
+    loader = get_yaml_loader(backend)(content)
+    r = EventReader(loader)
+    try:
+        loader.get_event()  # StreamStartEvent
+        if not loader.check_event(yaml.DocumentStartEvent):
+            error("open error: {}: bad format (not yaml)".format(filename))
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            error("open error: {}: bad format (not yaml)".format(filename))
+        loader.get_event()
+        if loader.check_event(yaml.MappingEndEvent) or r.value() != 'memory-map':
+            error("open error: {}: missing 'memory-map' root node".format(
+                filename))
+        if not loader.check_event(yaml.MappingStartEvent):
+            error("open error: {}: bad format (not yaml)".format(filename))
+        res = parse_root(filename, EventMapping(r))
+        if not loader.check_event(yaml.MappingEndEvent):
+            error("open error: {}: more than one root node".format(filename))
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        error("yaml error: {}:{}:{}: {}".format(
+            filename, mark.line + 1, mark.column + 1, e.problem or e.context))
+    except yaml.YAMLError as e:
+        error("yaml error: {}: {}".format(filename, e))
+    except ParseException as e:
+        if r.mark is not None:
+            e.msg = "{}:{}:{}: {}".format(
+                filename, r.mark.line + 1, r.mark.column + 1, e.msg)
+        raise
+    finally:
+        loader.dispose()
+    return res
@@ -4,19 +4,34 @@ import cheby.hdltree as hdltree
 
 style = None
 
+
+class Buffer(list):
+    """Output accumulated in memory, and written at once at the end.
+       Much faster than writing each fragment to the file."""
+    write = list.append
+
+
 def w(fd, str):
     fd.write(str)
 
 
 def wln(fd, str=""):
-    w(fd, str)
-    w(fd, '\n')
+    fd.write(str)
+    fd.write('\n')
 
 
 def windent(fd, indent):
     w(fd, '  ' * indent)
 
 
+# Dispatch tables for the declarations, expressions, sequential and
+# concurrent statements.
+decl_gen = hdltree.Dispatcher('decl')
+expr_gen = hdltree.Dispatcher('expr')
+seq_gen = hdltree.Dispatcher('seq')
+stmt_gen = hdltree.Dispatcher('stmt')
+
+
 def generate_header(fd, module):
     pass
 
@@ -64,6 +79,7 @@ def generate_interface_port(fd, itf, dir, indent):
             windent(fd, indent + 1)
             wln(fd, "{:<16} : {};".format(p.name, generate_vhdl_type(p)))
 
+@decl_gen.register(hdltree.HDLInterface)
 def generate_interface(fd, itf, indent):
     generate_decl_comment(fd, itf.comment, indent)
     windent(fd, indent)
@@ -92,12 +108,14 @@ def generate_param(fd, p, indent):
         w(fd, " := {}".format(generate_expr(p.value)))
 
 
+@decl_gen.register(hdltree.HDLSignal)
 def generate_signal(fd, s, indent):
     typ = generate_verilog_type(s)
     windent(fd, indent)
     w(fd, "{} {}{};\n".format(generate_verilog_kind(s), typ, s.name))
 
 
+@decl_gen.register(hdltree.HDLConstant)
 def generate_constant(fd, s, indent):
     typ = generate_verilog_type(s)
     windent(fd, indent)
@@ -108,21 +126,14 @@ def generate_constant(fd, s, indent):
     wln(fd)
 
 
+@decl_gen.register(hdltree.HDLComponent, hdltree.HDLComponentSpec)
+def generate_component(fd, d, indent):
+    # No component declarations in verilog.
+    pass
+
+
 def generate_decl(fd, d, indent):
-    if isinstance(d, hdltree.HDLSignal):
-        generate_signal(fd, d, indent)
-    elif isinstance(d, hdltree.HDLConstant):
-        generate_constant(fd, d, indent)
-    elif isinstance(d, hdltree.HDLComponent):
-        pass
-    elif isinstance(d, hdltree.HDLComponentSpec):
-        pass
-    elif isinstance(d, hdltree.HDLComment):
-        generate_comment(fd, d, indent)
-    elif isinstance(d, hdltree.HDLInterface):
-        generate_interface(fd, d, indent)
-    else:
-        raise AssertionError(d)
+    decl_gen.lookup(d)(fd, d, indent)
 
 
 operator = {hdltree.HDLAnd: (' & ', 4),
@@ -136,74 +147,130 @@ operator = {hdltree.HDLAnd: (' & ', 4),
             hdltree.HDLLe:  (' <= ', 5)}
 
 
+# The expression functions are called with the expression, the priority of
+# the enclosing operator, the list of the string parts of the result and
+# the stack of the parts to be handled (see generate_expr).
+
+@expr_gen.register(hdltree.HDLObject)
+def generate_expr_object(e, prio, res, stack):
+    res.append(e.name)
+
+
+@expr_gen.register(hdltree.HDLBinary)
+def generate_expr_binary(e, prio, res, stack):
+    opname, opprio = operator[type(e)]
+    parts = [(e.left, opprio), opname, (e.right, opprio)]
+    if opprio <= prio:
+        parts = ['('] + parts + [')']
+    stack.extend(reversed(parts))
+
+
+@expr_gen.register(hdltree.HDLUnary)
+def generate_expr_unary(e, prio, res, stack):
+    opname, opprio = operator[type(e)]
+    parts = [opname, (e.expr, opprio)]
+    if opprio <= prio:
+        parts = ['('] + parts + [')']
+    stack.extend(reversed(parts))
+
+
+@expr_gen.register(hdltree.HDLParen)
+def generate_expr_paren(e, prio, res, stack):
+    stack.extend([')', (e.expr, -1), '('])
+
+
+@expr_gen.register(hdltree.HDLReplicate)
+def generate_expr_replicate(e, prio, res, stack):
+    stack.extend(['}}', (e.expr, -1), '{{{}{{'.format(e.num)])
+
+
+@expr_gen.register(hdltree.HDLZext, hdltree.HDLSext)
+def generate_expr_ext(e, prio, res, stack):
+    stack.append((e.expr, -1))
+
+
+@expr_gen.register(hdltree.HDLBit)
+def generate_expr_bit(e, prio, res, stack):
+    res.append("1'b{}".format(e.val))
+
+
+@expr_gen.register(hdltree.HDLUndef)
+def generate_expr_undef(e, prio, res, stack):
+    res.append("1'bx")
+
+
+@expr_gen.register(hdltree.HDLHexConst)
+def generate_expr_hexconst(e, prio, res, stack):
+    assert (e.size > 0 and (e.size % 4) == 0)
+    res.append("{}'h".format(e.size))
+    res.extend(['{:X}'.format((e.val >> i) & 15)
+                for i in range(e.size - 4, -1, -4)])
+
+
+@expr_gen.register(hdltree.HDLConst, hdltree.HDLBinConst)
+def generate_expr_const(e, prio, res, stack):
+    if e.size is None:
+        # A bit.
+        res.append("1'b{}".format(e.val))
+    elif e.size <= 0:
+        # Null range.
+        res.append("{}'b".format(e.size))
+    else:
+        res.append("{}'b{:0{}b}".format(
+            e.size, e.val & ((1 << e.size) - 1), e.size))
+
+
+@expr_gen.register(hdltree.HDLNumber)
+def generate_expr_number(e, prio, res, stack):
+    res.append("{}".format(e.val))
+
+
+@expr_gen.register(hdltree.HDLBool)
+def generate_expr_bool(e, prio, res, stack):
+    res.append("1'b1" if e.val else "1'b0")
+
+
+@expr_gen.register(hdltree.HDLSlice)
+def generate_expr_slice(e, prio, res, stack):
+    if e.size is None:
+        stack.append("[{}]".format(e.index))
+    else:
+        stack.append("[{}:{}]".format(e.index + e.size - 1, e.index))
+    stack.append((e.prefix, -1))
+
+
+@expr_gen.register(hdltree.HDLIndex)
+def generate_expr_index(e, prio, res, stack):
+    stack.extend(["[{}]".format(e.index), (e.prefix, -1)])
+
+
+@expr_gen.register(hdltree.HDLInterfaceSelect)
+def generate_expr_interface_select(e, prio, res, stack):
+    # is_master means the direction is not reversed.
+    sfx = 'i' if (e.subport.dir == 'IN') == (e.prefix.is_master) else 'o'
+    res.append("{}_{}.{}".format(e.prefix.name, sfx, e.subport.name))
+
+
 def generate_expr(e, prio=-1):
+    """Return the string for expression E.  PRIO is the priority of the
+       enclosing operator, to add parenthesis.
+       The expression is walked with an explicit stack of string parts and
+       (sub-expression, priority) pairs, so that deep expressions don't
+       overflow the python stack."""
     if isinstance(e, hdltree.HDLObject):
+        # Fast path for the most common case.
         return e.name
-    elif isinstance(e, hdltree.HDLBinary):
-        opname, opprio = operator[type(e)]
-        res = ''.join([generate_expr(e.left, opprio),
-                       opname,
-                       generate_expr(e.right, opprio)])
-        if opprio <= prio:
-            return "({})".format(res)
-        else:
-            return res
-    elif isinstance(e, hdltree.HDLUnary):
-        opname, opprio = operator[type(e)]
-        res = "{}{}".format(opname, generate_expr(e.expr, opprio))
-        if opprio <= prio:
-            return "({})".format(res)
-        else:
-            return res
-    elif isinstance(e, hdltree.HDLParen):
-        return "({})".format(generate_expr(e.expr))
-    elif isinstance(e, hdltree.HDLReplicate):
-        return "{{{}{{{}}}}}".format(e.num, generate_expr(e.expr))
-    elif isinstance(e, hdltree.HDLZext):
-        return generate_expr(e.expr)
-    elif isinstance(e, hdltree.HDLSext):
-        return generate_expr(e.expr)
-    elif isinstance(e, hdltree.HDLBit):
-        return "1'b{}".format(e.val)
-    elif isinstance(e, hdltree.HDLUndef):
-        return "1'bx"
-    elif isinstance(e, hdltree.HDLHexConst):
-        assert (e.size > 0 and (e.size % 4) == 0)
-        res = "{}'h".format(e.size)
-        for i in range(e.size - 4, -1, -4):
-            res += '{:X}'.format((e.val >> i) & 15)
-        return res
-    elif isinstance(e, hdltree.HDLConst) or isinstance(e, hdltree.HDLBinConst):
-        if e.size is None:
-            # A bit.
-            return "1'b{}".format(e.val)
-
-        # Certainly overkill, patches welcome!
-        res = "{}'b".format(e.size)
-        for i in range(e.size - 1, -1, -1):
-            res += '1' if ((e.val >> i) & 1) == 1 else '0'
-        return res
-    elif isinstance(e, hdltree.HDLNumber):
-        return "{}".format(e.val)
-    elif isinstance(e, hdltree.HDLBool):
-        if e.val:
-            return "1'b1"
-        else:
-            return "1'b0"
-    elif isinstance(e, hdltree.HDLSlice):
-        if e.size is None:
-            return "{}[{}]".format(generate_expr(e.prefix), e.index)
-        else:
-            return "{}[{}:{}]".format(
-                generate_expr(e.prefix), e.index + e.size - 1, e.index)
-    elif isinstance(e, hdltree.HDLIndex):
-        return "{}[{}]".format(generate_expr(e.prefix), e.index)
-    elif isinstance(e, hdltree.HDLInterfaceSelect):
-        # is_master means the direction is not reversed.
-        sfx = 'i' if (e.subport.dir == 'IN') == (e.prefix.is_master) else 'o'
-        return "{}_{}.{}".format(e.prefix.name, sfx, e.subport.name)
-    else:
-        assert False, "unhandled hdl expr {}".format(e)
+    res = []
+    stack = [(e, prio)]
+    lookup = expr_gen.lookup
+    while stack:
+        e = stack.pop()
+        if not isinstance(e, tuple):
+            res.append(e)
+            continue
+        e, prio = e
+        lookup(e)(e, prio, res, stack)
+    return ''.join(res)
 
 
 def get_base_name(s):
@@ -247,47 +314,60 @@ def generate_seq_block(fd, stmts, level):
             generate_seq(fd, s, level + 1)
         wln(fd, indent + "end")
 
-def generate_seq(fd, s, level):
+@seq_gen.register(hdltree.HDLAssign)
+def generate_seq_assign(fd, s, level):
+    w(fd, '  ' * level)
+    targ = generate_expr(s.target)
+    expr = generate_expr(s.expr)
+    wln(fd, "{} <= {};".format(targ, expr))
+
+
+@seq_gen.register(hdltree.HDLIfElse)
+def generate_seq_ifelse(fd, s, level):
     indent = '  ' * level
-    if isinstance(s, hdltree.HDLAssign):
-        w(fd, indent)
-        targ = generate_expr(s.target)
-        expr = generate_expr(s.expr)
-        wln(fd, "{} <= {};".format(targ, expr))
-    elif isinstance(s, hdltree.HDLIfElse):
-        w(fd, indent)
-        while True:
-            wln(fd, "if ({})".format(generate_expr(s.cond)))
-            generate_seq_block(fd, s.then_stmts, level + 1)
-            if s.else_stmts is None:
-                break
-            w(fd, indent)
-            if len(s.else_stmts) == 1 \
-               and isinstance(s.else_stmts[0], hdltree.HDLIfElse):
-                w(fd, "else ")
-                s = s.else_stmts[0]
-            else:
-                wln(fd, "else")
-                generate_seq_block(fd, s.else_stmts, level + 1)
-                break
-    elif isinstance(s, hdltree.HDLSwitch):
+    w(fd, indent)
+    while True:
+        wln(fd, "if ({})".format(generate_expr(s.cond)))
+        generate_seq_block(fd, s.then_stmts, level + 1)
+        if s.else_stmts is None:
+            break
         w(fd, indent)
-        wln(fd, "case ({})".format(generate_expr(s.expr)))
-        for c in s.choices:
-            w(fd, indent)
-            if isinstance(c, hdltree.HDLChoiceExpr):
-                wln(fd, "{}: ".format(generate_expr(c.expr)))
-            elif isinstance(c, hdltree.HDLChoiceDefault):
-                wln(fd, "default:")
-            generate_seq_block(fd, c.stmts, level + 1)
-        wln(fd, indent + "endcase")
-    elif isinstance(s, hdltree.HDLComment):
+        if len(s.else_stmts) == 1 \
+           and isinstance(s.else_stmts[0], hdltree.HDLIfElse):
+            w(fd, "else ")
+            s = s.else_stmts[0]
+        else:
+            wln(fd, "else")
+            generate_seq_block(fd, s.else_stmts, level + 1)
+            break
+
+
+@seq_gen.register(hdltree.HDLSwitch)
+def generate_seq_switch(fd, s, level):
+    indent = '  ' * level
+    w(fd, indent)
+    wln(fd, "case ({})".format(generate_expr(s.expr)))
+    for c in s.choices:
         w(fd, indent)
-        wln(fd, "// {}".format(s.comment))
-    else:
-        assert False, "unhandled hdl seq {}".format(s)
+        if isinstance(c, hdltree.HDLChoiceExpr):
+            wln(fd, "{}: ".format(generate_expr(c.expr)))
+        elif isinstance(c, hdltree.HDLChoiceDefault):
+            wln(fd, "default:")
+        generate_seq_block(fd, c.stmts, level + 1)
+    wln(fd, indent + "endcase")
+
+
+@seq_gen.register(hdltree.HDLComment)
+def generate_seq_comment(fd, s, level):
+    w(fd, '  ' * level)
+    wln(fd, "// {}".format(s.comment))
 
 
+def generate_seq(fd, s, level):
+    seq_gen.lookup(s)(fd, s, level)
+
+
+@decl_gen.register(hdltree.HDLComment)
 def generate_comment(fd, n, indent):
     if n.nl:
         wln(fd)
@@ -296,77 +376,99 @@ def generate_comment(fd, n, indent):
         wln(fd, "// {}".format(n.comment))
 
 
-def generate_stmts(fd, stmts, indent):
+# The statement functions are called with a one element list that contains
+# the number of the next generate block of the statement list.
+
+@stmt_gen.register(hdltree.HDLComment)
+def generate_stmt_comment(fd, s, indent, gen_num):
+    generate_comment(fd, s, indent)
+
+
+@stmt_gen.register(hdltree.HDLAssign)
+def generate_stmt_assign(fd, s, indent, gen_num):
+    w(fd, "  " * indent)
+    generate_assign(fd, s)
+
+
+@stmt_gen.register(hdltree.HDLComb)
+def generate_stmt_comb(fd, s, indent, gen_num):
+    w(fd, "  " * indent)
+    if s.name is not None:
+        w(fd, '{}: '.format(s.name))
+    w(fd, "always @(")
+    first = True
+    for e in s.sensitivity:
+        if first:
+            first = False
+        else:
+            w(fd, ", ")
+        w(fd, generate_expr(e))
+    wln(fd, ") ")
+    generate_seq_block(fd, s.stmts, indent + 2)
+
+
+@stmt_gen.register(hdltree.HDLSync)
+def generate_stmt_sync(fd, s, indent, gen_num):
     sindent = "  " * indent
-    gen_num = 0
-    for s in stmts:
-        if isinstance(s, hdltree.HDLComment):
-            generate_comment(fd, s, indent)
-        elif isinstance(s, hdltree.HDLAssign):
-            w(fd, sindent)
-            generate_assign(fd, s)
-        elif isinstance(s, hdltree.HDLComb):
-            w(fd, sindent)
-            if s.name is not None:
-                w(fd, '{}: '.format(s.name))
-            w(fd, "always @(")
-            first = True
-            for e in s.sensitivity:
-                if first:
-                    first = False
-                else:
-                    w(fd, ", ")
-                w(fd, generate_expr(e))
-            wln(fd, ") ")
-            generate_seq_block(fd, s.stmts, indent + 2)
-        elif isinstance(s, hdltree.HDLSync):
-            w(fd, sindent)
-            if s.name is not None:
-                w(fd, '{}: '.format(s.name))
-            w(fd, "always @(posedge({})".format(generate_expr(s.clk)))
-            if s.rst is not None:
-                w(fd, "or negedge({})".format(generate_expr(s.rst)))
-            wln(fd, ")")
-            wln(fd, sindent + "begin")
-            if s.rst is not None:
-                wln(fd, sindent + "  if (!{})".format(generate_expr(s.rst)))
-                generate_seq_block(fd, s.rst_stmts, indent + 2)
-                wln(fd, sindent + "  else")
-                generate_seq_block(fd, s.sync_stmts, indent + 2)
+    w(fd, sindent)
+    if s.name is not None:
+        w(fd, '{}: '.format(s.name))
+    w(fd, "always @(posedge({})".format(generate_expr(s.clk)))
+    if s.rst is not None:
+        w(fd, "or negedge({})".format(generate_expr(s.rst)))
+    wln(fd, ")")
+    wln(fd, sindent + "begin")
+    if s.rst is not None:
+        wln(fd, sindent + "  if (!{})".format(generate_expr(s.rst)))
+        generate_seq_block(fd, s.rst_stmts, indent + 2)
+        wln(fd, sindent + "  else")
+        generate_seq_block(fd, s.sync_stmts, indent + 2)
+    else:
+        generate_seq_block(fd, s.sync_stmts, indent + 2)
+    wln(fd, sindent + "end")
+
+
+@stmt_gen.register(hdltree.HDLInstance)
+def generate_stmt_instance(fd, s, indent, gen_num):
+    sindent = "  " * indent
+    w(fd, sindent + "{}".format(s.module_name))
+
+    def generate_map(mapping, indent):
+        first = True
+        for p, e in mapping:
+            if first:
+                first = False
             else:
-                generate_seq_block(fd, s.sync_stmts, indent + 2)
-            wln(fd, sindent + "end")
-        elif isinstance(s, hdltree.HDLInstance):
-            w(fd, sindent + "{}".format(s.module_name))
-
-            def generate_map(mapping, indent):
-                first = True
-                for p, e in mapping:
-                    if first:
-                        first = False
-                    else:
-                        wln(fd, ",")
-                    w(fd, "  " * indent)
-                    w(fd, "  .{}({})".format(p, generate_expr(e)))
-                wln(fd)
-            if s.params:
-                wln(fd, " #(")
-                generate_map(s.params, indent + 1)
-                wln(fd, sindent + "  )")
-            w(fd, sindent + "{}".format(s.name))
-            if s.conns:
-                wln(fd, " (")
-                generate_map(s.conns, indent + 1)
-                wln(fd, sindent + "  );")
-            wln(fd, sindent)
-        elif isinstance(s, hdltree.HDLGenIf):
-            wln(fd, sindent + "genblock_{}: if ({}) generate".format(
-                gen_num, generate_expr(s.cond)))
-            generate_stmts(fd, s.stmts, indent + 1)
-            wln(fd, sindent + "end generate genblock_{};".format(gen_num))
-            gen_num += 1
-        else:
-            assert False, "unhandled hdl stmt {}".format(s)
+                wln(fd, ",")
+            w(fd, "  " * indent)
+            w(fd, "  .{}({})".format(p, generate_expr(e)))
+        wln(fd)
+    if s.params:
+        wln(fd, " #(")
+        generate_map(s.params, indent + 1)
+        wln(fd, sindent + "  )")
+    w(fd, sindent + "{}".format(s.name))
+    if s.conns:
+        wln(fd, " (")
+        generate_map(s.conns, indent + 1)
+        wln(fd, sindent + "  );")
+    wln(fd, sindent)
+
+
+@stmt_gen.register(hdltree.HDLGenIf)
+def generate_stmt_genif(fd, s, indent, gen_num):
+    sindent = "  " * indent
+    wln(fd, sindent + "genblock_{}: if ({}) generate".format(
+        gen_num[0], generate_expr(s.cond)))
+    generate_stmts(fd, s.stmts, indent + 1)
+    wln(fd, sindent + "end generate genblock_{};".format(gen_num[0]))
+    gen_num[0] += 1
+
+
+def generate_stmts(fd, stmts, indent):
+    gen_num = [0]
+    for s in stmts:
+        stmt_gen.lookup(s)(fd, s, indent, gen_num)
 
 
 def print_inters_list(fd, lst, name, indent):
@@ -466,7 +568,9 @@ def print_module(fd, module):
     wln(fd, "endmodule")
 
 def print_verilog(fd, n):
+    buf = Buffer()
     if isinstance(n, hdltree.HDLModule):
-        print_module(fd, n)
+        print_module(buf, n)
     else:
         raise AssertionError
+    fd.write(''.join(buf))
@@ -4,19 +4,34 @@ import cheby.hdltree as hdltree
 
 style = None
 
+
+class Buffer(list):
+    """Output accumulated in memory, and written at once at the end.
+       Much faster than writing each fragment to the file."""
+    write = list.append
+
+
 def w(fd, str):
     fd.write(str)
 
 
 def wln(fd, str=""):
-    w(fd, str)
-    w(fd, '\n')
+    fd.write(str)
+    fd.write('\n')
 
 
 def windent(fd, indent):
     w(fd, '  ' * indent)
 
 
+# Dispatch tables for the declarations, expressions, sequential and
+# concurrent statements.
+decl_gen = hdltree.Dispatcher('decl')
+expr_gen = hdltree.Dispatcher('expr')
+seq_gen = hdltree.Dispatcher('seq')
+stmt_gen = hdltree.Dispatcher('stmt')
+
+
 def generate_header(fd, module):
     wln(fd, "library ieee;")
     wln(fd, "use ieee.std_logic_1164.all;")
@@ -82,6 +97,7 @@ def generate_interface_port(fd, itf, dir, indent):
             windent(fd, indent + 1)
             wln(fd, "{:<16} : {};".format(p.name, generate_vhdl_type(p)))
 
+@decl_gen.register(hdltree.HDLInterface)
 def generate_interface(fd, itf, indent):
     generate_decl_comment(fd, itf.comment, indent)
     windent(fd, indent)
@@ -110,6 +126,7 @@ def generate_param(fd, p, indent):
         w(fd, " := {}".format(generate_expr(p.value)))
 
 
+@decl_gen.register(hdltree.HDLSignal)
 def generate_signal(fd, s, indent):
     if s.size:
         typ = generate_vhdl_type(s)
@@ -119,6 +136,7 @@ def generate_signal(fd, s, indent):
     w(fd, "signal {:<30} : {typ};\n".format(s.name, typ=typ))
 
 
+@decl_gen.register(hdltree.HDLConstant)
 def generate_constant(fd, s, indent):
     typ = generate_vhdl_type(s)
     windent(fd, indent)
@@ -129,6 +147,7 @@ def generate_constant(fd, s, indent):
     wln(fd)
 
 
+@decl_gen.register(hdltree.HDLComponent)
 def generate_component(fd, comp, indent):
     windent(fd, indent)
     wln(fd, "component {}".format(comp.name))
@@ -138,26 +157,14 @@ def generate_component(fd, comp, indent):
     wln(fd, "end component;")
 
 
+@decl_gen.register(hdltree.HDLComponentSpec)
 def generate_component_spec(fd, spec, indent):
     windent(fd, indent)
     wln(fd, "for all : {} use entity {};".format(spec.comp.name, spec.bind))
 
 
 def generate_decl(fd, d, indent):
-    if isinstance(d, hdltree.HDLSignal):
-        generate_signal(fd, d, indent)
-    elif isinstance(d, hdltree.HDLConstant):
-        generate_constant(fd, d, indent)
-    elif isinstance(d, hdltree.HDLComponent):
-        generate_component(fd, d, indent)
-    elif isinstance(d, hdltree.HDLComponentSpec):
-        generate_component_spec(fd, d, indent)
-    elif isinstance(d, hdltree.HDLComment):
-        generate_comment(fd, d, indent)
-    elif isinstance(d, hdltree.HDLInterface):
-        generate_interface(fd, d, indent)
-    else:
-        raise AssertionError(d)
+    decl_gen.lookup(d)(fd, d, indent)
 
 
 operator = {hdltree.HDLAnd: (' and ', 4),
@@ -171,78 +178,137 @@ operator = {hdltree.HDLAnd: (' and ', 4),
             hdltree.HDLLe:  (' <= ', 5)}
 
 
+# The expression functions are called with the expression, the priority of
+# the enclosing operator, the list of the string parts of the result and
+# the stack of the parts to be handled (see generate_expr).
+
+@expr_gen.register(hdltree.HDLObject)
+def generate_expr_object(e, prio, res, stack):
+    res.append(e.name)
+
+
+@expr_gen.register(hdltree.HDLBinary)
+def generate_expr_binary(e, prio, res, stack):
+    opname, opprio = operator[type(e)]
+    parts = [(e.left, opprio), opname, (e.right, opprio)]
+    if opprio <= prio:
+        parts = ['('] + parts + [')']
+    stack.extend(reversed(parts))
+
+
+@expr_gen.register(hdltree.HDLUnary)
+def generate_expr_unary(e, prio, res, stack):
+    opname, opprio = operator[type(e)]
+    parts = [opname + ' ', (e.expr, opprio)]
+    if opprio <= prio:
+        parts = ['('] + parts + [')']
+    stack.extend(reversed(parts))
+
+
+@expr_gen.register(hdltree.HDLParen)
+def generate_expr_paren(e, prio, res, stack):
+    stack.extend([')', (e.expr, -1), '('])
+
+
+@expr_gen.register(hdltree.HDLReplicate)
+def generate_expr_replicate(e, prio, res, stack):
+    stack.extend([')', (e.expr, -1), '(others => '])
+
+
+@expr_gen.register(hdltree.HDLZext)
+def generate_expr_zext(e, prio, res, stack):
+    stack.extend(['), {}))'.format(e.size), (e.expr, -1),
+                  'std_logic_vector(resize(unsigned('])
+
+
+@expr_gen.register(hdltree.HDLSext)
+def generate_expr_sext(e, prio, res, stack):
+    stack.extend(['), {}))'.format(e.size), (e.expr, -1),
+                  'std_logic_vector(resize(signed('])
+
+
+@expr_gen.register(hdltree.HDLBit)
+def generate_expr_bit(e, prio, res, stack):
+    res.append("'{}'".format(e.val))
+
+
+@expr_gen.register(hdltree.HDLUndef)
+def generate_expr_undef(e, prio, res, stack):
+    res.append("'X'")
+
+
+@expr_gen.register(hdltree.HDLHexConst)
+def generate_expr_hexconst(e, prio, res, stack):
+    assert (e.size > 0 and (e.size % 4) == 0)
+    res.append('X"')
+    res.extend(['{:X}'.format((e.val >> i) & 15)
+                for i in range(e.size - 4, -1, -4)])
+    res.append('"')
+
+
+@expr_gen.register(hdltree.HDLConst, hdltree.HDLBinConst)
+def generate_expr_const(e, prio, res, stack):
+    if e.size is None:
+        # A bit.
+        res.append("'{}'".format(e.val))
+    elif e.size <= 0:
+        # Null range.
+        res.append('""')
+    else:
+        res.append('"{:0{}b}"'.format(e.val & ((1 << e.size) - 1), e.size))
+
+
+@expr_gen.register(hdltree.HDLNumber)
+def generate_expr_number(e, prio, res, stack):
+    res.append("{}".format(e.val))
+
+
+@expr_gen.register(hdltree.HDLBool)
+def generate_expr_bool(e, prio, res, stack):
+    res.append("true" if e.val else "false")
+
+
+@expr_gen.register(hdltree.HDLSlice)
+def generate_expr_slice(e, prio, res, stack):
+    if e.size is None:
+        stack.append("({})".format(e.index))
+    else:
+        stack.append("({} downto {})".format(e.index + e.size - 1, e.index))
+    stack.append((e.prefix, -1))
+
+
+@expr_gen.register(hdltree.HDLIndex)
+def generate_expr_index(e, prio, res, stack):
+    stack.extend(["({})".format(e.index), (e.prefix, -1)])
+
+
+@expr_gen.register(hdltree.HDLInterfaceSelect)
+def generate_expr_interface_select(e, prio, res, stack):
+    # is_master means the direction is not reversed.
+    sfx = 'i' if (e.subport.dir == 'IN') == (e.prefix.is_master) else 'o'
+    res.append("{}_{}.{}".format(e.prefix.name, sfx, e.subport.name))
+
+
 def generate_expr(e, prio=-1):
+    """Return the string for expression E.  PRIO is the priority of the
+       enclosing operator, to add parenthesis.
+       The expression is walked with an explicit stack of string parts and
+       (sub-expression, priority) pairs, so that deep expressions don't
+       overflow the python stack."""
     if isinstance(e, hdltree.HDLObject):
+        # Fast path for the most common case.
         return e.name
-    elif isinstance(e, hdltree.HDLBinary):
-        opname, opprio = operator[type(e)]
-        res = ''.join([generate_expr(e.left, opprio),
-                       opname,
-                       generate_expr(e.right, opprio)])
-        if opprio <= prio:
-            return "({})".format(res)
-        else:
-            return res
-    elif isinstance(e, hdltree.HDLUnary):
-        opname, opprio = operator[type(e)]
-        res = "{} {}".format(opname, generate_expr(e.expr, opprio))
-        if opprio <= prio:
-            return "({})".format(res)
-        else:
-            return res
-    elif isinstance(e, hdltree.HDLParen):
-        return "({})".format(generate_expr(e.expr))
-    elif isinstance(e, hdltree.HDLReplicate):
-        return "(others => {})".format(generate_expr(e.expr))
-    elif isinstance(e, hdltree.HDLZext):
-        return "std_logic_vector(resize(unsigned({}), {}))".format(
-            generate_expr(e.expr), e.size)
-    elif isinstance(e, hdltree.HDLSext):
-        return "std_logic_vector(resize(signed({}), {}))".format(
-            generate_expr(e.expr), e.size)
-    elif isinstance(e, hdltree.HDLBit):
-        return "'{}'".format(e.val)
-    elif isinstance(e, hdltree.HDLUndef):
-        return "'X'"
-    elif isinstance(e, hdltree.HDLHexConst):
-        assert (e.size > 0 and (e.size % 4) == 0)
-        res = 'X"'
-        for i in range(e.size - 4, -1, -4):
-            res += '{:X}'.format((e.val >> i) & 15)
-        res += '"'
-        return res
-    elif isinstance(e, hdltree.HDLConst) or isinstance(e, hdltree.HDLBinConst):
-        if e.size is None:
-            # A bit.
-            return "'{}'".format(e.val)
-
-        # Certainly overkill, patches welcome!
-        res = '"'
-        for i in range(e.size - 1, -1, -1):
-            res += '1' if ((e.val >> i) & 1) == 1 else '0'
-        res += '"'
-        return res
-    elif isinstance(e, hdltree.HDLNumber):
-        return "{}".format(e.val)
-    elif isinstance(e, hdltree.HDLBool):
-        if e.val:
-            return "true"
-        else:
-            return "false"
-    elif isinstance(e, hdltree.HDLSlice):
-        if e.size is None:
-            return "{}({})".format(generate_expr(e.prefix), e.index)
-        else:
-            return "{}({} downto {})".format(
-                generate_expr(e.prefix), e.index + e.size - 1, e.index)
-    elif isinstance(e, hdltree.HDLIndex):
-        return "{}({})".format(generate_expr(e.prefix), e.index)
-    elif isinstance(e, hdltree.HDLInterfaceSelect):
-        # is_master means the direction is not reversed.
-        sfx = 'i' if (e.subport.dir == 'IN') == (e.prefix.is_master) else 'o'
-        return "{}_{}.{}".format(e.prefix.name, sfx, e.subport.name)
-    else:
-        assert False, "unhandled hdl expr {}".format(e)
+    res = []
+    stack = [(e, prio)]
+    lookup = expr_gen.lookup
+    while stack:
+        e = stack.pop()
+        if not isinstance(e, tuple):
+            res.append(e)
+            continue
+        e, prio = e
+        lookup(e)(e, prio, res, stack)
+    return ''.join(res)
 
 
 def get_base_name(s):
@@ -268,53 +334,66 @@ def generate_assign(fd, s):
         wln(fd, "{} <= {};".format(targ, expr))
 
 
-def generate_seq(fd, s, level):
+@seq_gen.register(hdltree.HDLAssign)
+def generate_seq_assign(fd, s, level):
+    w(fd, '  ' * level)
+    generate_assign(fd, s)
+
+
+@seq_gen.register(hdltree.HDLIfElse)
+def generate_seq_ifelse(fd, s, level):
     indent = '  ' * level
-    if isinstance(s, hdltree.HDLAssign):
-        w(fd, indent)
-        generate_assign(fd, s)
-    elif isinstance(s, hdltree.HDLIfElse):
-        w(fd, indent)
-        while True:
-            wln(fd, "if {} then".format(generate_expr(s.cond)))
-            for s1 in s.then_stmts:
-                generate_seq(fd, s1, level + 1)
-            if s.else_stmts is not None:
-                w(fd, indent)
-                if style != 'wbgen' \
-                   and len(s.else_stmts) == 1 \
-                   and isinstance(s.else_stmts[0], hdltree.HDLIfElse):
-                    w(fd, "els")
-                    s = s.else_stmts[0]
-                else:
-                    wln(fd, "else")
-                    for s1 in s.else_stmts:
-                        generate_seq(fd, s1, level + 1)
-                    break
+    w(fd, indent)
+    while True:
+        wln(fd, "if {} then".format(generate_expr(s.cond)))
+        for s1 in s.then_stmts:
+            generate_seq(fd, s1, level + 1)
+        if s.else_stmts is not None:
+            w(fd, indent)
+            if style != 'wbgen' \
+               and len(s.else_stmts) == 1 \
+               and isinstance(s.else_stmts[0], hdltree.HDLIfElse):
+                w(fd, "els")
+                s = s.else_stmts[0]
             else:
+                wln(fd, "else")
+                for s1 in s.else_stmts:
+                    generate_seq(fd, s1, level + 1)
                 break
+        else:
+            break
+    w(fd, indent)
+    wln(fd, "end if;")
+
+
+@seq_gen.register(hdltree.HDLSwitch)
+def generate_seq_switch(fd, s, level):
+    indent = '  ' * level
+    w(fd, indent)
+    wln(fd, "case {} is".format(generate_expr(s.expr)))
+    for c in s.choices:
         w(fd, indent)
-        wln(fd, "end if;")
-    elif isinstance(s, hdltree.HDLSwitch):
-        w(fd, indent)
-        wln(fd, "case {} is".format(generate_expr(s.expr)))
-        for c in s.choices:
-            w(fd, indent)
-            if isinstance(c, hdltree.HDLChoiceExpr):
-                wln(fd, "when {} => ".format(generate_expr(c.expr)))
-            elif isinstance(c, hdltree.HDLChoiceDefault):
-                wln(fd, "when others =>")
-            for s1 in c.stmts:
-                generate_seq(fd, s1, level + 1)
-        w(fd, indent)
-        wln(fd, "end case;")
-    elif isinstance(s, hdltree.HDLComment):
-        w(fd, indent)
-        wln(fd, "-- {}".format(s.comment))
-    else:
-        assert False, "unhandled hdl seq {}".format(s)
+        if isinstance(c, hdltree.HDLChoiceExpr):
+            wln(fd, "when {} => ".format(generate_expr(c.expr)))
+        elif isinstance(c, hdltree.HDLChoiceDefault):
+            wln(fd, "when others =>")
+        for s1 in c.stmts:
+            generate_seq(fd, s1, level + 1)
+    w(fd, indent)
+    wln(fd, "end case;")
+
 
+@seq_gen.register(hdltree.HDLComment)
+def generate_seq_comment(fd, s, level):
+    w(fd, '  ' * level)
+    wln(fd, "-- {}".format(s.comment))
 
+
+def generate_seq(fd, s, level):
+    seq_gen.lookup(s)(fd, s, level)
+
+
+@decl_gen.register(hdltree.HDLComment)
 def generate_comment(fd, n, indent):
     if n.nl:
         wln(fd)
@@ -323,103 +402,126 @@ def generate_comment(fd, n, indent):
         wln(fd, "-- {}".format(n.comment))
 
 
-def generate_stmts(fd, stmts, indent):
+# The statement functions are called with a one element list that contains
+# the number of the next generate block of the statement list.
+
+@stmt_gen.register(hdltree.HDLComment)
+def generate_stmt_comment(fd, s, indent, gen_num):
+    generate_comment(fd, s, indent)
+
+
+@stmt_gen.register(hdltree.HDLAssign)
+def generate_stmt_assign(fd, s, indent, gen_num):
+    w(fd, "  " * indent)
+    generate_assign(fd, s)
+
+
+@stmt_gen.register(hdltree.HDLComb)
+def generate_stmt_comb(fd, s, indent, gen_num):
     sindent = "  " * indent
-    gen_num = 0
-    for s in stmts:
-        if isinstance(s, hdltree.HDLComment):
-            generate_comment(fd, s, indent)
-        elif isinstance(s, hdltree.HDLAssign):
-            w(fd, sindent)
-            generate_assign(fd, s)
-        elif isinstance(s, hdltree.HDLComb):
-            w(fd, sindent)
-            if s.name is not None:
-                w(fd, '{}: '.format(s.name))
-            w(fd, "process (")
-            first = True
-            for e in s.sensitivity:
-                if first:
-                    first = False
-                else:
-                    w(fd, ", ")
-                w(fd, generate_expr(e))
-            if style == 'wbgen':
-                wln (fd, "  )")
-                w(fd, sindent)
-            else:
-                w(fd, ") ")
-            wln(fd, "begin")
-            # wln(fd, "  begin")
-            for s1 in s.stmts:
-                generate_seq(fd, s1, 2)
-            w(fd, "  end process")
-            if s.name is not None:
-                w(fd, ' {}'.format(s.name))
-            wln(fd, ";")
-        elif isinstance(s, hdltree.HDLSync):
-            w(fd, sindent)
-            if s.name is not None:
-                w(fd, '{}: '.format(s.name))
-            w(fd, "process ({}".format(generate_expr(s.clk)))
-            if s.rst is not None:
-                w(fd, ", {}".format(generate_expr(s.rst)))
-            if style == 'wbgen':
-                wln(fd, ')')
-                w(fd, sindent)
-                wln(fd, 'begin')
-            else:
-                wln(fd, ") begin")
-            # wln(fd, sindent + "begin")
-            if s.rst is not None:
-                cond = "{} = '0'".format(generate_expr(s.rst))
-                if style == 'wbgen':
-                    cond = '(' + cond + ')'
-                wln(fd, sindent + "  if {} then ".format(cond))
-                for s1 in s.rst_stmts:
-                    generate_seq(fd, s1, indent + 2)
-                w(fd, sindent + "  elsif ")
-            else:
-                w(fd, sindent + "  if ")
-            wln(fd, "rising_edge({}) then".format(
-                generate_expr(s.clk)))
-            for s1 in s.sync_stmts:
-                generate_seq(fd, s1, indent + 2)
-            wln(fd, sindent + "  end if;")
-            w(fd, sindent + "end process")
-            if s.name is not None:
-                w(fd, ' {}'.format(s.name))
-            wln(fd, ";")
-        elif isinstance(s, hdltree.HDLInstance):
-            wln(fd, sindent + "{}: {}".format(s.name, s.module_name))
-
-            def generate_map(mapping, indent):
-                first = True
-                for p, e in mapping:
-                    if first:
-                        first = False
-                    else:
-                        wln(fd, ",")
-                    w(fd, "  " * indent)
-                    w(fd, "  {:<20} => {}".format(p, generate_expr(e)))
-                wln(fd)
-            if s.params:
-                wln(fd, sindent + "  generic map (")
-                generate_map(s.params, indent + 1)
-                wln(fd, sindent + "  )")
-            if s.conns:
-                wln(fd, sindent + "  port map (")
-                generate_map(s.conns, indent + 1)
-                wln(fd, sindent + "  );")
-            wln(fd, sindent)
-        elif isinstance(s, hdltree.HDLGenIf):
-            wln(fd, sindent + "genblock_{}: if ({}) generate".format(
-                gen_num, generate_expr(s.cond)))
-            generate_stmts(fd, s.stmts, indent + 1)
-            wln(fd, sindent + "end generate genblock_{};".format(gen_num))
-            gen_num += 1
+    w(fd, sindent)
+    if s.name is not None:
+        w(fd, '{}: '.format(s.name))
+    w(fd, "process (")
+    first = True
+    for e in s.sensitivity:
+        if first:
+            first = False
         else:
-            assert False, "unhandled hdl stmt {}".format(s)
+            w(fd, ", ")
+        w(fd, generate_expr(e))
+    if style == 'wbgen':
+        wln (fd, "  )")
+        w(fd, sindent)
+    else:
+        w(fd, ") ")
+    wln(fd, "begin")
+    # wln(fd, "  begin")
+    for s1 in s.stmts:
+        generate_seq(fd, s1, 2)
+    w(fd, "  end process")
+    if s.name is not None:
+        w(fd, ' {}'.format(s.name))
+    wln(fd, ";")
+
+
+@stmt_gen.register(hdltree.HDLSync)
+def generate_stmt_sync(fd, s, indent, gen_num):
+    sindent = "  " * indent
+    w(fd, sindent)
+    if s.name is not None:
+        w(fd, '{}: '.format(s.name))
+    w(fd, "process ({}".format(generate_expr(s.clk)))
+    if s.rst is not None:
+        w(fd, ", {}".format(generate_expr(s.rst)))
+    if style == 'wbgen':
+        wln(fd, ')')
+        w(fd, sindent)
+        wln(fd, 'begin')
+    else:
+        wln(fd, ") begin")
+    # wln(fd, sindent + "begin")
+    if s.rst is not None:
+        cond = "{} = '0'".format(generate_expr(s.rst))
+        if style == 'wbgen':
+            cond = '(' + cond + ')'
+        wln(fd, sindent + "  if {} then ".format(cond))
+        for s1 in s.rst_stmts:
+            generate_seq(fd, s1, indent + 2)
+        w(fd, sindent + "  elsif ")
+    else:
+        w(fd, sindent + "  if ")
+    wln(fd, "rising_edge({}) then".format(
+        generate_expr(s.clk)))
+    for s1 in s.sync_stmts:
+        generate_seq(fd, s1, indent + 2)
+    wln(fd, sindent + "  end if;")
+    w(fd, sindent + "end process")
+    if s.name is not None:
+        w(fd, ' {}'.format(s.name))
+    wln(fd, ";")
+
+
+@stmt_gen.register(hdltree.HDLInstance)
+def generate_stmt_instance(fd, s, indent, gen_num):
+    sindent = "  " * indent
+    wln(fd, sindent + "{}: {}".format(s.name, s.module_name))
+
+    def generate_map(mapping, indent):
+        first = True
+        for p, e in mapping:
+            if first:
+                first = False
+            else:
+                wln(fd, ",")
+            w(fd, "  " * indent)
+            w(fd, "  {:<20} => {}".format(p, generate_expr(e)))
+        wln(fd)
+    if s.params:
+        wln(fd, sindent + "  generic map (")
+        generate_map(s.params, indent + 1)
+        wln(fd, sindent + "  )")
+    if s.conns:
+        wln(fd, sindent + "  port map (")
+        generate_map(s.conns, indent + 1)
+        wln(fd, sindent + "  );")
+    wln(fd, sindent)
+
+
+@stmt_gen.register(hdltree.HDLGenIf)
+def generate_stmt_genif(fd, s, indent, gen_num):
+    sindent = "  " * indent
+    wln(fd, sindent + "genblock_{}: if ({}) generate".format(
+        gen_num[0], generate_expr(s.cond)))
+    generate_stmts(fd, s.stmts, indent + 1)
+    wln(fd, sindent + "end generate genblock_{};".format(gen_num[0]))
+    gen_num[0] += 1
+
+
+def generate_stmts(fd, stmts, indent):
+    gen_num = [0]
+    for s in stmts:
+        stmt_gen.lookup(s)(fd, s, indent, gen_num)
 
 
 def print_inters_list(fd, lst, name, indent):
@@ -491,9 +593,11 @@ def print_package(fd, n):
     wln(fd, "end {};".format(n.name))
 
 def print_vhdl(fd, n):
+    buf = Buffer()
     if isinstance(n, hdltree.HDLModule):
-        print_module(fd, n)
+        print_module(buf, n)
     elif isinstance(n, hdltree.HDLPackage):
-        print_package(fd, n)
+        print_package(buf, n)
     else:
         raise AssertionError
+    fd.write(''.join(buf))
@@ -0,0 +1,105 @@
+"""Timing of the stages of a generation.
+   A stage is timed with a context manager:
+
+     timer = StageTimer()
+     with timer.stage('parse'):
+         ...
+     timer.report(sys.stderr)
+
+   For each stage the wall time and the peak memory are recorded.  The peak
+   memory is the maximum of the memory allocated during the stage (with
+   tracemalloc, which slows down the execution), or the growth of the
+   maximum resident size of the process when tracemalloc is not available
+   (python 2).  Tracemalloc is only started for the duration of a stage;
+   if the caller already traces, its traces are kept (and before python
+   3.9 the resident size is used, as the peak cannot be reset).  Stages
+   can be nested, the peak of a stage includes its inner stages."""
+
+import time
+import contextlib
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class NullTimer(object):
+    "A timer that doesn't record anything"
+    @contextlib.contextmanager
+    def stage(self, name):
+        yield
+
+
+class StageTimer(object):
+    def __init__(self):
+        self.stages = []    # List of (name, seconds, peak bytes or None)
+        self.active = []    # Measures of the stages being run
+
+    def memory_start(self):
+        """Return the measure used for a stage: a list of the kind ('own'
+           or 'trace' for tracemalloc, 'rss' for the resident size), the
+           start value and the peak before the last reset; or None."""
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                return ['own', 0, 0]
+            elif hasattr(tracemalloc, 'reset_peak'):
+                cur, peak = tracemalloc.get_traced_memory()
+                # The peak of the enclosing stages is lost by the reset.
+                for m in self.active:
+                    if m is not None and m[0] != 'rss':
+                        m[2] = max(m[2], peak)
+                tracemalloc.reset_peak()
+                return ['trace', cur, 0]
+        if resource is not None:
+            return ['rss', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    0]
+        else:
+            return None
+
+    def memory_peak(self, start):
+        if start is None:
+            return None
+        kind, val, saved = start
+        if kind == 'rss':
+            # ru_maxrss is in KiB on Linux.
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return (rss - val) * 1024
+        _, peak = tracemalloc.get_traced_memory()
+        if kind == 'own':
+            tracemalloc.stop()
+        return max(peak, saved) - val
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        mem = self.memory_start()
+        self.active.append(mem)
+        start = time.time()
+        try:
+            yield
+        finally:
+            t = time.time() - start
+            self.active.pop()
+            self.stages.append((name, t, self.memory_peak(mem)))
+
+    def report(self, fd, title=None):
+        """Write the table of the stages to FD (in a single write, as
+           several processes may report to the same stream)."""
+        res = []
+        if title is not None:
+            res.append('{}:\n'.format(title))
+        res.append('  {:<20} {:>10} {:>14}\n'.format(
+            'stage', 'time (ms)', 'peak mem (KiB)'))
+        for name, t, peak in self.stages:
+            res.append('  {:<20} {:10.2f} {:>14}\n'.format(
+                name, t * 1000,
+                '-' if peak is None else '{:.1f}'.format(peak / 1024.0)))
+        res.append('  {:<20} {:10.2f}\n'.format(
+            'total', sum([s[1] for s in self.stages]) * 1000))
+        fd.write(''.join(res))
@@ -7,19 +7,53 @@
    - Extensions are stored as python data in a 'x_XXX' field, where 'XXX' is
      the name of the extension.
    - Computed values have the 'c_' prefix (layout module).
-   - HDL fields have the 'h_' prefix (gen_hdl module). """
+   - HDL fields have the 'h_' prefix (gen_hdl module).
+
+   To reduce the memory used by big trees, the classes declare their
+   attributes in __slots__ (the user data, the computed values and the
+   HDL values of the fields).  The other attributes (extensions and
+   values specific to a generator) are stored in the instance dictionary,
+   which is created only when needed. """
+
+import bisect
 
 BYTE_SIZE = 8
 
+# Generation of the cached paths and roots.  A cached value is valid only
+# if it was computed during the current generation.
+cache_epoch = 0
+
+
+def invalidate_caches():
+    """Invalidate the cached paths, roots and path indexes of all the nodes.
+       Must be called when a tree is edited (a node added, removed, moved
+       or renamed) after paths or roots may have been computed.  This is
+       done by the layout and by IncrementalLayout.mark_dirty."""
+    global cache_epoch
+    cache_epoch += 1
+
 
 class Node(object):
     """Base class for any Cheby node.
        :var parent: the parent of that node, None for the root.
        """
+    __slots__ = ('_parent', '__dict__', '_root_cache')
     _dispatcher = {}    # Class variable for visitor.
 
     def __init__(self, parent):
         self._parent = parent
+        self._root_cache = None
+
+    def get_root(self):
+        c = self._root_cache
+        if c is not None and c[0] == cache_epoch:
+            return c[1]
+        if self._parent is None:
+            res = self
+        else:
+            res = self._parent.get_root()
+        self._root_cache = (cache_epoch, res)
+        return res
 
     def visit(self, name, *args, **kwargs):
         return self._dispatcher[name](*args, **kwargs)
@@ -28,10 +62,13 @@ class Node(object):
 class NamedNode(Node):
     """Many Cheby nodes have a name/description/comment.  Create a
        common class for them."""
+    __slots__ = ('name', 'description', 'comment',
+                 'c_address', 'c_size', 'c_align', 'c_name', '_path_cache')
     _dispatcher = {}
 
     def __init__(self, parent):
         super(NamedNode, self).__init__(parent)
+        self._path_cache = None
         self.name = None
         self.description = None
         self.comment = None
@@ -42,20 +79,17 @@ class NamedNode(Node):
 
     def get_path(self):
         """Return the full path (from the root) of this node."""
+        c = self._path_cache
+        if c is not None and c[0] == cache_epoch:
+            return c[1]
         if self.name is None:
             p = '/??'
         else:
             p = '/' + self.name
-        if self._parent is None:
-            return p
-        else:
-            return self._parent.get_path() + p
-
-    def get_root(self):
-        if self._parent is None:
-            return self
-        else:
-            return self._parent.get_root()
+        if self._parent is not None:
+            p = self._parent.get_path() + p
+        self._path_cache = (cache_epoch, p)
+        return p
 
     def get_extension(self, ext, name, default=None):
         if not hasattr(self, ext):
@@ -66,9 +100,30 @@ class NamedNode(Node):
         return x.get(name, default)
 
 
-class CompositeNode(NamedNode):
+class ChildrenByName(object):
+    """Lookup of the children by name, for the nodes with children.
+       The index (c_names) is built by the layout, or on the first lookup.
+       It must be reset to None when the children are changed.
+       Lazy children (the elements of an unrolled array, which are not a
+       list) are not indexed but do their own lookup."""
+    __slots__ = ()
+
+    def get_child(self, name):
+        """Return the child named NAME, or None."""
+        if not isinstance(self.children, list):
+            return self.children.get_child(name)
+        names = self.c_names
+        if names is None:
+            names = dict([(c.name, c) for c in self.children])
+            self.c_names = names
+        return names.get(name)
+
+
+class CompositeNode(ChildrenByName, NamedNode):
     """Base class for Cheby nodes with children; they are also named.
        :var children: is the list of children."""
+    __slots__ = ('children', 'c_blk_bits', 'c_sel_bits', 'c_sorted_children',
+                 'c_names', 'c_addresses')
     _dispatcher = {}
 
     def __init__(self, parent):
@@ -77,9 +132,35 @@ class CompositeNode(NamedNode):
         # Computed variables
         self.c_blk_bits = None   # Number of bits for sub-blocks
         self.c_sel_bits = None   # Number of bits to select sub-blocks
+        self.c_sorted_children = None  # Children sorted by address
+        self.c_names = None      # Children by name
+        self.c_addresses = None  # Addresses of c_sorted_children
+
+    def get_child_at(self, addr):
+        """Return the child that contains the relative address ADDR,
+           or None."""
+        if not isinstance(self.children, list):
+            return self.children.get_child_at(addr)
+        addrs = self.c_addresses
+        if addrs is None:
+            if self.c_sorted_children is None:
+                self.c_sorted_children = sorted(
+                    self.children, key=(lambda x: x.c_address))
+            addrs = [c.c_address for c in self.c_sorted_children]
+            self.c_addresses = addrs
+        i = bisect.bisect_right(addrs, addr) - 1
+        if i < 0:
+            return None
+        c = self.c_sorted_children[i]
+        if addr >= c.c_address + c.c_size:
+            return None
+        return c
 
 
 class Root(CompositeNode):
+    __slots__ = ('bus', 'size', 'c_word_size', 'c_filename', 'c_cache',
+                 'c_word_bits', 'c_addr_word_bits', 'c_buserr',
+                 '_path_index')
     _dispatcher = {}
 
     def __init__(self):
@@ -89,9 +170,47 @@ class Root(CompositeNode):
         # Computed variables
         self.c_word_size = None  # Word size in bytes
         self.c_filename = None   # Filename for the tree.
-
-
-class Reg(NamedNode):
+        self.c_cache = None      # Parse cache used for the tree (and submaps)
+        self._path_index = None
+
+    def get_node_by_path(self, path):
+        """Return the node whose path (as returned by get_path) is PATH,
+           or None.  Submaps are not searched.  The elements of the
+           unrolled arrays are not indexed (so that they are not all
+           created), but looked up by name."""
+        c = self._path_index
+        if c is None or c[0] != cache_epoch:
+            index = {}
+            lazy = []
+            todo = [self]
+            while todo:
+                n = todo.pop()
+                p = n.get_path()
+                index.setdefault(p, n)
+                children = getattr(n, 'children', [])
+                if isinstance(children, list):
+                    todo.extend(children)
+                else:
+                    lazy.append((p + '/', n))
+            c = (cache_epoch, index, lazy)
+            self._path_index = c
+        res = c[1].get(path)
+        if res is None:
+            for prefix, n in c[2]:
+                if path.startswith(prefix):
+                    for name in path[len(prefix):].split('/'):
+                        n = n.get_child(name) \
+                            if isinstance(n, ChildrenByName) else None
+                        if n is None:
+                            break
+                    return n
+        return res
+
+
+class Reg(ChildrenByName, NamedNode):
+    __slots__ = ('width', 'type', 'access', 'address', 'children', 'preset',
+                 'c_rwidth', 'c_iowidth', 'c_mwidth', 'c_nwords', 'c_type',
+                 'c_names')
     _dispatcher = {}
 
     def __init__(self, parent):
@@ -102,6 +221,7 @@ class Reg(NamedNode):
         self.address = None
         self.children = []
         self.preset = None
+        self.c_names = None   # Fields by name
         # Computed (by layout)
         self.c_size = None    # Size in bytes
         self.c_rwidth = None  # Width of the register (can be smaller than
@@ -116,6 +236,9 @@ class Reg(NamedNode):
 
 class FieldBase(NamedNode):
     "Base for Field and FieldReg"
+    __slots__ = ('hi', 'lo', 'preset', 'c_rwidth', 'c_iowidth',
+                 'hdl_type', 'hdl_write_strobe', 'hdl_read_strobe',
+                 'h_iport', 'h_oport', 'h_wport', 'h_reg')
 
     def __init__(self, parent):
         super(FieldBase, self).__init__(parent)
@@ -125,15 +248,16 @@ class FieldBase(NamedNode):
 
 class Field(FieldBase):
     "A field within a register."
-    pass
+    __slots__ = ()
 
 
 class FieldReg(FieldBase):
     "A pseudo field for a register without fields."
-    pass
+    __slots__ = ()
 
 
 class ComplexNode(CompositeNode):
+    __slots__ = ('address', 'align', 'size', 'c_width')
     _dispatcher = {}
 
     def __init__(self, parent):
@@ -144,6 +268,7 @@ class ComplexNode(CompositeNode):
 
 
 class Block(ComplexNode):
+    __slots__ = ()
     _dispatcher = {}
 
     def __init__(self, parent):
@@ -151,6 +276,7 @@ class Block(ComplexNode):
 
 
 class Submap(ComplexNode):
+    __slots__ = ('filename', 'interface', 'c_interface', 'c_submap')
     _dispatcher = {}
 
     def __init__(self, parent):
@@ -160,6 +286,7 @@ class Submap(ComplexNode):
 
 
 class Array(ComplexNode):
+    __slots__ = ('repeat', 'c_elsize')
     _dispatcher = {}
 
     def __init__(self, parent):
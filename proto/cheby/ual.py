@@ -1,5 +1,7 @@
 import cheby.parser
 import cheby.layout
+import cheby.compiled
+import cheby.timing
 import cheby.tree as tree
 
 class UALValue(object):
@@ -9,11 +11,11 @@ class UALValue(object):
         self._node = node
         self._offset = offset
 
-    def _get_child(self, name, children):
-        els = [el for el in children if el.name == name]
-        if len(els) != 1:
+    def _get_child(self, name):
+        el = self._node.get_child(name)
+        if el is None:
             raise AttributeError("no {} in {}".format(name, self._node.name))
-        return els[0]
+        return el
 
     def _read_val(self):
         res = 0
@@ -44,8 +46,16 @@ class UALValue(object):
                 raise AssertionError
 
     def __getattr__(self, name):
-        if isinstance(self._node, (tree.Root, tree.Block, tree.Array)):
-            el = self._get_child(name, self._node.children)
+        if isinstance(self._node, tree.Submap) \
+           and self._node.filename is not None:
+            el = self._node.c_submap.get_child(name)
+            if el is None:
+                raise AttributeError(
+                    "no {} in {}".format(name, self._node.name))
+            return UALValue(self._ual, self._root, el,
+                            self._offset + el.c_address)
+        elif isinstance(self._node, (tree.Root, tree.Block, tree.Array)):
+            el = self._get_child(name)
             return UALValue(self._ual, self._root, el,
                             self._offset + el.c_address)
         elif isinstance(self._node, tree.Reg) and self._node.type is None:
@@ -59,7 +69,7 @@ class UALValue(object):
         if name[0] == '_':
             object.__setattr__(self, name, value)
         elif isinstance(self._node, tree.Reg) and self._node.type is None:
-            el = self._get_child(name, self._node.children)
+            el = self._get_child(name)
             val = self._read_val()
             mask = ((1 << el.c_width) - 1) << el.lo
             val &= ~mask
@@ -80,8 +90,19 @@ class UALValue(object):
         else:
             raise TypeError
 
-def create_ual_access(ual, filename):
-    root = cheby.parser.parse_yaml(filename)
-    cheby.layout.layout_cheby(root)
+def create_ual_access(ual, filename, timer=None):
+    """Return the access object for the memory map of FILENAME, either a
+       cheby file or a compiled tree (see cheby.compiled).
+       The parse and layout stages are timed by TIMER (if not None)."""
+    if timer is None:
+        timer = cheby.timing.NullTimer()
+    if cheby.compiled.is_compiled(filename):
+        with timer.stage('load_compiled'):
+            root = cheby.compiled.load_compiled(filename)
+    else:
+        with timer.stage('parse_yaml'):
+            root = cheby.parser.parse_yaml(filename)
+        with timer.stage('layout_cheby'):
+            cheby.layout.layout_cheby(root)
 
     return UALValue(ual, root, root, 0)
@@ -1,16 +1,29 @@
 #! /usr/bin/env python
 """Simple test program"""
 import sys
+import random
 import os
+import shutil
+import tempfile
 import subprocess
 import cheby.parser as parser
+import cheby.tree as tree
+import cheby.cache as cache
+import cheby.depfile as depfile
+import cheby.outfile as outfile
+import cheby.timing as timing
+import cheby.ual as ual
 import cheby.layout as layout
+import cheby.lookup as lookup
+import cheby.compiled as compiled
 import cheby.pprint as pprint
 import cheby.sprint as sprint
 import cheby.cprint as cprint
 import cheby.gen_name as gen_name
 import cheby.gen_hdl as gen_hdl
+import cheby.hdltree as hdltree
 import cheby.print_vhdl as print_vhdl
+import cheby.print_verilog as print_verilog
 import cheby.gen_laychk as gen_laychk
 import cheby.expand_hdl as expand_hdl
 import cheby.gen_gena_memmap as gen_gena_memmap
@@ -87,6 +100,31 @@ def test_parser():
         parse_err(srcdir + f)
 
 
+def test_parser_events():
+    # The trees built from the yaml events are the same.
+    for f in ['demo.yaml', 'block4.yaml', 'submap2.yaml',
+              'array2.yaml']:
+        res = []
+        for events in [False, True]:
+            fd = write_buffer()
+            pprint.pprint_cheby(fd, parser.parse_yaml(srcdir + f,
+                                                      events=events))
+            res.append(fd.get())
+        if res[0] != res[1]:
+            error('different trees from the yaml events for {}'.format(f))
+    # The errors have the position of the key.
+    for f, pos in [('err_width_type1.yaml', ':8:9: '),
+                   ('parse_err_reg1.yaml', ':7:7: '),
+                   ('parse_err_elem2.yaml', ':4:3: ')]:
+        try:
+            parser.parse_yaml(srcdir + f, events=True)
+        except parser.ParseException as e:
+            if not e.msg.startswith(srcdir + f + pos):
+                error('bad error position for {}: {}'.format(f, e.msg))
+        else:
+            error('parse error expected for {}'.format(f))
+
+
 def layout_ok(t):
     try:
         layout.layout_cheby(t)
@@ -138,6 +176,43 @@ def test_layout():
         layout_err(t)
 
 
+def test_submaps():
+    t = parse_ok(srcdir + 'submap4.yaml')
+    submaps = layout.SubmapRegistry()
+    layout.layout_cheby(t, submaps)
+    if submaps.hits != 1 or submaps.misses != 2:
+        error('unexpected submap registry statistics')
+    blk1, blk2, blk3 = t.children
+    if blk1.c_submap is not blk2.c_submap:
+        error('submap not shared')
+    if blk3.c_submap is blk1.c_submap:
+        error('included submap must not be shared')
+    # A failed submap can be laid out again once fixed.
+    tmpdir = tempfile.mkdtemp()
+    try:
+        main = os.path.join(tmpdir, 'main.yaml')
+        sub = os.path.join(tmpdir, 'sub.yaml')
+        with open(main, 'w') as fd:
+            fd.write('memory-map:\n  bus: wb-32-be\n  name: main\n'
+                     '  children:\n  - submap:\n      name: blk\n'
+                     '      filename: sub.yaml\n')
+        submaps = layout.SubmapRegistry()
+        for src in ['err_noelements.yaml', 'simple_reg1.yaml']:
+            shutil.copy(srcdir + src, sub)
+            t = parse_ok(main)
+            try:
+                layout.layout_cheby(t, submaps)
+                ok = True
+            except layout.LayoutException as e:
+                ok = False
+                if 'recursive' in e.msg:
+                    error('failed submap still loading')
+            if ok != (src == 'simple_reg1.yaml'):
+                error('unexpected layout result with {}'.format(src))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 def test_print():
     fd = write_null()
     for f in ['demo.yaml', 'reg_value1.yaml', 'reg_value2.yaml',
@@ -149,6 +224,332 @@ def test_print():
         cprint.cprint_cheby(fd, t)
 
 
+def test_array_views():
+    t = parse_ok(srcdir + 'array2.yaml')
+    layout_ok(t)
+    arr = t.children[0]
+    el = arr.children[0]
+    expand_hdl.expand_hdl(t)
+    blk = t.children[0]
+    if len(blk.children) != arr.repeat:
+        error('bad number of array elements')
+    # Elements are created on access.
+    if blk.children.elements != [None] * arr.repeat:
+        error('array elements are not lazy')
+    # Lookups only create the element found.
+    name = '{}{:x}'.format(el.name, arr.repeat - 1)
+    r = t.get_node_by_path('{}/{}'.format(blk.get_path(), name))
+    if r is None or r.name != name \
+       or blk.get_child(name) is not r \
+       or blk.get_child_at(r.c_address + r.c_size - 1) is not r \
+       or blk.get_child(el.name + '0' + name[len(el.name):]) is not None \
+       or blk.get_child('{}{:x}'.format(el.name, arr.repeat)) is not None \
+       or blk.get_child_at(blk.c_address + blk.c_size) is not None \
+       or t.get_node_by_path('{}/{}/none'.format(blk.get_path(), name)) \
+       is not None:
+        error('bad lookup of array element')
+    if len([e for e in blk.children.elements if e is not None]) != 1:
+        error('array elements created by lookup')
+    for i, r in enumerate(blk.children):
+        if r.name != '{}{:x}'.format(el.name, i) \
+           or r.c_address != i * arr.c_elsize \
+           or r.width != el.width or r._parent is not blk:
+            error('bad array element {}'.format(i))
+    if blk.children[-1] is not blk.children[arr.repeat - 1]:
+        error('array elements are not kept')
+
+
+def test_paths():
+    t = parse_ok(srcdir + 'block1.yaml')
+    inc = layout.IncrementalLayout(t)
+    blk = t.children[0]
+    reg = blk.children[0]
+    if reg.get_path() != '/block1/blk/areg' or reg.get_root() is not t:
+        error('bad path for {}'.format(reg.get_path()))
+    if t.get_node_by_path('/block1/blk/areg') is not reg \
+       or t.get_node_by_path('/block1/blk/none') is not None:
+        error('bad path index')
+    # The edits marked for the incremental layout invalidate the cached
+    # paths, before and after the relayout.
+    blk.name = 'blk2'
+    inc.mark_dirty(blk)
+    if reg.get_path() != '/block1/blk2/areg' \
+       or t.get_node_by_path('/block1/blk2/areg') is not reg \
+       or t.get_node_by_path('/block1/blk/areg') is not None:
+        error('path not updated after renaming')
+    r = tree.Reg(blk)
+    r.name = 'new'
+    r.width = 32
+    r.access = 'rw'
+    blk.children.append(r)
+    inc.mark_dirty(r)
+    for i in range(2):
+        if r.get_path() != '/block1/blk2/new' \
+           or t.get_node_by_path('/block1/blk2/new') is not r \
+           or blk.get_child('new') is not r:
+            error('path of a new child not resolved')
+        inc.relayout()
+    if blk.get_child_at(r.c_address) is not r:
+        error('new child not indexed by address')
+    # Other edits must call invalidate_caches.
+    reg._parent = t
+    tree.invalidate_caches()
+    if reg.get_path() != '/block1/areg':
+        error('path not updated after reparenting')
+    # So do the structural changes, like the unrolling of arrays.
+    t = parse_ok(srcdir + 'array2.yaml')
+    layout_ok(t)
+    name = t.children[0].name
+    el = t.children[0].children[0]
+    path = '/{}/{}/{}'.format(t.name, name, el.name)
+    if t.get_node_by_path(path) is not el:
+        error('bad path index for {}'.format(path))
+    expand_hdl.expand_hdl(t)
+    path = '/{}/{}/{}0'.format(t.name, name, el.name)
+    if t.get_node_by_path(path) is not t.children[0].children[0]:
+        error('bad path index for {}'.format(path))
+
+
+def test_children_index():
+    t = parse_ok(srcdir + 'demo.yaml')
+    layout_ok(t)
+    for c in t.children:
+        if t.get_child(c.name) is not c:
+            error('bad name lookup for {}'.format(c.get_path()))
+        for addr in [c.c_address, c.c_address + c.c_size - 1]:
+            if t.get_child_at(addr) is not c:
+                error('bad address lookup for 0x{:x}'.format(addr))
+        if isinstance(c, tree.Reg):
+            for f in c.children:
+                if f.name is not None and c.get_child(f.name) is not f:
+                    error('bad name lookup for {}'.format(f.get_path()))
+    if t.get_child('nothing') is not None \
+       or t.get_child_at(t.c_size + 0x1000) is not None:
+        error('lookup of a missing child')
+    # The indexes of the unrolled arrays are built on lookup.
+    t = parse_ok(srcdir + 'array2.yaml')
+    layout_ok(t)
+    expand_hdl.expand_hdl(t)
+    blk = t.get_child('arr1')
+    if not isinstance(blk, tree.Block):
+        error('index not updated after unrolling')
+    el = blk.get_child_at(4)
+    if el is not blk.get_child('areg11') \
+       or el.get_child(None) is not el.children[0]:
+        error('bad lookup in unrolled array')
+
+
+def test_lookup():
+    t = parse_ok(srcdir + 'lookup1.yaml')
+    layout_ok(t)
+    lk = lookup.Lookup(t)
+    for addr, path, indexes, offset, fields in [
+            (0x00, '/lookup1/r0', [], 0, ['hi']),
+            (0x04, '/lookup1/r0', [], 4, ['lo']),
+            (0x1e, '/lookup1/b/arr[3]/ar', [3], 2, [None]),
+            (0x20, '/lookup1/sm/blk/areg', [], 0, [None]),
+            (0x104, '/lookup1/gen', [], 4, [])]:
+        loc = lk.lookup(addr)
+        if loc is None or loc.path != path or loc.indexes != indexes \
+           or loc.offset != offset or [f.name for f in loc.fields] != fields:
+            error('bad lookup of 0x{:x}'.format(addr))
+    for addr in [0x08, 0x24, 0x200]:
+        if lk.lookup(addr) is not None:
+            error('0x{:x} is not mapped'.format(addr))
+
+
+def test_compiled():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for f in ['demo.yaml', 'lookup1.yaml', 'array2.yaml']:
+            t = parse_ok(srcdir + f)
+            layout_ok(t)
+            name = os.path.join(tmpdir, t.name + compiled.SUFFIX)
+            with outfile.OutputFile(name) as fd:
+                compiled.save_compiled(fd, t)
+            if not compiled.is_compiled(name) \
+               or compiled.is_compiled(srcdir + f):
+                error('compiled: file not recognized')
+            t2 = compiled.load_compiled(name)
+            ref = write_buffer()
+            sprint.sprint_cheby(ref, t, True)
+            buf = write_buffer()
+            sprint.sprint_cheby(buf, t2, True)
+            if buf.get() != ref.get():
+                error('compiled: bad tree for {}'.format(f))
+        if lookup.Lookup(compiled.load_compiled(
+                os.path.join(tmpdir, 'lookup1' + compiled.SUFFIX))) \
+                .lookup(0x20).path != '/lookup1/sm/blk/areg':
+            error('compiled: bad submap')
+        with open(name, 'rb') as fd:
+            content = fd.read()
+        for bad in [b'', content[:20], b'XXXX' + content[4:]]:
+            with open(name, 'wb') as fd:
+                fd.write(bad)
+            try:
+                compiled.load_compiled(name)
+                error('compiled: bad file not detected')
+            except compiled.CompiledException:
+                pass
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_layout_deep():
+    # Deep hierarchies must not overflow the python stack.
+    depth = sys.getrecursionlimit() + 100
+    t = tree.Root()
+    t.name = 'deep'
+    t.bus = 'wb-32-be'
+    n = t
+    for i in range(depth):
+        b = tree.Block(n)
+        b.name = 'b{}'.format(i)
+        n.children.append(b)
+        n = b
+    r = tree.Reg(n)
+    r.name = 'r'
+    r.width = 32
+    r.access = 'rw'
+    n.children.append(r)
+    layout_ok(t)
+    if t.c_size != 4 or n.c_size != 4 or r.c_address != 0:
+        error('bad layout of a deep hierarchy')
+
+
+def layout_values(n, res):
+    """Append the computed values of the tree N to RES (to compare two
+       layouts)."""
+    res.append((n.get_path(), n.c_address, n.c_size, n.c_align))
+    if isinstance(n, tree.Reg):
+        res.append((n.c_rwidth, n.c_iowidth, n.c_mwidth, n.c_nwords,
+                    n.c_type, sorted(n.c_names)))
+        for f in n.children:
+            res.append((f.get_path(), f.lo, f.hi, f.c_rwidth, f.c_iowidth))
+        return res
+    if isinstance(n, tree.Submap):
+        res.append((n.c_blk_bits, n.c_width, n.c_interface))
+        return res
+    if isinstance(n, tree.Array):
+        res.append(n.c_elsize)
+    res.append((n.c_blk_bits, n.c_sel_bits, sorted(n.c_names),
+                [c.name for c in n.c_sorted_children], n.c_addresses))
+    for c in n.children:
+        layout_values(c, res)
+    return res
+
+
+def random_edit(rng, t, num):
+    """Apply a random edit to tree T.  Return the node to be marked."""
+    nodes = []
+    todo = [t]
+    while todo:
+        n = todo.pop()
+        nodes.append(n)
+        if isinstance(n, (tree.Root, tree.Block, tree.Array)):
+            todo.extend(reversed(n.children))
+    regs = [n for n in nodes if isinstance(n, tree.Reg)]
+    noflds = [r for r in regs if all([f.name is None for f in r.children])]
+    blocks = [n for n in nodes if isinstance(n, (tree.Root, tree.Block))
+              and n.children]
+    arrs = [n for n in nodes if isinstance(n, tree.Array)]
+    kinds = ['add', 'field']
+    if arrs:
+        kinds.append('repeat')
+    if noflds:
+        kinds.append('width')
+    if [b for b in blocks if len(b.children) > 1]:
+        kinds.append('remove')
+    kind = rng.choice(kinds)
+    if kind == 'width':
+        r = rng.choice(noflds)
+        r.width = rng.choice([8, 16, 32, 64])
+        return r
+    elif kind == 'add':
+        b = rng.choice(blocks)
+        r = tree.Reg(b)
+        r.name = 'new{}'.format(num)
+        r.width = rng.choice([8, 16, 32, 64])
+        r.access = 'rw'
+        b.children.insert(rng.randint(0, len(b.children)), r)
+        return rng.choice([b, r])
+    elif kind == 'remove':
+        b = rng.choice([b for b in blocks if len(b.children) > 1])
+        del b.children[rng.randrange(len(b.children))]
+        return b
+    elif kind == 'field':
+        r = rng.choice(regs)
+        used = [f.name for f in r.children if f.name is not None]
+        if not used:
+            f = tree.Field(r)
+            f.name = 'f{}'.format(num)
+            f.lo = 0
+            f.hi = rng.randint(1, r.width - 1)
+            r.children.append(f)
+        return r
+    else:
+        a = rng.choice(arrs)
+        a.repeat = rng.randint(1, 8)
+        return a
+
+
+def test_incremental_layout():
+    # Compare the incremental layout with a full layout after random edits.
+    t1 = parse_ok(srcdir + 'lookup1.yaml')
+    t2 = parse_ok(srcdir + 'lookup1.yaml')
+    inc = layout.IncrementalLayout(t1)
+    num = 0
+    for seed in range(20):
+        rng = random.Random(seed)
+        for i in range(rng.randint(1, 5)):
+            # Same edit on both trees.
+            s = rng.random()
+            inc.mark_dirty(random_edit(random.Random(s), t1, num))
+            random_edit(random.Random(s), t2, num)
+            num += 1
+        inc.relayout()
+        layout_ok(t2)
+        if layout_values(t1, []) != layout_values(t2, []):
+            error('incremental layout differs (seed {})'.format(seed))
+    # The submap has been loaded only once.
+    if inc.submaps.misses != 1:
+        error('submap reloaded by the incremental layout')
+
+
+def test_hdl_expr():
+    # Deep expressions must not overflow the python stack.
+    e = hdltree.HDLSignal('s0')
+    for i in range(1, 5000):
+        e = hdltree.HDLOr(e, hdltree.HDLSignal('s{}'.format(i)))
+    e = hdltree.HDLNot(hdltree.HDLParen(e))
+    for gen, op in [(print_vhdl.generate_expr, ' or '),
+                    (print_verilog.generate_expr, ' | ')]:
+        res = gen(e)
+        if res.count(op) != 4999 or not res.endswith('s4999)'):
+            error('bad deep expression')
+    # Constants, including a null range.
+    for size, vhdl, verilog in [(4, '"0101"', "4'b0101"),
+                                (0, '""', "0'b")]:
+        e = hdltree.HDLConst(5, size)
+        if print_vhdl.generate_expr(e) != vhdl \
+           or print_verilog.generate_expr(e) != verilog:
+            error('bad constant of size {}'.format(size))
+
+
+def test_hdl_dispatch():
+    d = hdltree.Dispatcher('test')
+    f = d.register(hdltree.HDLObject)(lambda n: 'obj')
+    d.register(hdltree.HDLPort)(lambda n: 'port')
+    if d.lookup(hdltree.HDLSignal('s')) is not f \
+       or d.lookup(hdltree.HDLPort('p'))(None) != 'port':
+        error('bad hdl dispatch')
+    try:
+        d.lookup(hdltree.HDLComment('c'))
+        error('unhandled hdl node not detected')
+    except AssertionError:
+        pass
+
+
 def test_hdl():
     fd = write_null()
     for f in ['simple_reg3.yaml', 'simple_reg4_ro.yaml',
@@ -171,6 +572,454 @@ def test_hdl():
         print_vhdl.print_vhdl(fd, h)
 
 
+def decoder_elements(dec, res):
+    "Append the elements of decode tree DEC to RES."
+    if isinstance(dec, gen_hdl.DecodeSwitch):
+        for _, sub in dec.choices:
+            decoder_elements(sub, res)
+    else:
+        res.append(dec.el)
+    return res
+
+
+def test_decoder():
+    # Each element appears once in the decode tree, in address order.
+    for f in ['simple_reg3.yaml', 'wb_slave_vic.cheby',
+              'inter-mt/mt_cpu_xb.cheby', 'inter-mt/mt_cpu_xb-include.cheby']:
+        t = parse_ok(srcdir + f)
+        layout_ok(t)
+        expand_hdl.expand_hdl(t)
+        els = decoder_elements(gen_hdl.build_decoder(t), [])
+        ref = sorted(gen_hdl.gather_children(t), key=lambda x: x.c_address)
+        if [id(e) for e in els] != [id(e) for e in ref]:
+            error('bad decode tree for {}'.format(f))
+
+
+def test_hdl_pipeline():
+    for f in ['pipeline1.yaml', 'simple_reg3.yaml', 'wb_slave_vic.cheby']:
+        for p in ['none', 'rd', 'wr', 'all']:
+            if verbose:
+                print('test hdl pipeline: {} {}'.format(f, p))
+            t = parse_ok(srcdir + f)
+            t.x_hdl = {'pipeline': p}
+            layout_ok(t)
+            expand_hdl.expand_hdl(t)
+            gen_name.gen_name_root(t)
+            h = gen_hdl.generate_hdl(t)
+            buf = write_buffer()
+            print_vhdl.print_vhdl(buf, h)
+            print_verilog.print_verilog(write_null(), h)
+            for sig, path in [('wr_req_d0', 'wr'), ('rd_dat_d0', 'rd')]:
+                if (sig in buf.get()) != (path in t.h_pipeline):
+                    error('bad {} pipeline for {}'.format(p, f))
+    t = parse_ok(srcdir + 'simple_reg3.yaml')
+    t.x_hdl = {'pipeline': 'both'}
+    layout_ok(t)
+    expand_hdl.expand_hdl(t)
+    gen_name.gen_name_root(t)
+    try:
+        gen_hdl.generate_hdl(t)
+        error('incorrect pipeline not detected')
+    except gen_hdl.HdlError:
+        pass
+
+
+def test_hdl_read_mux():
+    for n, fanin, sizes in [(10, 4, [4, 3, 3]), (9, 3, [3, 3, 3]),
+                            (3, 16, [3])]:
+        groups = gen_hdl.balanced_groups(range(n), lambda x: 1, fanin)
+        if [len(g) for g in groups] != sizes:
+            error('bad read mux groups for {} {}'.format(n, fanin))
+    for fanin in [2, 3, 4, 16]:
+        if verbose:
+            print('test hdl read mux: {}'.format(fanin))
+        t = parse_ok(srcdir + 'read_mux1.yaml')
+        t.x_hdl = {'read-mux-fanin': fanin}
+        layout_ok(t)
+        expand_hdl.expand_hdl(t)
+        gen_name.gen_name_root(t)
+        h = gen_hdl.generate_hdl(t)
+        print_vhdl.print_vhdl(write_null(), h)
+        print_verilog.print_verilog(write_null(), h)
+        # The sub-muxes decode each readable register once.
+        regs = [r for r in gen_hdl.gather_children(t)
+                if isinstance(r, tree.Reg) and r.access != 'wo']
+        els = []
+        for r in regs:
+            decoder_elements(gen_hdl.prune_decoder(t.h_decoder,
+                                                   set([id(r)])), els)
+        if [id(e) for e in els] != [id(r) for r in regs]:
+            error('bad read sub-mux for {}'.format(fanin))
+    # The RAMs are still acked in one cycle.
+    for f in ['read_mux1.yaml', 'read_mux2.yaml']:
+        if verbose:
+            print('test hdl read mux: {}'.format(f))
+        t = parse_ok(srcdir + f)
+        layout_ok(t)
+        expand_hdl.expand_hdl(t)
+        gen_name.gen_name_root(t)
+        h = gen_hdl.generate_hdl(t)
+        print_vhdl.print_vhdl(write_null(), h)
+        acks = {}
+        for s in hdl_walk(h.stmts):
+            if isinstance(s, hdltree.HDLChoice) and s.stmts \
+               and isinstance(s.stmts[0], hdltree.HDLComment):
+                kind = s.stmts[0].comment.split()[0]
+                acks.setdefault(kind, set()).update(
+                    [hdl_name(a.expr) for a in s.stmts
+                     if isinstance(a, hdltree.HDLAssign)
+                     and hdl_name(a.target) == 'rd_ack_int'])
+        if acks.get('RAM') != set(['rd_ack1_int']) \
+           or 'rd_ack1_int' in acks.get('r0', []):
+            error('bad RAM read ack in {}'.format(f))
+        ram_acks = [s for s in hdl_walk(h.stmts)
+                    if isinstance(s, hdltree.HDLAssign)
+                    and hdl_name(s.target) == 'rd_ack1_int']
+        if [s for s in ram_acks if not isinstance(s.expr, hdltree.HDLBit)]:
+            error('RAM read ack delayed in {}'.format(f))
+    t = parse_ok(srcdir + 'read_mux1.yaml')
+    t.x_hdl = {'read-mux-fanin': 1}
+    layout_ok(t)
+    expand_hdl.expand_hdl(t)
+    gen_name.gen_name_root(t)
+    try:
+        gen_hdl.generate_hdl(t)
+        error('incorrect read-mux-fanin not detected')
+    except gen_hdl.HdlError:
+        pass
+
+
+def hdl_name(e):
+    return getattr(e, 'name', None)
+
+
+def hdl_walk(stmts):
+    """Yield the statements STMTS and all their nested statements."""
+    for s in stmts:
+        yield s
+        for attr in ['stmts', 'choices', 'rst_stmts', 'sync_stmts',
+                     'then_stmts', 'else_stmts']:
+            sub = getattr(s, attr, None)
+            if sub:
+                for s1 in hdl_walk(sub):
+                    yield s1
+
+
+def check_axi4lite_handshake(h, ack, valid, ready):
+    """Check the response VALID is set by ACK and held until READY."""
+    for s in h.stmts:
+        if not isinstance(s, hdltree.HDLSync):
+            continue
+        if valid not in [hdl_name(a.target) for a in s.rst_stmts]:
+            continue
+        wr_if = s.sync_stmts[0]
+        assert hdl_name(wr_if.cond.left) == ack
+        assert [(hdl_name(a.target), a.expr.val)
+                for a in wr_if.then_stmts[:1]] == [(valid, 1)]
+        resp_if = wr_if.else_stmts[0]
+        assert hdl_name(resp_if.cond.left) == ready
+        assert [(hdl_name(a.target), a.expr.val)
+                for a in resp_if.then_stmts] == [(valid, 0)]
+        assert resp_if.else_stmts is None
+        return
+    error('no process for {}'.format(valid))
+
+
+def test_hdl_axi4lite():
+    for f in ['axi4lite1.yaml', 'axi4lite2.yaml']:
+        if verbose:
+            print('test hdl axi4-lite: {}'.format(f))
+        t = parse_ok(srcdir + f)
+        layout_ok(t)
+        expand_hdl.expand_hdl(t)
+        gen_name.gen_name_root(t)
+        h = gen_hdl.generate_hdl(t)
+        print_vhdl.print_vhdl(write_null(), h)
+        print_verilog.print_verilog(write_null(), h)
+        # The AXI4-Lite submaps remember the channels already accepted.
+        decls = set([hdl_name(d) for d in h.decls])
+        for n in t.children:
+            if isinstance(n, tree.Submap):
+                for flag in ['aw_done', 'w_done', 'ar_done']:
+                    assert '{}_{}'.format(n.name, flag) in decls
+        if t.bus != 'axi4-lite-32':
+            continue
+        # The channels are accepted by the (combinational) ack.
+        assigns = dict([(hdl_name(s.target), hdl_name(s.expr))
+                        for s in h.stmts
+                        if isinstance(s, hdltree.HDLAssign)])
+        assert assigns['awready'] == 'wr_ack_int'
+        assert assigns['wready'] == 'wr_ack_int'
+        assert assigns['arready'] == 'rd_ack_int'
+        # The responses are held until accepted.
+        check_axi4lite_handshake(h, 'wr_ack_int', 'bvalid_int', 'bready')
+        check_axi4lite_handshake(h, 'rd_ack_int', 'rvalid_int', 'rready')
+        # The registers are written per byte lane.
+        lanes = [s for s in hdl_walk(h.stmts)
+                 if isinstance(s, hdltree.HDLIfElse)
+                 and isinstance(s.cond.left, hdltree.HDLIndex)
+                 and hdl_name(s.cond.left.prefix) == 'wstrb']
+        if not lanes:
+            error('register writes not masked by wstrb in {}'.format(f))
+    # Unsupported features with an AXI4-Lite bus.
+    for f, x_hdl in [('pipeline1.yaml', None),
+                     ('axi4lite1.yaml', {'pipeline': 'all'}),
+                     ('axi4lite1.yaml', {'read-mux-fanin': 2})]:
+        t = parse_ok(srcdir + f)
+        t.bus = 'axi4-lite-32'
+        if x_hdl is not None:
+            t.x_hdl = x_hdl
+        layout_ok(t)
+        expand_hdl.expand_hdl(t)
+        gen_name.gen_name_root(t)
+        try:
+            gen_hdl.generate_hdl(t)
+            error('unsupported feature not detected in {}'.format(f))
+        except gen_hdl.HdlError:
+            pass
+
+
+def test_cache():
+    cachedir = tempfile.mkdtemp()
+    try:
+        for f in ['demo.yaml', 'inter-mt/mt_cpu_xb.cheby']:
+            if verbose:
+                print('test cache: {}'.format(f))
+            # Reference
+            t = parse_ok(srcdir + f)
+            layout_ok(t)
+            ref = write_buffer()
+            pprint.pprint_cheby(ref, t)
+            # First parse fills the cache, the second one hits it.
+            for hits in [0, 1]:
+                c = cache.Cache(cachedir)
+                t = parser.parse_yaml(srcdir + f, c)
+                if c.hits != hits:
+                    error('unexpected cache hits for {}'.format(f))
+                layout_ok(t)
+                buf = write_buffer()
+                pprint.pprint_cheby(buf, t)
+                if buf.get() != ref.get():
+                    error('cache mismatch for {}'.format(f))
+        # Eviction
+        c = cache.Cache(cachedir, max_size=0)
+        c.evict()
+        if c.entries():
+            error('cache not evicted')
+    finally:
+        shutil.rmtree(cachedir)
+
+
+def test_depfile():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Copy the files, as an input is modified.  The names contain
+        # characters special for make.
+        indir = os.path.join(tmpdir, 'in $dir#1')
+        os.mkdir(indir)
+        for f in ['submap4.yaml', 'simple_reg1.yaml']:
+            shutil.copy(srcdir + f, indir)
+        top = os.path.join(indir, 'submap4.yaml')
+        t = parse_ok(top)
+        submaps = layout.SubmapRegistry()
+        layout.layout_cheby(t, submaps)
+        inputs = [top] + submaps.filenames
+        if len(inputs) != 2:
+            error('unexpected depfile inputs {}'.format(inputs))
+        out = os.path.join(tmpdir, 'out file$(x)#2.txt')
+        dep = os.path.join(tmpdir, 'submap4.d')
+        depfile.write_depfile(dep, [out], inputs, 'opts')
+        with open(dep) as fd:
+            content = fd.read()
+        if 'out\\ file$$(x)\\#2.txt:' not in content \
+           or 'in\\ $$dir\\#1' not in content:
+            error('depfile: names not escaped')
+        if depfile.read_depfile(dep)[1:] != ([out], inputs):
+            error('cannot read depfile')
+        # The target doesn't exist.
+        if depfile.is_up_to_date(dep, 'opts'):
+            error('depfile: missing target is up to date')
+        open(out, 'w').close()
+        if not depfile.is_up_to_date(dep, 'opts'):
+            error('depfile: target is not up to date')
+        if depfile.is_up_to_date(dep, 'other opts'):
+            error('depfile: options change not detected')
+        with open(inputs[1], 'a') as fd:
+            fd.write('\n')
+        if depfile.is_up_to_date(dep, 'opts'):
+            error('depfile: submap change not detected')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_outfile():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        name = os.path.join(tmpdir, 'out.txt')
+        t = parse_ok(srcdir + 'demo.yaml')
+        layout_ok(t)
+        # Created, then unchanged, then modified.
+        for content, changed in [('', True), ('', False), ('--\n', True)]:
+            fd = outfile.OutputFile(name)
+            sprint.sprint_cheby(fd, t, True)
+            fd.write(content)
+            if fd.close() != changed:
+                error('outfile: unexpected change status')
+            ref = write_buffer()
+            sprint.sprint_cheby(ref, t, True)
+            ref.write(content)
+            if open(name).read() != ref.get():
+                error('outfile: bad content')
+        if os.listdir(tmpdir) != ['out.txt']:
+            error('outfile: temporary file not removed')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def run_cheby(args):
+    """Run the cheby command with ARGS, return the exit status, the output
+       and the error output."""
+    p = subprocess.Popen([sys.executable, 'cheby.py'] + args,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         universal_newlines=True)
+    out, err = p.communicate()
+    return p.returncode, out, err
+
+
+def test_jobs():
+    files = [srcdir + f for f in ['simple_reg1.yaml', 'err_bus_name.yaml',
+                                  'simple_reg2.yaml', 'simple_reg3.yaml']]
+    ref = ''
+    for f in files[0:1] + files[2:]:
+        status, out, _ = run_cheby(['--gen-vhdl', f])
+        if status != 0:
+            error('jobs: cannot generate {}'.format(f))
+        ref += out
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for jobs in ['1', '3']:
+            if verbose:
+                print('test jobs: {}'.format(jobs))
+            # The outputs are in the order of the files, all the errors are
+            # reported and each file is timed only when run in parallel.
+            status, out, err = run_cheby(['-j', jobs, '--gen-vhdl'] + files)
+            if status != 2 or out != ref:
+                error('jobs: bad output for -j {}'.format(jobs))
+            lines = err.splitlines()
+            if jobs == '1':
+                expected = files[1:2]
+            else:
+                expected = files[0:2] + files[1:]
+            if [l.split(':')[0] for l in lines] != expected \
+               or 'layout error' not in lines[expected.index(files[1])]:
+                error('jobs: bad errors for -j {}'.format(jobs))
+            # One output file per input.
+            out = os.path.join(tmpdir, jobs + '_{name}.vhd')
+            status, _, _ = run_cheby(['-j', jobs, '--gen-vhdl', '-o', out]
+                                     + files[0:1] + files[2:])
+            names = ['simple_reg1', 'simple_reg2', 'simple_reg3']
+            if status != 0 or \
+               sorted([n for n in os.listdir(tmpdir)
+                       if n.startswith(jobs + '_')]) != \
+               [jobs + '_' + n + '.vhd' for n in names]:
+                error('jobs: bad output files for -j {}'.format(jobs))
+            content = ''
+            for n in names:
+                with open(out.format(name=n)) as fd:
+                    content += fd.read()
+            if content != ref:
+                error('jobs: bad output content for -j {}'.format(jobs))
+        # --time-stages also times each file.
+        status, _, err = run_cheby(['--time-stages', '--gen-vhdl', files[0]])
+        last = err.splitlines()[-1]
+        if status != 0 or not last.startswith(files[0] + ': ') \
+           or not last.endswith('s'):
+            error('jobs: file not timed with --time-stages')
+        # The same output can't be used for several files.
+        for opt in ['-o', '--depfile']:
+            status, _, err = run_cheby(
+                ['--gen-vhdl', '-o', os.path.join(tmpdir, '{name}.vhd'),
+                 opt, os.path.join(tmpdir, 'out')] + files[0:1] + files[2:])
+            if status != 2 or '{name}' not in err:
+                error('jobs: {} without {{name}} not rejected'.format(opt))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_output_dir():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for f, gens in [
+                ('gena/CRegs.cheby',
+                 [(['--gen-vhdl'], 'cregs.vhd'),
+                  (['--gen-verilog'], 'cregs.v'),
+                  (['--print-c', '-'], 'cregs.h'),
+                  (['--print-c-check-layout'], 'cregs.c'),
+                  (['--gen-gena-memmap'], 'MemMap_cregs.vhd'),
+                  (['--gen-gena-regctrl'], 'RegCtrl_cregs.vhd')]),
+                ('simple_reg3.yaml',
+                 [(['--gen-encore'], 'sreg2.csv'),
+                  (['--gen-vhdl'], 'sreg2.vhd')])]:
+            if verbose:
+                print('test output dir: {}'.format(f))
+            # All the files are generated in one run, with the same content
+            # as the output of separate runs.
+            outdir = os.path.join(tmpdir, 'out')
+            args = ['--output-dir', outdir]
+            for opts, _ in gens:
+                args.extend(opts)
+            status, out, _ = run_cheby(args + [srcdir + f])
+            if status != 0 or out != '' \
+               or sorted(os.listdir(outdir)) != sorted([n for _, n in gens]):
+                error('output dir: bad files for {}'.format(f))
+            for opts, name in gens:
+                _, ref, _ = run_cheby(opts + [srcdir + f])
+                with open(os.path.join(outdir, name)) as fd:
+                    if fd.read() != ref:
+                        error('output dir: bad content of {}'.format(name))
+            shutil.rmtree(outdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_timing():
+    timer = timing.StageTimer()
+    ual.create_ual_access(None, srcdir + 'demo.yaml', timer)
+    if [s[0] for s in timer.stages] != ['parse_yaml', 'layout_cheby']:
+        error('timing: bad stages')
+    buf = write_buffer()
+    timer.report(buf)
+    if 'layout_cheby' not in buf.get():
+        error('timing: bad report')
+    if timing.tracemalloc is not None:
+        # Tracing is stopped after the stages, and the tracing of the
+        # caller is kept.
+        if timing.tracemalloc.is_tracing():
+            error('timing: tracemalloc not stopped')
+        timing.tracemalloc.start()
+        try:
+            data = [list(range(100))]
+            with timer.stage('caller'):
+                pass
+            if not timing.tracemalloc.is_tracing() \
+               or timing.tracemalloc.get_object_traceback(data[0]) is None:
+                error('timing: tracing of the caller modified')
+        finally:
+            timing.tracemalloc.stop()
+    if timing.tracemalloc is not None \
+       and hasattr(timing.tracemalloc, 'reset_peak'):
+        # The peak of a stage includes the peak before an inner stage.
+        timer = timing.StageTimer()
+        with timer.stage('outer'):
+            data = bytearray(1 << 22)
+            del data
+            with timer.stage('inner'):
+                data = [0] * 10
+        peaks = dict([(s[0], s[2]) for s in timer.stages])
+        if peaks['outer'] < (1 << 22) or peaks['inner'] >= (1 << 20):
+            error('timing: bad peak for nested stages')
+
+
 def test_self():
     """Auto-test"""
     def test(func, func_name):
@@ -380,9 +1229,30 @@ def main():
     try:
         test_self()
         test_parser()
+        test_parser_events()
         test_layout()
+        test_submaps()
         test_print()
+        test_cache()
+        test_depfile()
+        test_outfile()
+        test_jobs()
+        test_output_dir()
+        test_timing()
+        test_array_views()
+        test_paths()
+        test_children_index()
+        test_lookup()
+        test_compiled()
+        test_layout_deep()
+        test_incremental_layout()
+        test_hdl_expr()
+        test_hdl_dispatch()
         test_hdl()
+        test_decoder()
+        test_hdl_pipeline()
+        test_hdl_read_mux()
+        test_hdl_axi4lite()
         test_gena()
         test_gena_regctrl_err()
         test_gena2cheby()